@@ -0,0 +1,273 @@
+"""
+Async (ASGI-native) versions of the hot self-service endpoints.
+
+DRF views are synchronous, so under an ASGI server every request to them
+goes through the thread-sensitive sync adapter. These plain Django async
+views authenticate with CachedJWTAuthentication.aauthenticate, query with
+the async ORM and return the same bodies as their DRF counterparts. The
+login endpoint awaits the password hashing pool rather than a thread.
+"""
+import base64
+import functools
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import aauthenticate, get_user_model
+from django.contrib.auth.models import update_last_login
+from django.db.models import Q
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
+from rest_framework import status
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.urls import replace_query_param
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.serializers import TokenObtainSerializer, TokenRefreshSerializer
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from apps.common.audit import apending_history
+from apps.common.models import Subscription, SubscriptionHistory
+from apps.users.hashing import PasswordHashingBusy
+from apps.users.snapshots import aget_user_snapshot, user_from_snapshot
+from .authentication import CachedJWTAuthentication
+from .caching import acached_user_response
+from .exceptions import ServiceBusy
+from .metrics import serialization
+from .projection import compile_field_plan, project_row
+from .serializers import SubscriptionHistorySerializer, SubscriptionSerializer, UserSerializer
+from .views import CheckTrialStatusView, SubscriptionHistoryViewSet
+
+User = get_user_model()
+
+authentication = CachedJWTAuthentication()
+
+
+def render(data, status=status.HTTP_200_OK):
+    return HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+
+
+def render_exception(request, exc):
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    response = render(detail, status=exc.status_code)
+    if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+        response['WWW-Authenticate'] = authentication.authenticate_header(request)
+    if isinstance(exc, ServiceBusy):
+        response['Retry-After'] = str(exc.retry_after)
+    return response
+
+
+def parse_credentials(request, fields):
+    """
+    Parse a JSON body holding the given string fields, returning the values
+    and the field errors the DRF serializers would report
+    """
+    try:
+        data = json.loads(request.body or b'{}')
+    except ValueError as e:
+        return None, {'detail': f'JSON parse error - {e}'}
+    if not isinstance(data, dict):
+        return None, {'non_field_errors': ['Invalid data. Expected a dictionary, but got list.']}
+    
+    errors = {}
+    for field in fields:
+        if data.get(field) is None:
+            errors[field] = ['This field is required.']
+        elif not str(data[field]).strip():
+            errors[field] = ['This field may not be blank.']
+    return data, errors
+
+
+def authenticated(view):
+    """
+    Authenticate the request and require a user, as IsAuthenticated does for the DRF views
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            result = await authentication.aauthenticate(request)
+            if result is None:
+                raise NotAuthenticated()
+        except APIException as exc:
+            return render_exception(request, exc)
+        
+        request.user, request.auth = result
+        return await view(request, *args, **kwargs)
+    
+    return wrapper
+
+
+@csrf_exempt
+@require_POST
+async def login(request):
+    """
+    Async version of TokenObtainPairView, checking the password on the
+    password hashing pool without holding a thread
+    """
+    data, errors = parse_credentials(request, (User.USERNAME_FIELD, 'password'))
+    if errors:
+        return render(errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        user = await aauthenticate(
+            request,
+            **{User.USERNAME_FIELD: str(data[User.USERNAME_FIELD]), 'password': str(data['password'])}
+        )
+    except PasswordHashingBusy:
+        return render_exception(request, ServiceBusy())
+    
+    if not api_settings.USER_AUTHENTICATION_RULE(user):
+        return render_exception(request, AuthenticationFailed(
+            TokenObtainSerializer.default_error_messages['no_active_account'], 'no_active_account'
+        ))
+    
+    refresh = RefreshToken.for_user(user)
+    if api_settings.UPDATE_LAST_LOGIN:
+        await sync_to_async(update_last_login)(None, user)
+    
+    return render({'refresh': str(refresh), 'access': str(refresh.access_token)})
+
+
+@csrf_exempt
+@require_POST
+async def refresh(request):
+    """
+    Async version of TokenRefreshView, checking the user against its cached
+    snapshot instead of loading the row
+    """
+    data, errors = parse_credentials(request, ('refresh',))
+    if errors:
+        return render(errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        token = RefreshToken(str(data['refresh']))
+    except TokenError as e:
+        return render_exception(request, InvalidToken(e.args[0]))
+    
+    user_id = token.payload.get(api_settings.USER_ID_CLAIM)
+    if user_id:
+        snapshot = await aget_user_snapshot(User._meta.pk.to_python(user_id))
+        user = user_from_snapshot(snapshot) if snapshot is not None else None
+        if not api_settings.USER_AUTHENTICATION_RULE(user):
+            return render_exception(request, AuthenticationFailed(
+                TokenRefreshSerializer.default_error_messages['no_active_account'], 'no_active_account'
+            ))
+    
+    response = {'access': str(token.access_token)}
+    if api_settings.ROTATE_REFRESH_TOKENS:
+        token.set_jti()
+        token.set_exp()
+        token.set_iat()
+        response['refresh'] = str(token)
+    
+    return render(response)
+
+
+@require_GET
+@authenticated
+async def me(request):
+    """
+    Async version of UserViewSet.me
+    """
+    async def build():
+        return UserSerializer(request.user, context={'request': request}).data, status.HTTP_200_OK
+    
+    return await acached_user_response(request, 'me', build)
+
+
+@require_GET
+@authenticated
+async def my_subscription(request):
+    """
+    Async version of SubscriptionViewSet.my_subscription
+    """
+    async def build():
+        subscription = await Subscription.objects.select_related('catalog_plan').filter(user_id=request.user.pk).afirst()
+        if subscription is None:
+            return {"detail": "You don't have any subscription."}, status.HTTP_404_NOT_FOUND
+        subscription.user = request.user
+        return SubscriptionSerializer(subscription, context={'request': request}).data, status.HTTP_200_OK
+    
+    return await acached_user_response(request, 'my-subscription', build)
+
+
+@require_GET
+@authenticated
+async def trial_status(request):
+    """
+    Async version of CheckTrialStatusView.get
+    """
+    user = request.user
+    now = timezone.now()
+    
+    variant = ''
+    if user.is_on_trial and user.trial_end_date:
+        variant = str((user.trial_end_date - now).days) if user.trial_end_date > now else 'expired'
+    
+    async def build():
+        return CheckTrialStatusView().build(user, now)
+    
+    return await acached_user_response(request, 'trial-status', build, variant)
+
+
+def _encode_cursor(row):
+    position = f"{row['created_at'].isoformat()}|{row['id']}"
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def _decode_cursor(cursor):
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return parse_datetime(created_at), int(pk)
+    except (TypeError, ValueError):
+        return None
+
+
+@functools.cache
+def _history_plan():
+    return compile_field_plan(SubscriptionHistorySerializer(), SubscriptionHistoryViewSet.projection_sources)
+
+
+@require_GET
+@authenticated
+async def subscription_history(request):
+    """
+    Async version of the SubscriptionHistoryViewSet list, paginated forward
+    on (created_at, id) like its cursor pagination
+    """
+    plan = _history_plan()
+    queryset = SubscriptionHistory.objects.order_by('-created_at', '-id')
+    if not request.user.is_staff:
+        queryset = queryset.filter(subscription__user_id=request.user.pk)
+    
+    cursor = request.GET.get('cursor')
+    if cursor:
+        position = _decode_cursor(cursor)
+        if position is None or position[0] is None:
+            return render({'detail': 'Invalid cursor'}, status=status.HTTP_404_NOT_FOUND)
+        created_at, pk = position
+        queryset = queryset.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk))
+    
+    page_size = settings.REST_FRAMEWORK['PAGE_SIZE']
+    rows = [row async for row in queryset.values(*{lookup for _, lookup, _ in plan})[:page_size + 1]]
+    
+    next_url = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_url = replace_query_param(request.build_absolute_uri(), 'cursor', _encode_cursor(rows[-1]))
+    
+    with serialization():
+        results = [project_row(row, plan) for row in rows]
+    if not cursor:
+        pending = await apending_history(request.user)
+        results[:0] = SubscriptionHistorySerializer(pending, many=True).data
+    
+    return render({
+        'next': next_url,
+        'previous': None,
+        'results': results,
+    })
@@ -0,0 +1,66 @@
+from asgiref.sync import sync_to_async
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from apps.users.snapshots import aget_user_snapshot, get_user_snapshot, user_from_snapshot
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that resolves the user from a cached snapshot instead
+    of loading the user row on every request.
+    
+    The snapshot holds every column the views read (staff flags, trial dates,
+    subscription status...). The password hash is not part of it and is only
+    fetched, as a deferred field, when a view actually checks or changes it.
+    """
+    
+    def get_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Revocation compares against the password hash, which snapshots omit
+            return super().get_user(validated_token)
+        
+        snapshot = get_user_snapshot(self.get_user_id(validated_token))
+        return self.user_from_snapshot(snapshot)
+    
+    async def aauthenticate(self, request):
+        """
+        Async counterpart of authenticate() for plain Django async views
+        """
+        header = self.get_header(request)
+        if header is None:
+            return None
+        
+        raw_token = self.get_raw_token(header)
+        if raw_token is None:
+            return None
+        
+        validated_token = self.get_validated_token(raw_token)
+        return await self.aget_user(validated_token), validated_token
+    
+    async def aget_user(self, validated_token):
+        if api_settings.CHECK_REVOKE_TOKEN:
+            return await sync_to_async(super().get_user)(validated_token)
+        
+        snapshot = await aget_user_snapshot(self.get_user_id(validated_token))
+        return self.user_from_snapshot(snapshot)
+    
+    def get_user_id(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+        
+        # Token claims may carry the id as a string; snapshots are keyed on the pk value
+        return self.user_model._meta.pk.to_python(user_id)
+    
+    def user_from_snapshot(self, snapshot):
+        if snapshot is None:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        
+        if api_settings.CHECK_USER_IS_ACTIVE and not snapshot['is_active']:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        
+        return user_from_snapshot(snapshot)
@@ -0,0 +1,85 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from apps.common.cache import aget_user_version, get_user_version
+from apps.common.utils import CacheStats
+
+response_cache_stats = CacheStats(('not_modified', 'hits', 'misses'))
+
+
+def _validators(name, user_id, version, variant):
+    """Return the ETag, Last-Modified timestamp and cache key of a representation"""
+    etag = quote_etag(f'{name}-{user_id}-{version}-{variant}')
+    last_modified = version // 1_000_000
+    key = f'user-response:{name}:{user_id}:{version}:{variant}'
+    return etag, last_modified, key
+
+
+def _set_validators(response, etag, last_modified):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def cached_user_response(request, name, build, variant=''):
+    """
+    Serve a per-user representation keyed on the user's data version.
+    
+    ``build`` returns ``(data, status)`` and only runs on a cache miss.
+    ``variant`` distinguishes representations that also depend on something
+    other than stored data, such as the current time. Requests whose
+    If-None-Match / If-Modified-Since match get a 304 without any
+    serialization work.
+    """
+    user_id = request.user.pk
+    etag, last_modified, key = _validators(name, user_id, get_user_version(user_id), variant)
+    
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        response_cache_stats.incr('not_modified')
+        return not_modified
+    
+    cached = cache.get(key)
+    if cached is None:
+        response_cache_stats.incr('misses')
+        cached = build()
+        cache.set(key, cached, timeout=settings.USER_RESPONSE_CACHE_TIMEOUT)
+    else:
+        response_cache_stats.incr('hits')
+    data, status = cached
+    
+    return _set_validators(Response(data, status=status), etag, last_modified)
+
+
+async def acached_user_response(request, name, build, variant=''):
+    """
+    Async counterpart of cached_user_response for plain Django async views.
+    
+    ``build`` is a coroutine function. Representations are shared with the
+    sync views and rendered with DRF's JSON renderer so both return the same body.
+    """
+    user_id = request.user.pk
+    etag, last_modified, key = _validators(name, user_id, await aget_user_version(user_id), variant)
+    
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        response_cache_stats.incr('not_modified')
+        return not_modified
+    
+    cached = await cache.aget(key)
+    if cached is None:
+        response_cache_stats.incr('misses')
+        cached = await build()
+        await cache.aset(key, cached, timeout=settings.USER_RESPONSE_CACHE_TIMEOUT)
+    else:
+        response_cache_stats.incr('hits')
+    data, status = cached
+    
+    response = HttpResponse(JSONRenderer().render(data), status=status, content_type='application/json')
+    return _set_validators(response, etag, last_modified)
@@ -0,0 +1,229 @@
+"""
+Adaptive concurrency limits per route class, for load shedding.
+
+Each route class (auth, self-service reads, writes, staff) has a limit on
+the requests it may have in flight in a process, adapted AIMD-style from
+the latency it observes. Alongside each class's limit, the class keeps a
+no-load latency for each of its routes (URL names): the lowest recent
+latency, allowed to drift slowly upwards. Routes of one class can differ
+widely in cost, e.g. login hashes a password and token refresh does not,
+so each request is compared with its own route's baseline.
+
+- A request that takes more than LOAD_SHEDDING_LATENCY_TOLERANCE times
+  its route's no-load latency, or fails with a server error, signals congestion. The
+  limit is then multiplied by LOAD_SHEDDING_BACKOFF, at most once per
+  latency window.
+- Any other request grows the limit by about one per window while the
+  limit is in use.
+
+Classes also share the process's LOAD_SHEDDING_CAPACITY by priority. A
+class is admitted only while the process has fewer requests in flight than
+its share of that capacity. Lower priority classes are therefore turned
+away first, and the headroom left above them keeps login and token refresh
+available under overload.
+
+In-process limits only bind when a process serves requests concurrently
+(gthread or ASGI workers). A sync worker has one request in flight, and
+its backlog waits in the server's queue instead. So a request is also shed
+when it has waited in front of the process longer than its class's share
+of LOAD_SHEDDING_MAX_QUEUE_TIME, as measured from the X-Request-Start
+header set by the proxy.
+"""
+import functools
+import threading
+import time
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+# Route classes by priority, with the share of the process capacity each
+# may fill
+ROUTE_CLASSES = {
+    'auth': 1.0,
+    'reads': 0.9,
+    'writes': 0.75,
+    'staff': 0.5,
+}
+
+# URL names of the login and token refresh endpoints, sync and async
+AUTH_ROUTES = {
+    'token_obtain_pair', 'token_refresh', 'token_verify',
+    'async-token-obtain-pair', 'async-token-refresh',
+}
+
+# URL names of the staff-only endpoints
+STAFF_ROUTES = {
+    'user-import', 'user-import-status', 'export', 'analytics-mrr', 'analytics-trial-conversion', 'analytics-churn',
+}
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Weight of a new sample when it raises the no-load latency
+NOLOAD_DRIFT = 0.005
+
+
+@functools.lru_cache(maxsize=4096)
+def _route(path):
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return None, None
+    return match.url_name, match.namespace
+
+
+def route_name(request):
+    """
+    The URL name of a request, or None when it does not resolve
+    """
+    return _route(request.path_info)[0]
+
+
+def queue_time(request, now=None):
+    """
+    Seconds the request waited between the proxy and this process, from an
+    X-Request-Start header of seconds, milliseconds or microseconds since
+    the epoch (optionally prefixed with ``t=``), or None without one
+    """
+    value = request.headers.get('X-Request-Start', '')
+    if value.startswith('t='):
+        value = value[2:]
+    try:
+        start = float(value)
+    except ValueError:
+        return None
+    # Tell the units apart by magnitude
+    while start > 1e11:
+        start /= 1000
+    return max(0.0, (time.time() if now is None else now) - start)
+
+
+def classify(request):
+    """
+    The route class of a request, from its URL name and method
+    """
+    name, namespace = _route(request.path_info)
+    if name in AUTH_ROUTES:
+        return 'auth'
+    if name in STAFF_ROUTES or namespace == 'admin':
+        return 'staff'
+    if request.method in SAFE_METHODS:
+        return 'reads'
+    return 'writes'
+
+
+class AdaptiveLimit:
+    """
+    Concurrency limit of one route class, adapted from its latency
+    """
+
+    def __init__(self, initial, minimum, maximum):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.noload_latency = {}
+        self.last_decrease = 0.0
+        self.admitted = 0
+        self.rejected = 0
+
+    def on_sample(self, latency, in_flight, failed, now, route=None):
+        """
+        Adapt the limit to a finished request of ``route`` that started with
+        ``in_flight`` requests of its class running
+        """
+        noload_latency = self.noload_latency.get(route)
+        if noload_latency is None or latency < noload_latency:
+            noload_latency = latency
+        else:
+            noload_latency += (latency - noload_latency) * NOLOAD_DRIFT
+        self.noload_latency[route] = noload_latency
+
+        congested = failed or latency > noload_latency * settings.LOAD_SHEDDING_LATENCY_TOLERANCE
+        if congested:
+            # Back off once per window, not once per slow request of that window
+            if now - self.last_decrease >= latency:
+                self.limit = max(self.minimum, self.limit * settings.LOAD_SHEDDING_BACKOFF)
+                self.last_decrease = now
+        elif in_flight >= self.limit / 2:
+            # Only grow while the limit is in use, so idle periods do not inflate it
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+
+class Ticket:
+    """
+    An admitted request; release() it with the outcome once it is done
+    """
+
+    def __init__(self, limiter, route_class, route, in_flight):
+        self.limiter = limiter
+        self.route_class = route_class
+        self.route = route
+        self.in_flight = in_flight
+        self.started = time.monotonic()
+
+    def release(self, failed=False):
+        self.limiter.release(self, failed)
+
+
+class ConcurrencyLimiter:
+    """
+    Per-process admission control over the route classes
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.limits = {
+            route_class: AdaptiveLimit(
+                settings.LOAD_SHEDDING_INITIAL_LIMIT,
+                settings.LOAD_SHEDDING_MIN_LIMIT,
+                settings.LOAD_SHEDDING_MAX_LIMIT,
+            )
+            for route_class in ROUTE_CLASSES
+        }
+
+    def acquire(self, route_class, route=None, queued=None):
+        """
+        Admit a request of ``route_class`` for ``route`` that waited
+        ``queued`` seconds before reaching the process, returning its
+        Ticket, or None when it should be shed
+        """
+        limit = self.limits[route_class]
+        share = ROUTE_CLASSES[route_class]
+        capacity = int(settings.LOAD_SHEDDING_CAPACITY * share)
+        waited_too_long = queued is not None and queued > settings.LOAD_SHEDDING_MAX_QUEUE_TIME * share
+        with self._lock:
+            if waited_too_long or limit.in_flight >= int(limit.limit) or self.in_flight >= capacity:
+                limit.rejected += 1
+                return None
+            limit.in_flight += 1
+            limit.admitted += 1
+            self.in_flight += 1
+            return Ticket(self, route_class, route, limit.in_flight)
+
+    def release(self, ticket, failed=False):
+        now = time.monotonic()
+        limit = self.limits[ticket.route_class]
+        with self._lock:
+            limit.in_flight -= 1
+            self.in_flight -= 1
+            limit.on_sample(now - ticket.started, ticket.in_flight, failed, now, ticket.route)
+
+    def snapshot(self):
+        """
+        Current limit, in-flight requests and counters of every route class
+        """
+        with self._lock:
+            return {
+                route_class: {
+                    'limit': int(limit.limit),
+                    'in_flight': limit.in_flight,
+                    'noload_latency': dict(limit.noload_latency),
+                    'admitted': limit.admitted,
+                    'rejected': limit.rejected,
+                }
+                for route_class, limit in self.limits.items()
+            }
+
+
+limiter = ConcurrencyLimiter()
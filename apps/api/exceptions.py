@@ -0,0 +1,31 @@
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.views import exception_handler as drf_exception_handler
+
+from apps.users.hashing import PasswordHashingBusy
+
+
+class ServiceBusy(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The service is busy, please retry shortly.'
+    default_code = 'service_busy'
+    retry_after = 1
+
+
+class PlanUnavailable(ServiceBusy):
+    default_detail = 'The plan could not be set up with the payment gateway, please retry shortly.'
+    default_code = 'plan_unavailable'
+
+
+def exception_handler(exc, context):
+    """
+    DRF exception handler that turns a saturated password hashing pool into
+    a 503 with Retry-After instead of a server error
+    """
+    if isinstance(exc, PasswordHashingBusy):
+        exc = ServiceBusy()
+    
+    response = drf_exception_handler(exc, context)
+    if isinstance(exc, ServiceBusy) and response is not None:
+        response['Retry-After'] = str(exc.retry_after)
+    return response
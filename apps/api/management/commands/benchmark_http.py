@@ -0,0 +1,66 @@
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of already sorted samples"""
+    index = max(0, min(len(samples) - 1, round(fraction * len(samples)) - 1))
+    return samples[index]
+
+
+class Command(BaseCommand):
+    help = (
+        'Load a running deployment with concurrent GET requests and report '
+        'requests/sec and latency percentiles. Run it against the WSGI '
+        '(gunicorn) and ASGI (uvicorn) deployments to compare them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('urls', nargs='+', help='URLs to request, in round robin')
+        parser.add_argument('--token', help='JWT access token sent as a Bearer token')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--warmup', type=int, default=200,
+                            help='Requests sent, and discarded, before measuring')
+        parser.add_argument('--timeout', type=float, default=10)
+
+    def handle(self, *args, **options):
+        urls = options['urls']
+        headers = {'Authorization': f"Bearer {options['token']}"} if options['token'] else {}
+        timeout = options['timeout']
+
+        def fetch(index):
+            request = urllib.request.Request(urls[index % len(urls)], headers=headers)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    response.read()
+                    ok = response.status < 500
+            except urllib.error.HTTPError as e:
+                ok = e.code < 500
+            except OSError:
+                ok = False
+            return time.perf_counter() - started, ok
+
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            list(pool.map(fetch, range(options['warmup'])))
+
+            started = time.perf_counter()
+            results = list(pool.map(fetch, range(options['requests'])))
+            elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for latency, ok in results if ok)
+        errors = len(results) - len(latencies)
+        if not latencies:
+            raise CommandError('Every request failed.')
+
+        self.stdout.write(f"requests:    {len(results)} ({errors} errors)")
+        self.stdout.write(f"concurrency: {options['concurrency']}")
+        self.stdout.write(f"throughput:  {len(results) / elapsed:.1f} req/s")
+        self.stdout.write(f"latency p50: {statistics.median(latencies) * 1000:.1f} ms")
+        self.stdout.write(f"latency p99: {percentile(latencies, 0.99) * 1000:.1f} ms")
@@ -0,0 +1,66 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from apps.api.projection import compile_field_plan, project_row
+from apps.api.views import SubscriptionHistoryViewSet, SubscriptionViewSet
+from apps.common.models import Subscription, SubscriptionHistory
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare list serialization throughput of the ModelSerializer path and '
+        'the projection fast path on existing rows'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--page-sizes', default='10,100,1000',
+                            help='Comma separated page sizes to benchmark')
+        parser.add_argument('--iterations', type=int, default=20,
+                            help='Number of pages rendered per measurement')
+
+    def handle(self, *args, **options):
+        page_sizes = [int(size) for size in options['page_sizes'].split(',')]
+        iterations = options['iterations']
+        renderer = JSONRenderer()
+
+        targets = [
+            (SubscriptionViewSet, Subscription.objects.select_related('user').order_by('id')),
+            (SubscriptionHistoryViewSet, SubscriptionHistory.objects.select_related('subscription__user')),
+        ]
+
+        for view_class, queryset in targets:
+            serializer_class = view_class.serializer_class
+            plan = compile_field_plan(serializer_class(), view_class.projection_sources)
+            lookups = {lookup for _, lookup, _ in plan}
+
+            for size in page_sizes:
+                if queryset.count() < size:
+                    raise CommandError(
+                        f'{queryset.model.__name__} has fewer than {size} rows to benchmark.'
+                    )
+
+                def serializer_page():
+                    return serializer_class(list(queryset[:size]), many=True).data
+
+                def projection_page():
+                    return [project_row(row, plan) for row in queryset.values(*lookups)[:size]]
+
+                if renderer.render(serializer_page()) != renderer.render(projection_page()):
+                    raise CommandError(f'{view_class.__name__}: projection output differs.')
+
+                results = {}
+                for label, render_page in (('serializer', serializer_page),
+                                           ('projection', projection_page)):
+                    started = time.perf_counter()
+                    for _ in range(iterations):
+                        renderer.render(render_page())
+                    results[label] = size * iterations / (time.perf_counter() - started)
+
+                self.stdout.write(
+                    f"{view_class.__name__} page_size={size}: "
+                    f"serializer {results['serializer']:.0f} rows/s, "
+                    f"projection {results['projection']:.0f} rows/s "
+                    f"({results['projection'] / results['serializer']:.1f}x)"
+                )
@@ -0,0 +1,93 @@
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+
+from .benchmark_http import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Load a running deployment with concurrent logins alongside ordinary '
+        'authenticated API traffic, and report throughput and latency for each. '
+        'Shows how much password hashing slows the rest of the API.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('base_url', help='API root, e.g. http://localhost:8000/api/v1/')
+        parser.add_argument('--email', required=True)
+        parser.add_argument('--password', required=True)
+        parser.add_argument('--login-path', default='auth/login/',
+                            help='Use async/auth/login/ for the async endpoint')
+        parser.add_argument('--api-path', default='users/me/')
+        parser.add_argument('--login-concurrency', type=int, default=10)
+        parser.add_argument('--api-concurrency', type=int, default=40)
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run')
+        parser.add_argument('--timeout', type=float, default=10)
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/') + '/'
+        timeout = options['timeout']
+        credentials = json.dumps({'email': options['email'], 'password': options['password']}).encode()
+
+        def send(request):
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    body = response.read()
+                    code = response.status
+            except urllib.error.HTTPError as e:
+                body, code = b'', e.code
+            except OSError:
+                body, code = b'', None
+            return time.perf_counter() - started, code, body
+
+        def login():
+            return send(urllib.request.Request(
+                base_url + options['login_path'].lstrip('/'),
+                data=credentials,
+                headers={'Content-Type': 'application/json'},
+            ))
+
+        _, code, body = login()
+        if code != 200:
+            raise CommandError(f'Login failed with status {code}.')
+        headers = {'Authorization': f"Bearer {json.loads(body)['access']}"}
+
+        def api():
+            return send(urllib.request.Request(base_url + options['api_path'].lstrip('/'), headers=headers))
+
+        deadline = time.perf_counter() + options['duration']
+        results = {'login': [], 'api': []}
+        lock = threading.Lock()
+
+        def loop(name, call):
+            samples = []
+            while time.perf_counter() < deadline:
+                latency, code, _ = call()
+                samples.append((latency, code))
+            with lock:
+                results[name].extend(samples)
+
+        workers = options['login_concurrency'] + options['api_concurrency']
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for _ in range(options['login_concurrency']):
+                pool.submit(loop, 'login', login)
+            for _ in range(options['api_concurrency']):
+                pool.submit(loop, 'api', api)
+
+        for name, samples in results.items():
+            latencies = sorted(latency for latency, code in samples if code is not None and code < 500)
+            shed = sum(1 for _, code in samples if code == 503)
+            errors = len(samples) - len(latencies) - shed
+            self.stdout.write(f"{name}:")
+            self.stdout.write(f"  requests:    {len(samples)} ({shed} shed with 503, {errors} errors)")
+            self.stdout.write(f"  throughput:  {len(latencies) / options['duration']:.1f} req/s")
+            if latencies:
+                self.stdout.write(f"  latency p50: {statistics.median(latencies) * 1000:.1f} ms")
+                self.stdout.write(f"  latency p99: {percentile(latencies, 0.99) * 1000:.1f} ms")
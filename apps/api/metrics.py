@@ -0,0 +1,403 @@
+"""
+Request metrics in the Prometheus text format.
+
+MetricsMiddleware records, per resolved view and action, request counts by
+status class, latency and response size histograms, and the database query
+count and time and serializer time spent by the requests. Database time is
+measured by an execute wrapper installed on every connection, and both it
+and serializer time are attributed to the request through a context
+variable, so sync and async views are accounted alike.
+
+Each process keeps its metrics in memory, and a background thread writes a
+snapshot of them to METRICS_DIR (one file per pid) every
+METRICS_DUMP_INTERVAL seconds, off the request path.
+The /metrics endpoint merges the snapshots of every process on the host:
+counters and histograms are summed, and gauges are reported per live pid.
+Clear METRICS_DIR when the server is (re)started.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare
+
+from apps.common.utils import metrics as razorpay_metrics
+from apps.common.utils import subscription_cache_stats
+from apps.users.snapshots import snapshot_cache_stats
+from .caching import response_cache_stats
+from .concurrency import limiter
+
+logger = logging.getLogger(__name__)
+
+# Histogram upper bounds, in seconds and bytes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """
+    Database and serializer time spent by the current request
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.serializer_seconds = 0.0
+        self.serializing = False
+
+
+@contextmanager
+def track_request():
+    """
+    Attribute the database and serializer time spent in the block to a new
+    RequestMetrics
+    """
+    collector = RequestMetrics()
+    token = _current.set(collector)
+    try:
+        yield collector
+    finally:
+        _current.reset(token)
+
+
+def _time_query(execute, sql, params, many, context):
+    collector = _current.get()
+    if collector is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        collector.queries += 1
+        collector.query_seconds += time.perf_counter() - started
+
+
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+    # Wrappers outlive reconnections of the same connection object
+    if settings.METRICS_ENABLED and _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+@contextmanager
+def serialization():
+    """
+    Count the time spent in the block as serializer time of the current
+    request; nested blocks are counted once
+    """
+    collector = _current.get()
+    if collector is None or collector.serializing:
+        yield
+        return
+
+    collector.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        collector.serializing = False
+        collector.serializer_seconds += time.perf_counter() - started
+
+
+class TimedSerializerMixin:
+    """
+    Serializer mixin counting representation time as serializer time
+    """
+
+    def to_representation(self, instance):
+        with serialization():
+            return super().to_representation(instance)
+
+
+def _observe(histogram, bounds, value):
+    for index, bound in enumerate(bounds):
+        if value <= bound:
+            histogram['buckets'][index] += 1
+            break
+    histogram['count'] += 1
+    histogram['sum'] += value
+
+
+def _histogram(bounds):
+    return {'buckets': [0] * len(bounds), 'count': 0, 'sum': 0.0}
+
+
+def view_labels(request):
+    """
+    The (view, action) a request resolved to
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unresolved', request.method.lower()
+
+    func = match.func
+    view = getattr(func, 'cls', None) or getattr(func, 'view_class', None) or func
+    actions = getattr(func, 'actions', None)
+    method = request.method.lower()
+    return f"{view.__module__}.{view.__qualname__}", actions.get(method, method) if actions else method
+
+
+class Registry:
+    """
+    Per-process request metrics, written to METRICS_DIR for aggregation
+    """
+
+    def __init__(self):
+        self._views = {}
+        self._lock = threading.Lock()
+        self._dumping = threading.Lock()
+        self._pid = None
+
+    def _start(self):
+        # Threads do not survive a fork, so each worker starts its own dumper
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    threading.Thread(target=self._run, name='metrics-dumper', daemon=True).start()
+                    atexit.register(self.dump)
+                    self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(settings.METRICS_DUMP_INTERVAL)
+            try:
+                self.dump()
+            except OSError:
+                logger.exception("Writing the metrics snapshot failed, retrying on the next round")
+
+    def observe(self, request, response, seconds, collector):
+        self._start()
+        view, action = view_labels(request)
+        status = f"{response.status_code // 100}xx"
+        size = None if response.streaming else len(response.content)
+
+        with self._lock:
+            stats = self._views.get((view, action))
+            if stats is None:
+                stats = self._views[(view, action)] = {
+                    'statuses': {},
+                    'latency': _histogram(LATENCY_BUCKETS),
+                    'size': _histogram(SIZE_BUCKETS),
+                    'queries': 0,
+                    'query_seconds': 0.0,
+                    'serializer_seconds': 0.0,
+                }
+            stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+            _observe(stats['latency'], LATENCY_BUCKETS, seconds)
+            if size is not None:
+                _observe(stats['size'], SIZE_BUCKETS, size)
+            stats['queries'] += collector.queries
+            stats['query_seconds'] += collector.query_seconds
+            stats['serializer_seconds'] += collector.serializer_seconds
+
+    def snapshot(self):
+        with self._lock:
+            views = [
+                {'view': view, 'action': action, **json.loads(json.dumps(stats))}
+                for (view, action), stats in self._views.items()
+            ]
+        return {
+            'pid': os.getpid(),
+            'views': views,
+            'caches': {
+                'subscription': subscription_cache_stats.snapshot(),
+                'user_response': response_cache_stats.snapshot(),
+                'user_snapshot': snapshot_cache_stats.snapshot(),
+            },
+            'razorpay': razorpay_metrics.snapshot(),
+            'load_shedding': limiter.snapshot(),
+        }
+
+    def dump(self):
+        """
+        Write this process's snapshot to its file in METRICS_DIR, unless
+        another thread of the process is already doing so
+        """
+        if not self._dumping.acquire(blocking=False):
+            return
+        try:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            path = os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json")
+            with open(f"{path}.tmp", 'w') as snapshot:
+                json.dump(self.snapshot(), snapshot)
+            os.replace(f"{path}.tmp", path)
+        finally:
+            self._dumping.release()
+
+
+registry = Registry()
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect():
+    """
+    Merge the snapshots of every process on the host
+    """
+    registry.dump()
+    snapshots = []
+    for filename in os.listdir(settings.METRICS_DIR):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, filename)) as snapshot:
+                snapshots.append(json.load(snapshot))
+        except (OSError, ValueError):
+            continue  # Being replaced by its process
+
+    views, caches, razorpay, shedding, gauges = {}, {}, {}, {}, []
+    for snapshot in snapshots:
+        for stats in snapshot['views']:
+            merged = views.setdefault((stats['view'], stats['action']), {
+                'statuses': {},
+                'latency': _histogram(LATENCY_BUCKETS),
+                'size': _histogram(SIZE_BUCKETS),
+                'queries': 0,
+                'query_seconds': 0.0,
+                'serializer_seconds': 0.0,
+            })
+            for status, count in stats['statuses'].items():
+                merged['statuses'][status] = merged['statuses'].get(status, 0) + count
+            for name in ('latency', 'size'):
+                for index, count in enumerate(stats[name]['buckets']):
+                    merged[name]['buckets'][index] += count
+                merged[name]['count'] += stats[name]['count']
+                merged[name]['sum'] += stats[name]['sum']
+            for name in ('queries', 'query_seconds', 'serializer_seconds'):
+                merged[name] += stats[name]
+
+        for cache, counts in snapshot['caches'].items():
+            for event, count in counts.items():
+                caches[cache, event] = caches.get((cache, event), 0) + count
+        for method, stats in snapshot['razorpay'].items():
+            merged = razorpay.setdefault(method, {'calls': 0, 'errors': 0, 'short_circuited': 0, 'latency_total': 0.0})
+            for name in merged:
+                merged[name] += stats[name]
+        alive = _is_alive(snapshot['pid'])
+        for route_class, stats in snapshot['load_shedding'].items():
+            merged = shedding.setdefault(route_class, {'admitted': 0, 'rejected': 0})
+            merged['admitted'] += stats['admitted']
+            merged['rejected'] += stats['rejected']
+            if alive:
+                gauges.append((route_class, snapshot['pid'], stats['limit'], stats['in_flight']))
+
+    return views, caches, razorpay, shedding, gauges
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _render_histogram(lines, name, bounds, histogram, labels):
+    cumulative = 0
+    for bound, count in zip(bounds, histogram['buckets']):
+        cumulative += count
+        lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+    lines.append(f"{name}_bucket{_labels(**labels, le='+Inf')} {histogram['count']}")
+    lines.append(f"{name}_sum{_labels(**labels)} {histogram['sum']}")
+    lines.append(f"{name}_count{_labels(**labels)} {histogram['count']}")
+
+
+def render():
+    """
+    The merged metrics in the Prometheus text exposition format
+    """
+    views, caches, razorpay, shedding, gauges = collect()
+    lines = []
+
+    def header(name, kind, description):
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+
+    header('http_requests_total', 'counter', 'Requests by view, action and status class')
+    for (view, action), stats in sorted(views.items()):
+        for status, count in sorted(stats['statuses'].items()):
+            lines.append(f"http_requests_total{_labels(view=view, action=action, status=status)} {count}")
+
+    header('http_request_duration_seconds', 'histogram', 'Request latency by view and action')
+    for (view, action), stats in sorted(views.items()):
+        _render_histogram(lines, 'http_request_duration_seconds', LATENCY_BUCKETS, stats['latency'],
+                          {'view': view, 'action': action})
+
+    header('http_response_size_bytes', 'histogram', 'Response body size by view and action, streams excluded')
+    for (view, action), stats in sorted(views.items()):
+        _render_histogram(lines, 'http_response_size_bytes', SIZE_BUCKETS, stats['size'],
+                          {'view': view, 'action': action})
+
+    for name, key, description in (
+        ('db_queries_total', 'queries', 'Database queries run by requests'),
+        ('db_query_duration_seconds_total', 'query_seconds', 'Time requests spent in database queries'),
+        ('serializer_duration_seconds_total', 'serializer_seconds', 'Time requests spent serializing'),
+    ):
+        header(name, 'counter', description)
+        for (view, action), stats in sorted(views.items()):
+            lines.append(f"{name}{_labels(view=view, action=action)} {stats[key]}")
+
+    header('cache_events_total', 'counter', 'Cache hits, misses and refreshes by cache')
+    for (cache, event), count in sorted(caches.items()):
+        lines.append(f"cache_events_total{_labels(cache=cache, event=event)} {count}")
+
+    for name, key, description in (
+        ('razorpay_calls_total', 'calls', 'Razorpay client calls by method'),
+        ('razorpay_errors_total', 'errors', 'Failed Razorpay client calls by method'),
+        ('razorpay_short_circuited_total', 'short_circuited', 'Razorpay calls refused by the circuit breaker'),
+        ('razorpay_call_duration_seconds_total', 'latency_total', 'Time spent in Razorpay calls'),
+    ):
+        header(name, 'counter', description)
+        for method, stats in sorted(razorpay.items()):
+            lines.append(f"{name}{_labels(method=method)} {stats[key]}")
+
+    for name, key, description in (
+        ('load_shedding_admitted_total', 'admitted', 'Requests admitted by route class'),
+        ('load_shedding_rejected_total', 'rejected', 'Requests shed by route class'),
+    ):
+        header(name, 'counter', description)
+        for route_class, stats in sorted(shedding.items()):
+            lines.append(f"{name}{_labels(route_class=route_class)} {stats[key]}")
+
+    header('load_shedding_limit', 'gauge', 'Adaptive concurrency limit by route class and live process')
+    for route_class, pid, limit, _ in gauges:
+        lines.append(f"load_shedding_limit{_labels(route_class=route_class, pid=pid)} {limit}")
+    header('load_shedding_in_flight', 'gauge', 'Requests in flight by route class and live process')
+    for route_class, pid, _, in_flight in gauges:
+        lines.append(f"load_shedding_in_flight{_labels(route_class=route_class, pid=pid)} {in_flight}")
+
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint; requires ``Authorization: Bearer
+    <METRICS_TOKEN>``, and is closed without a token unless DEBUG is on
+    """
+    if settings.METRICS_TOKEN:
+        supplied = request.headers.get('Authorization', '')
+        if not constant_time_compare(supplied, f"Bearer {settings.METRICS_TOKEN}"):
+            return HttpResponse(status=401)
+    elif not settings.DEBUG:
+        return HttpResponse(status=403)
+    return HttpResponse(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,281 @@
+import contextvars
+import logging
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import JsonResponse
+
+from .concurrency import classify, limiter, queue_time, route_name
+from .exceptions import ServiceBusy
+from .metrics import registry, track_request
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """Raised in strict mode when a view issues more queries than it declares"""
+
+
+def get_query_budget(view_class, action=None):
+    """
+    Return the maximum number of queries declared by a view for an action.
+
+    Views declare ``query_budget`` either as an int that applies to every
+    request, or as a dict keyed by viewset action (``'get'`` and friends for
+    plain API views). Returns None when no budget is declared.
+    """
+    budget = getattr(view_class, 'query_budget', None)
+    if isinstance(budget, dict):
+        return budget.get(action)
+    return budget
+
+
+_query_counter = contextvars.ContextVar('query_counter', default=None)
+
+
+class QueryCounter:
+    """Number of queries run by the current request"""
+
+    def __init__(self):
+        self.count = 0
+
+
+# Savepoint statements of nested atomic blocks, which are transaction control
+# like the uncounted BEGIN and COMMIT rather than queries
+TRANSACTION_CONTROL = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+
+def count_query(execute, sql, params, many, context):
+    counter = _query_counter.get()
+    if counter is not None and not sql.startswith(TRANSACTION_CONTROL):
+        counter.count += 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs):
+    # Installed on every connection, as async views run their queries on
+    # connections of other threads; requests are told apart by the context
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def install_query_counters():
+    """
+    Count the queries of the open connections and of every connection opened
+    from now on. Only QueryBudgetMiddleware calls this, so Celery workers and
+    management commands run their queries unwrapped.
+    """
+    connection_created.connect(install_query_counter, dispatch_uid='query-budget-counter')
+    for connection in connections.all(initialized_only=True):
+        install_query_counter(None, connection)
+
+
+class QueryBudgetMiddleware:
+    """
+    Development middleware reporting the number of queries run by each API
+    request against the budget declared on its view.
+
+    Every response gets an ``X-Query-Count`` header (and ``X-Query-Budget``
+    when the view declares one). Requests going over budget are logged, or
+    raise QueryBudgetExceeded when ``QUERY_BUDGET_STRICT`` is set, which is
+    how tests enforce the budgets.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not (settings.DEBUG or getattr(settings, 'QUERY_BUDGET_STRICT', False)):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.strict = getattr(settings, 'QUERY_BUDGET_STRICT', False)
+        install_query_counters()
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        counter = QueryCounter()
+        token = _query_counter.set(counter)
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_counter.reset(token)
+        return self.check_budget(request, response, counter)
+
+    async def __acall__(self, request):
+        counter = QueryCounter()
+        token = _query_counter.set(counter)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_counter.reset(token)
+        return self.check_budget(request, response, counter)
+
+    def check_budget(self, request, response, counter):
+        response['X-Query-Count'] = str(counter.count)
+
+        match = getattr(request, 'resolver_match', None)
+        view_class = getattr(getattr(match, 'func', None), 'cls', None)
+        if view_class is None:
+            return response
+
+        actions = getattr(match.func, 'actions', None)
+        method = request.method.lower()
+        action = actions.get(method) if actions else method
+        budget = get_query_budget(view_class, action)
+        if budget is None:
+            return response
+
+        response['X-Query-Budget'] = str(budget)
+        if counter.count > budget:
+            message = (
+                f"{view_class.__name__}.{action} ran {counter.count} queries, "
+                f"over its budget of {budget}"
+            )
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+        return response
+
+
+class LoadSheddingMiddleware:
+    """
+    Middleware rejecting requests with a 503 and Retry-After when their
+    route class is over its adaptive concurrency limit (see
+    apps.api.concurrency), before any view or database work is done.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.LOAD_SHEDDING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def shed(self):
+        # Logged by django.request like any other 5xx response
+        response = JsonResponse({'detail': ServiceBusy.default_detail}, status=ServiceBusy.status_code)
+        response['Retry-After'] = str(settings.LOAD_SHEDDING_RETRY_AFTER)
+        return response
+
+    def release_after(self, response, ticket):
+        """
+        Release the ticket of a plain response now, and that of a streaming
+        one (such as an export) once its content is sent or the response
+        is closed, so the whole transfer counts as in flight and its
+        latency is sampled
+        """
+        if not response.streaming:
+            ticket.release(response.status_code >= 500)
+            return response
+
+        released = False
+
+        def release(failed):
+            nonlocal released
+            if not released:
+                released = True
+                ticket.release(failed)
+
+        content = response.streaming_content
+        failed = response.status_code >= 500
+        if response.is_async:
+            async def stream():
+                try:
+                    async for chunk in content:
+                        yield chunk
+                except Exception:
+                    release(True)
+                    raise
+                release(failed)
+        else:
+            def stream():
+                try:
+                    yield from content
+                except Exception:
+                    release(True)
+                    raise
+                release(failed)
+        response.streaming_content = stream()
+
+        # A client that disconnects mid-download never exhausts the content
+        close = response.close
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                release(failed)
+
+        response.close = close_and_release
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        ticket = limiter.acquire(classify(request), route_name(request), queue_time(request))
+        if ticket is None:
+            return self.shed()
+
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            ticket.release(True)
+            raise
+        return self.release_after(response, ticket)
+
+    async def __acall__(self, request):
+        ticket = limiter.acquire(classify(request), route_name(request), queue_time(request))
+        if ticket is None:
+            return self.shed()
+
+        try:
+            response = await self.get_response(request)
+        except BaseException:
+            ticket.release(True)
+            raise
+        return self.release_after(response, ticket)
+
+
+class MetricsMiddleware:
+    """
+    Middleware recording each request's latency, response size, database
+    queries and serializer time against its view and action (see
+    apps.api.metrics)
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        with track_request() as collector:
+            response = self.get_response(request)
+        registry.observe(request, response, time.perf_counter() - started, collector)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with track_request() as collector:
+            response = await self.get_response(request)
+        registry.observe(request, response, time.perf_counter() - started, collector)
+        return response
@@ -0,0 +1,24 @@
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+from apps.common.pagination import ApproximateCountPaginator
+
+
+class SubscriptionHistoryCursorPagination(CursorPagination):
+    """
+    Keyset pagination over subscription history on (created_at, id), newest first
+    """
+    ordering = ('-created_at', '-id')
+
+
+class UserCursorPagination(CursorPagination):
+    """
+    Keyset pagination over users on their primary key
+    """
+    ordering = ('id',)
+
+
+class ApproximateCountPagination(PageNumberPagination):
+    """
+    Page number pagination that estimates large table counts from planner statistics
+    """
+    django_paginator_class = ApproximateCountPaginator
@@ -1,11 +1,19 @@
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from apps.common.models import Subscription, SubscriptionHistory
+from django.db import transaction
+from django.utils import timezone
+from apps.common.audit import record_history
+from apps.common.models import Plan, Subscription, SubscriptionHistory
+from apps.common.plans import get_subscription_plan
+from apps.common.utils import calculate_trial_end_date
+from apps.users.hashing import hash_password
+from .exceptions import PlanUnavailable
+from .metrics import TimedSerializerMixin
 
 User = get_user_model()
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for the User model"""
     
     class Meta:
@@ -42,43 +50,77 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
         # Remove password_confirm as it's not needed for creating the user
         validated_data.pop('password_confirm', None)
         
-        # Create the user
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            email=validated_data['email'],
-            first_name=validated_data['first_name'],
-            last_name=validated_data['last_name'],
-            password=validated_data['password']
-        )
+        # Hash on the password pool before opening the transaction
+        password = hash_password(validated_data['password'])
         
-        # Add additional fields if provided
-        if 'phone_number' in validated_data:
-            user.phone_number = validated_data['phone_number']
-            user.save()
-        
-        # Start the trial for the new user
-        user.start_trial()
+        # Create the user already on the 30-day trial, with the subscription,
+        # in one transaction: a single INSERT per table. The trial_started
+        # history event is written behind once it commits
+        trial_start_date = timezone.now()
+        with transaction.atomic():
+            user = User.objects.create(
+                username=User.normalize_username(validated_data['username']),
+                email=User.objects.normalize_email(validated_data['email']),
+                first_name=validated_data['first_name'],
+                last_name=validated_data['last_name'],
+                password=password,
+                phone_number=validated_data.get('phone_number'),
+                is_on_trial=True,
+                trial_start_date=trial_start_date,
+                trial_end_date=calculate_trial_end_date(trial_start_date),
+                subscription_status='trial'
+            )
+            subscription = Subscription.objects.create(user=user)
+            record_history(
+                user.pk,
+                subscription.pk,
+                'trial_started',
+                new_plan='free',
+                notes='30-day free trial started'
+            )
         
         return user
 
 
-class SubscriptionSerializer(serializers.ModelSerializer):
+class SubscriptionSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for the Subscription model"""
     
     user_email = serializers.SerializerMethodField()
+    razorpay_plan_id = serializers.CharField(source='catalog_plan.razorpay_plan_id', read_only=True, allow_null=True)
     
     class Meta:
         model = Subscription
         fields = ('id', 'user', 'user_email', 'plan', 'is_active', 
                   'start_date', 'end_date', 'amount', 'currency', 
-                  'billing_cycle', 'auto_renew', 'razorpay_subscription_id')
+                  'billing_cycle', 'auto_renew', 'razorpay_subscription_id',
+                  'razorpay_plan_id')
         read_only_fields = ('id', 'user', 'user_email', 'razorpay_subscription_id')
     
     def get_user_email(self, obj):
         return obj.user.email
+    
+    def validate(self, attrs):
+        """
+        Link paid subscriptions to the catalog plan billing their terms
+        """
+        terms = {}
+        for name in ('plan', 'billing_cycle', 'amount', 'currency'):
+            if name in attrs:
+                terms[name] = attrs[name]
+            elif self.instance is not None:
+                terms[name] = getattr(self.instance, name)
+            else:
+                terms[name] = Subscription._meta.get_field(name).get_default()
+        
+        attrs['catalog_plan'] = None
+        if terms['amount']:
+            attrs['catalog_plan'] = get_subscription_plan(**terms)
+            if attrs['catalog_plan'] is None:
+                raise PlanUnavailable()
+        return attrs
 
 
-class SubscriptionHistorySerializer(serializers.ModelSerializer):
+class SubscriptionHistorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """Serializer for the SubscriptionHistory model"""
     
     subscription_id = serializers.PrimaryKeyRelatedField(source='subscription', read_only=True)
@@ -95,6 +137,16 @@ class SubscriptionHistorySerializer(serializers.ModelSerializer):
         return obj.subscription.user.email
 
 
+class PlanSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    """Serializer for the Plan catalog"""
+    
+    class Meta:
+        model = Plan
+        fields = ('id', 'name', 'period', 'interval', 'amount', 'currency', 
+                  'description', 'razorpay_plan_id')
+        read_only_fields = fields
+
+
 class PasswordChangeSerializer(serializers.Serializer):
     """Serializer for password change endpoint"""
     
@@ -0,0 +1,148 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory
+
+from apps.api import middleware
+from apps.api.concurrency import AdaptiveLimit, ConcurrencyLimiter, queue_time
+from apps.api.middleware import LoadSheddingMiddleware
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.mark.parametrize('header', ['t=1700000000.25', '1700000000250', '1700000000250000'])
+def test_queue_time_reads_seconds_milliseconds_and_microseconds(header):
+    request = RequestFactory().get('/', headers={'X-Request-Start': header})
+
+    assert queue_time(request, now=1700000001.0) == pytest.approx(0.75)
+
+
+def test_queue_time_is_none_without_the_header():
+    assert queue_time(RequestFactory().get('/')) is None
+
+
+def test_fast_routes_do_not_make_a_slow_route_of_their_class_look_congested(settings):
+    limit = AdaptiveLimit(initial=16, minimum=2, maximum=64)
+    now = 0.0
+    for _ in range(100):
+        now += 1
+        limit.on_sample(0.005, 16, False, now, route='token_refresh')
+        limit.on_sample(0.2, 16, False, now, route='token_obtain_pair')
+
+    assert limit.limit > 16
+    assert limit.noload_latency['token_obtain_pair'] == pytest.approx(0.2)
+
+    # A genuinely slow login still counts as congestion
+    grown = limit.limit
+    limit.on_sample(0.2 * settings.LOAD_SHEDDING_LATENCY_TOLERANCE * 2, 16, False, now + 1, route='token_obtain_pair')
+    assert limit.limit < grown
+
+
+def test_requests_that_waited_too_long_behind_the_proxy_are_shed(settings, make_user, auth_client):
+    settings.LOAD_SHEDDING_MAX_QUEUE_TIME = 1.0
+    client = auth_client(make_user())
+
+    stale = client.get('/api/v1/users/me/', headers={'X-Request-Start': f't={time.time() - 5:.3f}'})
+    fresh = client.get('/api/v1/users/me/', headers={'X-Request-Start': f't={time.time():.3f}'})
+
+    assert stale.status_code == 503
+    assert stale['Retry-After'] == str(settings.LOAD_SHEDDING_RETRY_AFTER)
+    assert fresh.status_code == 200
+
+
+def test_lower_priority_classes_tolerate_less_queueing(settings):
+    settings.LOAD_SHEDDING_MAX_QUEUE_TIME = 1.0
+    limiter = ConcurrencyLimiter()
+
+    assert limiter.acquire('auth', 'token_obtain_pair', queued=0.8) is not None
+    assert limiter.acquire('staff', 'export', queued=0.8) is None
+
+
+@pytest.fixture
+def releases(monkeypatch):
+    """
+    Swap in a fresh limiter and record the (latency, failed) of each release
+    """
+    limiter = ConcurrencyLimiter()
+    recorded = []
+    release = limiter.release
+
+    def recording_release(ticket, failed=False):
+        recorded.append((time.monotonic() - ticket.started, failed))
+        release(ticket, failed)
+
+    monkeypatch.setattr(limiter, 'release', recording_release)
+    monkeypatch.setattr(middleware, 'limiter', limiter)
+    return SimpleNamespace(limiter=limiter, recorded=recorded)
+
+
+def export_chunks(error=None):
+    yield b'id\n'
+    time.sleep(0.05)
+    if error:
+        raise error
+    yield b'1\n'
+
+
+def streamed(content):
+    return LoadSheddingMiddleware(lambda request: StreamingHttpResponse(content))(
+        RequestFactory().get('/api/v1/exports/history/')
+    )
+
+
+def test_streaming_responses_hold_their_ticket_until_sent(releases):
+    response = streamed(export_chunks())
+    assert releases.limiter.in_flight == 1
+
+    assert b''.join(response) == b'id\n1\n'
+    response.close()
+
+    assert releases.limiter.in_flight == 0
+    [(latency, failed)] = releases.recorded
+    assert latency >= 0.05
+    assert failed is False
+
+
+def test_streaming_responses_closed_early_release_their_ticket(releases):
+    response = streamed(export_chunks())
+    next(iter(response))
+    response.close()
+    response.close()
+
+    assert releases.limiter.in_flight == 0
+    assert [failed for _, failed in releases.recorded] == [False]
+
+
+def test_streaming_errors_are_failures(releases):
+    response = streamed(export_chunks(error=RuntimeError('cursor lost')))
+
+    with pytest.raises(RuntimeError):
+        b''.join(response)
+    response.close()
+
+    assert [failed for _, failed in releases.recorded] == [True]
+
+
+def test_async_streaming_responses_hold_their_ticket_until_sent(releases):
+    async def chunks():
+        yield b'id\n'
+        await asyncio.sleep(0.05)
+        yield b'1\n'
+
+    async def get_response(request):
+        return StreamingHttpResponse(chunks())
+
+    async def download():
+        response = await LoadSheddingMiddleware(get_response)(RequestFactory().get('/api/v1/exports/history/'))
+        assert releases.limiter.in_flight == 1
+        content = b''.join([chunk async for chunk in response])
+        response.close()
+        return content
+
+    assert asyncio.run(download()) == b'id\n1\n'
+    assert releases.limiter.in_flight == 0
+    assert [failed for _, failed in releases.recorded] == [False]
+    assert releases.recorded[0][0] >= 0.05
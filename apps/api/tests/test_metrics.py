@@ -0,0 +1,98 @@
+import json
+import os
+import re
+import threading
+
+import pytest
+
+from apps.api.metrics import registry
+
+pytestmark = pytest.mark.django_db
+
+TOKEN = 'scrape-token'
+
+
+@pytest.fixture
+def scrape(settings, client):
+    settings.METRICS_TOKEN = TOKEN
+
+    def get():
+        response = client.get('/metrics', headers={'Authorization': f'Bearer {TOKEN}'})
+        assert response.status_code == 200
+        return response.content.decode()
+
+    return get
+
+
+def snapshot(pid, view, count, in_flight):
+    return {
+        'pid': pid,
+        'views': [{
+            'view': view,
+            'action': 'list',
+            'statuses': {'2xx': count},
+            'latency': {'buckets': [count] + [0] * 10, 'count': count, 'sum': 0.001 * count},
+            'size': {'buckets': [count] + [0] * 5, 'count': count, 'sum': 50 * count},
+            'queries': 2 * count,
+            'query_seconds': 0.0,
+            'serializer_seconds': 0.0,
+        }],
+        'caches': {'user_snapshot': {'hits': count}},
+        'razorpay': {},
+        'load_shedding': {'reads': {'limit': 16, 'in_flight': in_flight, 'admitted': count, 'rejected': 1}},
+    }
+
+
+def test_scrapes_are_denied_without_a_token_unless_debug(client, settings):
+    settings.METRICS_TOKEN = ''
+    assert client.get('/metrics').status_code == 403
+
+    settings.DEBUG = True
+    assert client.get('/metrics').status_code == 200
+
+
+def test_scrapes_with_a_wrong_token_are_unauthorized(client, settings):
+    settings.METRICS_TOKEN = TOKEN
+
+    assert client.get('/metrics', headers={'Authorization': 'Bearer guess'}).status_code == 401
+
+
+def test_requests_are_rendered_by_view_and_action(scrape, make_user, auth_client):
+    assert auth_client(make_user()).get('/api/v1/users/me/').status_code == 200
+
+    text = scrape()
+
+    labels = r'\{view="apps\.api\.views\.UserViewSet",action="me"'
+    assert re.search(labels + r',status="2xx"\} [1-9]', text)
+    assert re.search(r'http_request_duration_seconds_bucket' + labels + r',le="\+Inf"\} [1-9]', text)
+    assert re.search(r'db_queries_total' + labels + r'\} [1-9]', text)
+    assert '# TYPE http_request_duration_seconds histogram' in text
+
+
+def test_snapshots_of_processes_are_merged(scrape, settings):
+    dead_pid = 2 ** 22 + 1
+    os.makedirs(settings.METRICS_DIR, exist_ok=True)
+    for pid, count, in_flight in ((os.getppid(), 3, 2), (dead_pid, 4, 5)):
+        with open(os.path.join(settings.METRICS_DIR, f'{pid}.json'), 'w') as file:
+            json.dump(snapshot(pid, 'tests.MergedView', count, in_flight), file)
+
+    text = scrape()
+
+    labels = '{view="tests.MergedView",action="list"}'
+    assert f'http_requests_total{{view="tests.MergedView",action="list",status="2xx"}} 7' in text
+    assert f'http_request_duration_seconds_count{labels} 7' in text
+    assert f'http_response_size_bytes_sum{labels} 350' in text
+    assert f'db_queries_total{labels} 14' in text
+    # Gauges are only reported for live processes
+    assert f'load_shedding_in_flight{{route_class="reads",pid="{os.getppid()}"}} 2' in text
+    assert f'pid="{dead_pid}"' not in text
+
+
+def test_requests_do_not_write_snapshots_inline(make_user, auth_client, monkeypatch):
+    dumps = []
+    monkeypatch.setattr(registry, 'dump', lambda: dumps.append(threading.current_thread()))
+
+    assert auth_client(make_user()).get('/api/v1/users/me/').status_code == 200
+
+    # The dumper thread may run meanwhile, but never the request's own thread
+    assert threading.current_thread() not in dumps
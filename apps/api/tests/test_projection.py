@@ -0,0 +1,67 @@
+"""
+The projected list endpoints must return exactly what their serializers
+would for the same rows, nulls included
+"""
+import json
+from datetime import timedelta
+from decimal import Decimal
+
+import pytest
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from apps.api.serializers import SubscriptionHistorySerializer, SubscriptionSerializer
+from apps.common.models import Plan, Subscription, SubscriptionHistory
+
+pytestmark = pytest.mark.django_db
+
+
+def serialized(serializer_class, queryset):
+    return json.loads(JSONRenderer().render(serializer_class(queryset, many=True).data))
+
+
+def listed(client, path):
+    response = client.get(path)
+    assert response.status_code == 200, response.content
+    return json.loads(response.content)['results']
+
+
+def by_id(rows):
+    return {row['id']: row for row in rows}
+
+
+@pytest.fixture
+def staff_client(make_user, auth_client):
+    return auth_client(make_user(is_staff=True))
+
+
+def test_subscription_list_matches_the_serializer(make_user, staff_client):
+    plan = Plan.objects.create(name='basic', period='monthly', amount=49900, razorpay_plan_id='plan_basic')
+    now = timezone.now()
+    Subscription.objects.create(
+        user=make_user(), plan='basic', catalog_plan=plan, is_active=True, start_date=now,
+        end_date=now + timedelta(days=30), amount=Decimal('499.00'), billing_cycle='monthly',
+        razorpay_subscription_id='sub_1',
+    )
+    # Free, with no catalog plan, dates or gateway ids
+    Subscription.objects.create(user=make_user())
+
+    expected = serialized(SubscriptionSerializer, Subscription.objects.select_related('user', 'catalog_plan'))
+
+    assert by_id(listed(staff_client, '/api/v1/subscriptions/')) == by_id(expected)
+
+
+def test_subscription_history_list_matches_the_serializer(make_user, staff_client):
+    subscription = Subscription.objects.create(user=make_user())
+    SubscriptionHistory.objects.create(
+        subscription=subscription, action='renewed', previous_plan='basic', new_plan='premium',
+        payment_id='pay_1', amount=Decimal('999.00'), notes='Upgraded',
+    )
+    # Nothing but the action
+    SubscriptionHistory.objects.create(subscription=subscription, action='cancelled')
+
+    expected = serialized(
+        SubscriptionHistorySerializer, SubscriptionHistory.objects.select_related('subscription__user')
+    )
+
+    assert by_id(listed(staff_client, '/api/v1/subscription-history/')) == by_id(expected)
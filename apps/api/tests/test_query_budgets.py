@@ -0,0 +1,129 @@
+"""
+Enforce the query budgets declared by the API views: every list endpoint
+runs the same number of queries for a page of one row and a full page, and
+stays within its budget (QueryBudgetMiddleware raises in strict mode)
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient
+from rest_framework.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.common.models import Subscription, SubscriptionHistory
+
+pytestmark = pytest.mark.django_db
+
+PAGE_SIZES = (1, api_settings.PAGE_SIZE)
+
+
+@pytest.fixture(autouse=True)
+def strict_budgets(settings):
+    settings.QUERY_BUDGET_STRICT = True
+
+
+def subscribe(user):
+    return Subscription.objects.create(user=user, plan='basic', is_active=True)
+
+
+def seed_users(make_user, rows):
+    staff = make_user(is_staff=True)
+    for _ in range(rows - 1):
+        make_user()
+    return staff
+
+
+def seed_subscriptions(make_user, rows):
+    staff = make_user(is_staff=True)
+    for _ in range(rows):
+        subscribe(make_user())
+    return staff
+
+
+def seed_own_history(make_user, rows):
+    user = make_user()
+    subscription = subscribe(user)
+    for _ in range(rows):
+        SubscriptionHistory.objects.create(subscription=subscription, action='renewed')
+    return user
+
+
+def seed_all_history(make_user, rows):
+    staff = make_user(is_staff=True)
+    for _ in range(rows):
+        SubscriptionHistory.objects.create(subscription=subscribe(make_user()), action='renewed')
+    return staff
+
+
+def seed_own_subscription(make_user, rows):
+    user = make_user()
+    subscribe(user)
+    return user
+
+
+LIST_ENDPOINTS = {
+    'users (staff)': ('/api/v1/users/', seed_users),
+    'subscriptions (staff)': ('/api/v1/subscriptions/', seed_subscriptions),
+    'subscriptions (own)': ('/api/v1/subscriptions/', seed_own_subscription),
+    'subscription-history (staff)': ('/api/v1/subscription-history/', seed_all_history),
+    'subscription-history (own)': ('/api/v1/subscription-history/', seed_own_history),
+}
+
+
+def query_count(client, path):
+    response = client.get(path)
+    assert response.status_code == 200, response.content
+    count = int(response['X-Query-Count'])
+    assert count <= int(response['X-Query-Budget'])
+    return count
+
+
+@pytest.mark.parametrize('endpoint', LIST_ENDPOINTS)
+def test_list_queries_do_not_grow_with_page_size(endpoint, make_user, auth_client):
+    path, seed = LIST_ENDPOINTS[endpoint]
+    counts = []
+    for rows in PAGE_SIZES:
+        client = auth_client(seed(make_user, rows))
+        counts.append(query_count(client, path))
+    assert counts[0] == counts[1]
+
+
+def test_budget_overrun_raises_in_strict_mode(make_user, auth_client, monkeypatch):
+    from apps.api.middleware import QueryBudgetExceeded
+    from apps.api.views import SubscriptionHistoryViewSet
+
+    monkeypatch.setattr(SubscriptionHistoryViewSet, 'query_budget', {'list': 0})
+    client = auth_client(seed_own_history(make_user, 1))
+    with pytest.raises(QueryBudgetExceeded):
+        client.get('/api/v1/subscription-history/')
+
+
+def test_async_views_count_queries(make_user):
+    user = seed_own_history(make_user, 3)
+    response = async_to_sync(AsyncClient().get)(
+        '/api/v1/async/subscription-history/',
+        headers={'Authorization': f'Bearer {AccessToken.for_user(user)}'},
+    )
+
+    assert response.status_code == 200, response.content
+    assert int(response['X-Query-Count']) > 0
+
+
+def test_processes_without_budgets_do_not_wrap_their_queries():
+    # A fresh process, like a Celery worker, that never builds the middleware
+    script = (
+        'import django; django.setup()\n'
+        'from django.db import connection\n'
+        'from apps.api.middleware import count_query\n'
+        'connection.ensure_connection()\n'
+        'print(count_query in connection.execute_wrappers)\n'
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', script], capture_output=True, text=True, check=True,
+        env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'core.settings'},
+    ).stdout
+
+    assert output.strip() == 'False'
@@ -0,0 +1,46 @@
+import pytest
+
+from apps.api.views import RegistrationAPIView
+from apps.common.models import Subscription, SubscriptionHistory
+from apps.users.models import User
+
+pytestmark = pytest.mark.django_db
+
+# The SAVEPOINT and RELEASE of the signup's atomic block, which the test
+# database captures but QueryBudgetMiddleware does not count
+TRANSACTION_STATEMENTS = 2
+
+
+@pytest.fixture(autouse=True)
+def strict_budgets(settings):
+    settings.QUERY_BUDGET_STRICT = True
+
+PAYLOAD = {
+    'email': 'new@example.com',
+    'username': 'newcomer',
+    'first_name': 'New',
+    'last_name': 'Comer',
+    'password': 'secret-pass-123',
+    'password_confirm': 'secret-pass-123',
+}
+
+
+def test_registration_runs_its_budgeted_queries(api_client, django_assert_num_queries):
+    with django_assert_num_queries(RegistrationAPIView.query_budget + TRANSACTION_STATEMENTS):
+        response = api_client.post('/api/v1/auth/register/', PAYLOAD)
+
+    assert response.status_code == 201, response.content
+    assert int(response['X-Query-Count']) == RegistrationAPIView.query_budget
+    user = User.objects.get(email='new@example.com')
+    assert user.subscription_status == 'trial'
+    assert SubscriptionHistory.objects.filter(subscription__user=user, action='trial_started').exists()
+
+
+def test_registration_with_written_behind_history_skips_its_insert(api_client, settings, django_assert_num_queries):
+    settings.AUDIT_WRITE_BEHIND = True
+
+    with django_assert_num_queries(RegistrationAPIView.query_budget - 1 + TRANSACTION_STATEMENTS):
+        response = api_client.post('/api/v1/auth/register/', PAYLOAD)
+
+    assert response.status_code == 201, response.content
+    assert Subscription.objects.filter(user__email='new@example.com').exists()
@@ -6,12 +6,21 @@ from rest_framework_simplejwt.views import (
     TokenVerifyView,
 )
 
+from . import async_views
+from .webhooks import razorpay_webhook
 from .views import (
     UserViewSet, 
     RegistrationAPIView, 
+    UserImportView,
+    UserImportStatusView,
+    ExportView,
+    MRRAnalyticsView,
+    TrialConversionAnalyticsView,
+    ChurnAnalyticsView,
     SubscriptionViewSet, 
     SubscriptionHistoryViewSet,
-    CheckTrialStatusView
+    CheckTrialStatusView,
+    PlanCatalogView
 )
 
 # Create a router and register our viewsets
@@ -22,6 +31,14 @@ router.register(r'subscription-history', SubscriptionHistoryViewSet, basename='s
 
 # URL patterns for our API
 urlpatterns = [
+    # Staff endpoints (ahead of the router so they are not taken as user ids)
+    path('users/import/', UserImportView.as_view(), name='user-import'),
+    path('users/import/<uuid:task_id>/', UserImportStatusView.as_view(), name='user-import-status'),
+    path('exports/<str:kind>/', ExportView.as_view(), name='export'),
+    path('analytics/mrr/', MRRAnalyticsView.as_view(), name='analytics-mrr'),
+    path('analytics/trial-conversion/', TrialConversionAnalyticsView.as_view(), name='analytics-trial-conversion'),
+    path('analytics/churn/', ChurnAnalyticsView.as_view(), name='analytics-churn'),
+    
     # Include the router URLs
     path('', include(router.urls)),
     
@@ -33,4 +50,16 @@ urlpatterns = [
     
     # Subscription-related endpoints
     path('trial/status/', CheckTrialStatusView.as_view(), name='trial-status'),
+    path('plans/', PlanCatalogView.as_view(), name='plan-catalog'),
+    
+    # Razorpay webhooks
+    path('webhooks/razorpay/', razorpay_webhook, name='razorpay-webhook'),
+    
+    # Async (ASGI-native) versions of the hot self-service endpoints
+    path('async/auth/login/', async_views.login, name='async-token-obtain-pair'),
+    path('async/auth/refresh/', async_views.refresh, name='async-token-refresh'),
+    path('async/users/me/', async_views.me, name='async-user-me'),
+    path('async/subscriptions/my_subscription/', async_views.my_subscription, name='async-my-subscription'),
+    path('async/subscription-history/', async_views.subscription_history, name='async-subscription-history'),
+    path('async/trial/status/', async_views.trial_status, name='async-trial-status'),
 ]
@@ -1,23 +1,66 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from celery.result import AsyncResult
+
 from rest_framework import viewsets, permissions, status, generics
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.http import Http404, StreamingHttpResponse
 from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.dateparse import parse_date
+from django.utils.http import quote_etag
 
-from apps.common.models import Subscription, SubscriptionHistory
+from apps.common import analytics
+from apps.common.audit import pending_history
+from apps.common.export import EXPORTS, FORMATS, ExportError, export_rows, parse_bound, stream_export
+from apps.common.models import Plan, Subscription, SubscriptionHistory
+from apps.common.tasks import import_users_file
+from apps.common.transitions import ConcurrentTransition, TransitionError, transition
+from apps.users import hashing
+from .caching import cached_user_response
+from .projection import ProjectionListMixin
+from .pagination import (
+    ApproximateCountPagination,
+    SubscriptionHistoryCursorPagination,
+    UserCursorPagination
+)
 from .serializers import (
     UserSerializer, 
     UserRegistrationSerializer, 
     SubscriptionSerializer, 
     SubscriptionHistorySerializer,
-    PasswordChangeSerializer
+    PasswordChangeSerializer,
+    PlanSerializer
 )
 
 User = get_user_model()
 
 
+def transition_error_response(error):
+    """
+    400 for a transition the current status does not allow, 409 when a
+    concurrent request changed the subscription first
+    """
+    if isinstance(error, ConcurrentTransition):
+        return Response({"detail": str(error)}, status=status.HTTP_409_CONFLICT)
+    return Response({"detail": str(error)}, status=status.HTTP_400_BAD_REQUEST)
+
+
 class UserViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing user accounts
@@ -25,6 +68,8 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = UserCursorPagination
+    query_budget = {'list': 2, 'retrieve': 2, 'me': 1}
     
     def get_permissions(self):
         """
@@ -56,8 +101,10 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         Endpoint to get current user's details
         """
-        serializer = self.get_serializer(request.user)
-        return Response(serializer.data)
+        def build():
+            return self.get_serializer(request.user).data, status.HTTP_200_OK
+        
+        return cached_user_response(request, 'me', build)
     
     @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
     def change_password(self, request):
@@ -66,14 +113,16 @@ class UserViewSet(viewsets.ModelViewSet):
         """
         serializer = PasswordChangeSerializer(data=request.data)
         if serializer.is_valid():
-            # Check old password
-            if not request.user.check_password(serializer.validated_data['old_password']):
+            # Check old password (on the password hashing pool)
+            if not hashing.check_password(request.user, serializer.validated_data['old_password']):
                 return Response({"old_password": ["Wrong password."]}, 
                                 status=status.HTTP_400_BAD_REQUEST)
             
             # Set new password
-            request.user.set_password(serializer.validated_data['new_password'])
-            request.user.save()
+            hashing.set_password(request.user, serializer.validated_data['new_password'])
+            # Only the password: a full save would write back the whole, possibly
+            # stale, user over a concurrent subscription transition
+            request.user.save(update_fields=['password'])
             return Response({"message": "Password updated successfully"}, 
                             status=status.HTTP_200_OK)
         
@@ -99,17 +148,11 @@ class UserViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Start the trial
-        user.start_trial()
-        
-        # Create subscription history record
-        subscription, created = Subscription.objects.get_or_create(user=user)
-        SubscriptionHistory.objects.create(
-            subscription=subscription,
-            action='trial_started',
-            new_plan='free',
-            notes='30-day free trial started'
-        )
+        # Start the trial and record it in the subscription history
+        try:
+            transition(user, 'start_trial')
+        except TransitionError as e:
+            return transition_error_response(e)
         
         return Response(
             {"detail": "Your 30-day free trial has been started."},
@@ -130,19 +173,11 @@ class UserViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Cancel the subscription
-        user.cancel_subscription()
-        
-        # Create subscription history record
-        subscription = Subscription.objects.get(user=user)
-        previous_plan = subscription.plan
-        
-        SubscriptionHistory.objects.create(
-            subscription=subscription,
-            action='cancelled',
-            previous_plan=previous_plan,
-            notes='Subscription cancelled by user'
-        )
+        # Cancel the subscription and record it in the subscription history
+        try:
+            transition(user, 'cancel')
+        except TransitionError as e:
+            return transition_error_response(e)
         
         return Response(
             {"detail": "Your subscription has been cancelled."},
@@ -157,6 +192,9 @@ class RegistrationAPIView(generics.CreateAPIView):
     queryset = User.objects.all()
     permission_classes = [permissions.AllowAny]
     serializer_class = UserRegistrationSerializer
+    # Two uniqueness checks, then one INSERT each for the user, subscription
+    # and, unless it is written behind, history
+    query_budget = 5
     
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -174,21 +212,169 @@ class RegistrationAPIView(generics.CreateAPIView):
         }, status=status.HTTP_201_CREATED)
 
 
-class SubscriptionViewSet(viewsets.ModelViewSet):
+class UserImportView(APIView):
+    """
+    API view for staff to bulk import users from an uploaded CSV or NDJSON file.
+    
+    The file is stored and imported by the import_users_file task; the
+    response links to UserImportStatusView for its outcome.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    parser_classes = [MultiPartParser]
+    
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+        
+        fmt = request.data.get('format') or os.path.splitext(upload.name)[1].lstrip('.').lower()
+        if fmt not in ('csv', 'ndjson'):
+            return Response({'format': ['Use csv or ndjson.']}, status=status.HTTP_400_BAD_REQUEST)
+        
+        name = default_storage.save(f'imports/{uuid.uuid4().hex}.{fmt}', upload)
+        task = import_users_file.delay(name, fmt)
+        
+        return Response({
+            'task_id': task.id,
+            'status_url': reverse('user-import-status', args=[task.id], request=request)
+        }, status=status.HTTP_202_ACCEPTED)
+
+
+class UserImportStatusView(APIView):
+    """
+    API view for staff to follow a bulk import: its state, then its totals
+    and per-row errors once it is done
+    """
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request, task_id):
+        result = AsyncResult(str(task_id))
+        if result.successful():
+            return Response({'state': 'done', **result.result})
+        if result.failed():
+            return Response({'state': 'failed', 'detail': 'The import stopped with an error.'})
+        return Response({'state': 'running' if result.state == 'STARTED' else 'pending'})
+
+
+class ExportView(APIView):
+    """
+    API view for staff to download every subscription or history row as a
+    streamed CSV or NDJSON file, optionally gzip-compressed.
+    
+    Query parameters: ``output`` (csv or ndjson), ``since`` and ``until``
+    (created_at bounds), ``action`` (history) or ``plan`` (subscriptions),
+    comma-separated, and ``compress=gzip``.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    
+    def get(self, request, kind):
+        if kind not in EXPORTS:
+            raise Http404
+        
+        fmt = request.query_params.get('output', 'csv')
+        if fmt not in FORMATS:
+            return Response({'output': ['Use csv or ndjson.']}, status=status.HTTP_400_BAD_REQUEST)
+        compress = request.query_params.get('compress') == 'gzip'
+        
+        choice_filter = EXPORTS[kind]['choice_filter']
+        choices = [value for value in request.query_params.get(choice_filter, '').split(',') if value]
+        try:
+            columns, rows = export_rows(
+                kind,
+                since=parse_bound(request.query_params.get('since'), 'since'),
+                until=parse_bound(request.query_params.get('until'), 'until'),
+                choices=choices,
+            )
+        except ExportError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        filename = f"{kind}.{fmt}" + ('.gz' if compress else '')
+        content_type = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(
+            stream_export(columns, rows, fmt, compress=compress),
+            content_type='application/gzip' if compress else f'{content_type}; charset=utf-8'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+
+
+class AnalyticsView(APIView):
+    """
+    Base API view for staff subscription analytics, read from the daily
+    rollup table rather than the subscription tables
+    """
+    permission_classes = [permissions.IsAdminUser]
+    query_budget = 1
+    default_days = 30
+    
+    def get_date(self, request, name, default):
+        value = request.query_params.get(name)
+        if not value:
+            return default
+        try:
+            day = parse_date(value)
+        except ValueError:
+            day = None
+        if day is None:
+            raise ValidationError({name: ['Enter a date in YYYY-MM-DD format.']})
+        return day
+    
+    def get_range(self, request):
+        until = self.get_date(request, 'until', timezone.localdate())
+        since = self.get_date(request, 'since', until - timedelta(days=self.default_days - 1))
+        if since > until:
+            raise ValidationError({'since': ['Must not be after until.']})
+        return since, until
+
+
+class MRRAnalyticsView(AnalyticsView):
+    """
+    MRR and active subscriptions by plan and billing cycle (``as_of``, default today)
+    """
+    
+    def get(self, request):
+        return Response(analytics.mrr_by_plan(self.get_date(request, 'as_of', timezone.localdate())))
+
+
+class TrialConversionAnalyticsView(AnalyticsView):
+    """
+    Trial-to-paid conversion between ``since`` and ``until`` (default the last 30 days)
+    """
+    
+    def get(self, request):
+        return Response(analytics.trial_conversion(*self.get_range(request)))
+
+
+class ChurnAnalyticsView(AnalyticsView):
+    """
+    Subscription and MRR churn between ``since`` and ``until`` (default the last 30 days)
+    """
+    
+    def get(self, request):
+        return Response(analytics.churn(*self.get_range(request)))
+
+
+class SubscriptionViewSet(ProjectionListMixin, viewsets.ModelViewSet):
     """
     ViewSet for managing subscriptions
     """
     serializer_class = SubscriptionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ApproximateCountPagination
+    projection_sources = {'user_email': 'user__email'}
+    # The unfiltered staff list reads the planner's row estimate, and counts
+    # exactly when the table is small
+    query_budget = {'list': 4, 'retrieve': 2, 'my_subscription': 2}
     
     def get_queryset(self):
         """
         Filter queryset to only show the current user's subscription unless staff
         """
         user = self.request.user
+        queryset = Subscription.objects.select_related('user', 'catalog_plan').order_by('id')
         if user.is_staff:
-            return Subscription.objects.all()
-        return Subscription.objects.filter(user=user)
+            return queryset
+        return queryset.filter(user=user)
     
     def perform_create(self, serializer):
         """
@@ -201,32 +387,49 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
         """
         Endpoint to get current user's subscription details
         """
-        try:
-            subscription = Subscription.objects.get(user=request.user)
-            serializer = self.get_serializer(subscription)
-            return Response(serializer.data)
-        except Subscription.DoesNotExist:
-            return Response(
-                {"detail": "You don't have any subscription."},
-                status=status.HTTP_404_NOT_FOUND
-            )
+        def build():
+            try:
+                subscription = Subscription.objects.select_related('catalog_plan').get(user=request.user)
+            except Subscription.DoesNotExist:
+                return {"detail": "You don't have any subscription."}, status.HTTP_404_NOT_FOUND
+            # Reuse the authenticated user instead of fetching it again
+            subscription.user = request.user
+            return self.get_serializer(subscription).data, status.HTTP_200_OK
+        
+        return cached_user_response(request, 'my-subscription', build)
 
 
-class SubscriptionHistoryViewSet(viewsets.ReadOnlyModelViewSet):
+class SubscriptionHistoryViewSet(ProjectionListMixin, viewsets.ReadOnlyModelViewSet):
     """
     ViewSet for viewing subscription history
     """
     serializer_class = SubscriptionHistorySerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = SubscriptionHistoryCursorPagination
+    projection_sources = {'user_email': 'subscription__user__email'}
+    # One more query on the list when the user has history events not yet written
+    query_budget = {'list': 3, 'retrieve': 2}
     
     def get_queryset(self):
         """
         Filter queryset to only show the current user's subscription history unless staff
         """
         user = self.request.user
+        queryset = SubscriptionHistory.objects.select_related('subscription__user')
         if user.is_staff:
-            return SubscriptionHistory.objects.all()
-        return SubscriptionHistory.objects.filter(subscription__user=user)
+            return queryset
+        return queryset.filter(subscription__user=user)
+    
+    def list(self, request, *args, **kwargs):
+        response = super().list(request, *args, **kwargs)
+        
+        # The user's own events still on their way through the write-behind
+        # log head the first page, so they can read their writes
+        if self.paginator.cursor_query_param not in request.query_params:
+            pending = pending_history(request.user)
+            if pending:
+                response.data['results'][:0] = self.get_serializer(pending, many=True).data
+        return response
 
 
 class CheckTrialStatusView(APIView):
@@ -234,20 +437,30 @@ class CheckTrialStatusView(APIView):
     API view to check trial status and expiration
     """
     permission_classes = [permissions.IsAuthenticated]
+    query_budget = 1
     
     def get(self, request):
         user = request.user
+        now = timezone.now()
+        
+        # The representation changes with the number of days left, not only
+        # with the stored trial fields
+        variant = ''
+        if user.is_on_trial and user.trial_end_date:
+            variant = str((user.trial_end_date - now).days) if user.trial_end_date > now else 'expired'
         
+        return cached_user_response(request, 'trial-status', lambda: self.build(user, now), variant)
+    
+    def build(self, user, now):
         if not user.is_on_trial:
-            return Response({
+            return {
                 "is_on_trial": False,
                 "message": "You are not currently on a trial."
-            })
+            }, status.HTTP_200_OK
         
         days_left = 0
         if user.trial_end_date:
             # Calculate days left in trial
-            now = timezone.now()
             if user.trial_end_date > now:
                 days_left = (user.trial_end_date - now).days
                 
@@ -263,10 +476,49 @@ class CheckTrialStatusView(APIView):
         else:
             message = "Trial information is incomplete."
         
-        return Response({
+        return {
             "is_on_trial": user.is_on_trial,
             "trial_start_date": user.trial_start_date,
             "trial_end_date": user.trial_end_date,
             "days_left": days_left,
             "message": message
-        })
+        }, status.HTTP_200_OK
+
+
+class PlanCatalogView(APIView):
+    """
+    API view listing the plan catalog, served from process memory
+    """
+    authentication_classes = []
+    permission_classes = [permissions.AllowAny]
+    query_budget = 1
+    
+    _catalog = None
+    _lock = threading.Lock()
+    
+    @classmethod
+    def get_catalog(cls):
+        """
+        Return the serialized catalog and its ETag, rebuilt at most once per
+        PLAN_CATALOG_TIMEOUT seconds in each process
+        """
+        catalog = cls._catalog
+        if catalog is None or catalog[0] < time.monotonic():
+            with cls._lock:
+                catalog = cls._catalog
+                if catalog is None or catalog[0] < time.monotonic():
+                    data = PlanSerializer(Plan.objects.all(), many=True).data
+                    etag = quote_etag(hashlib.md5(JSONRenderer().render(data)).hexdigest())
+                    catalog = (time.monotonic() + settings.PLAN_CATALOG_TIMEOUT, data, etag)
+                    cls._catalog = catalog
+        return catalog[1], catalog[2]
+    
+    def get(self, request):
+        data, etag = self.get_catalog()
+        
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = Response(data)
+            response['ETag'] = etag
+        response['Cache-Control'] = f'public, max-age={settings.PLAN_CATALOG_TIMEOUT}'
+        return response
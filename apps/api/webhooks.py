@@ -0,0 +1,40 @@
+import hashlib
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+
+from apps.common.models import WebhookEvent
+
+
+def verify_signature(body, signature):
+    """
+    Check the X-Razorpay-Signature header, an HMAC-SHA256 of the raw body
+    """
+    secret = settings.RAZORPAY_WEBHOOK_SECRET
+    if not secret or not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature)
+
+
+@csrf_exempt
+@require_POST
+def razorpay_webhook(request):
+    """
+    Receive a Razorpay webhook.
+    
+    The raw event is only verified and appended to the inbox; parsing and
+    applying it is left to the process_webhook_events task so the gateway
+    gets its response within a few milliseconds.
+    """
+    body = request.body
+    if not verify_signature(body, request.headers.get('X-Razorpay-Signature')):
+        return HttpResponseForbidden()
+    
+    # Redeliveries keep their event id, so the unique event_id drops them
+    event_id = request.headers.get('X-Razorpay-Event-Id') or hashlib.sha256(body).hexdigest()
+    WebhookEvent.objects.bulk_create([WebhookEvent(event_id=event_id, body=body.decode())], ignore_conflicts=True)
+    return HttpResponse(status=202)
@@ -1,22 +1,26 @@
 from django.contrib import admin
 from django.utils.translation import gettext_lazy as _
 
-from .models import Subscription, SubscriptionHistory
+from .admin_mixins import LargeTableAdminMixin
+from .models import Plan, Subscription, SubscriptionDailyRollup, SubscriptionHistory
 
 
 @admin.register(Subscription)
-class SubscriptionAdmin(admin.ModelAdmin):
+class SubscriptionAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     """
     Admin configuration for Subscription model
     """
     list_display = ('user', 'plan', 'is_active', 'start_date', 'end_date', 'billing_cycle')
     list_filter = ('plan', 'is_active', 'billing_cycle', 'auto_renew')
+    list_select_related = ('user',)
     search_fields = ('user__email', 'user__username', 'razorpay_subscription_id')
+    email_search_field = 'user__email'
+    raw_id_fields = ('user', 'catalog_plan')
     readonly_fields = ('created_at', 'updated_at')
     date_hierarchy = 'start_date'
     
     fieldsets = (
-        (None, {'fields': ('user', 'plan', 'is_active')}),
+        (None, {'fields': ('user', 'plan', 'catalog_plan', 'is_active')}),
         (_('Dates'), {'fields': ('start_date', 'end_date', 'created_at', 'updated_at')}),
         (_('Billing'), {'fields': ('amount', 'currency', 'billing_cycle', 'auto_renew')}),
         (_('Razorpay'), {'fields': ('razorpay_subscription_id', 'razorpay_payment_id')}),
@@ -24,13 +28,16 @@ class SubscriptionAdmin(admin.ModelAdmin):
 
 
 @admin.register(SubscriptionHistory)
-class SubscriptionHistoryAdmin(admin.ModelAdmin):
+class SubscriptionHistoryAdmin(LargeTableAdminMixin, admin.ModelAdmin):
     """
     Admin configuration for SubscriptionHistory model
     """
     list_display = ('subscription', 'action', 'created_at', 'previous_plan', 'new_plan')
     list_filter = ('action', 'created_at')
+    list_select_related = ('subscription__user',)
     search_fields = ('subscription__user__email', 'payment_id', 'notes')
+    email_search_field = 'subscription__user__email'
+    raw_id_fields = ('subscription',)
     readonly_fields = ('created_at', 'updated_at')
     date_hierarchy = 'created_at'
     
@@ -40,3 +47,34 @@ class SubscriptionHistoryAdmin(admin.ModelAdmin):
         (_('Payment'), {'fields': ('payment_id', 'amount')}),
         (_('Additional Information'), {'fields': ('notes', 'created_at', 'updated_at')}),
     )
+
+
+@admin.register(Plan)
+class PlanAdmin(admin.ModelAdmin):
+    """
+    Admin configuration for Plan model
+    """
+    list_display = ('name', 'period', 'interval', 'amount', 'currency', 'razorpay_plan_id')
+    list_filter = ('period', 'currency')
+    search_fields = ('name', 'razorpay_plan_id')
+    readonly_fields = ('razorpay_item_id', 'razorpay_plan_id', 'created_at', 'updated_at')
+
+
+@admin.register(SubscriptionDailyRollup)
+class SubscriptionDailyRollupAdmin(admin.ModelAdmin):
+    """
+    Read-only admin for the analytics rollup, which only the rollup task writes
+    """
+    list_display = ('day', 'plan', 'billing_cycle', 'trials_started', 'conversions',
+                    'activations', 'cancellations', 'new_mrr', 'churned_mrr')
+    list_filter = ('plan', 'billing_cycle')
+    date_hierarchy = 'day'
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,234 @@
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    Case, Count, DecimalField, Exists, ExpressionWrapper, F, Max, OuterRef, Q, Sum, Value, When
+)
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from apps.common.models import JobCheckpoint, SubscriptionDailyRollup, SubscriptionHistory
+
+ROLLUP_CHECKPOINT = 'subscription-analytics-rollup'
+
+COUNTERS = {
+    'trials_started': Q(action='trial_started'),
+    'trials_ended': Q(action='trial_ended'),
+    'activations': Q(action='created'),
+    'conversions': Q(action='created', had_trial=True),
+    'renewals': Q(action='renewed'),
+    'cancellations': Q(action='cancelled'),
+    'payment_failures': Q(action='payment_failed'),
+}
+AMOUNTS = {
+    'new_mrr': ('monthly_value', Q(action='created')),
+    'churned_mrr': ('monthly_value', Q(action='cancelled')),
+    'renewal_revenue': ('value', Q(action='renewed')),
+}
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+CENT = Decimal('0.01')
+
+
+def _history_buckets(after, upto):
+    """
+    Aggregate the history rows with after < id <= upto per day (in the
+    project time zone), plan and billing cycle
+    """
+    had_trial = SubscriptionHistory.objects.filter(
+        subscription_id=OuterRef('subscription_id'),
+        action='trial_started',
+        id__lt=OuterRef('id'),
+    )
+    value = Coalesce('amount', 'subscription__amount', output_field=MONEY)
+    months = Case(
+        When(subscription__billing_cycle='quarterly', then=Value(3)),
+        When(subscription__billing_cycle='yearly', then=Value(12)),
+        default=Value(1),
+    )
+
+    aggregates = {name: Count('id', filter=condition) for name, condition in COUNTERS.items()}
+    aggregates.update({
+        name: Sum(field, filter=condition, default=0) for name, (field, condition) in AMOUNTS.items()
+    })
+
+    return (
+        SubscriptionHistory.objects
+        .filter(id__gt=after, id__lte=upto)
+        .annotate(
+            day=TruncDate('created_at'),
+            bucket_plan=Coalesce('new_plan', 'previous_plan', 'subscription__plan'),
+            bucket_cycle=F('subscription__billing_cycle'),
+            value=value,
+            monthly_value=ExpressionWrapper(value / months, output_field=MONEY),
+            had_trial=Exists(had_trial),
+        )
+        .values('day', 'bucket_plan', 'bucket_cycle')
+        .annotate(**aggregates)
+        .order_by()
+    )
+
+
+def _apply_buckets(buckets):
+    """
+    Add aggregated buckets into the rollup table
+    """
+    buckets = list(buckets)
+    if not buckets:
+        return 0
+
+    existing = {
+        (rollup.day, rollup.plan, rollup.billing_cycle): rollup
+        for rollup in SubscriptionDailyRollup.objects.select_for_update().filter(
+            day__in={bucket['day'] for bucket in buckets},
+            plan__in={bucket['bucket_plan'] for bucket in buckets},
+            billing_cycle__in={bucket['bucket_cycle'] for bucket in buckets},
+        )
+    }
+
+    fields = list(COUNTERS) + list(AMOUNTS)
+    created, updated = [], []
+    for bucket in buckets:
+        key = (bucket['day'], bucket['bucket_plan'], bucket['bucket_cycle'])
+        rollup = existing.get(key)
+        if rollup is None:
+            rollup = SubscriptionDailyRollup(day=key[0], plan=key[1], billing_cycle=key[2])
+            created.append(rollup)
+        else:
+            updated.append(rollup)
+        for field in fields:
+            increment = bucket[field] or 0
+            if field in AMOUNTS:
+                increment = Decimal(increment).quantize(CENT)
+            setattr(rollup, field, getattr(rollup, field) + increment)
+
+    now = timezone.now()
+    for rollup in updated:
+        rollup.updated_at = now
+    SubscriptionDailyRollup.objects.bulk_create(created)
+    SubscriptionDailyRollup.objects.bulk_update(updated, fields + ['updated_at'])
+    return len(buckets)
+
+
+def rollup_subscription_history(batch_size=None, lag=None):
+    """
+    Fold the history rows added since the last watermark into the daily
+    rollup table, ``batch_size`` rows per transaction.
+
+    The watermark is the last history id folded in, stored in a
+    JobCheckpoint and advanced in the same transaction as the rollup rows,
+    so each history row is counted exactly once even if the task dies. Rows
+    inserted less than ``lag`` seconds ago are left for the next run, giving
+    transactions that drew lower ids time to commit. Insertion time is
+    updated_at: history rows are never updated, and written-behind rows keep
+    the created_at of their event.
+    """
+    batch_size = batch_size or settings.ANALYTICS_ROLLUP_BATCH_SIZE
+    lag = settings.ANALYTICS_ROLLUP_LAG if lag is None else lag
+    cutoff = timezone.now() - datetime.timedelta(seconds=lag)
+    totals = {'processed': 0, 'buckets': 0, 'watermark': None}
+
+    while True:
+        with transaction.atomic():
+            checkpoint, _ = JobCheckpoint.objects.get_or_create(name=ROLLUP_CHECKPOINT)
+            checkpoint = JobCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+
+            pending = SubscriptionHistory.objects.filter(id__gt=checkpoint.position, updated_at__lt=cutoff)
+            upto = pending.order_by('id').values_list('id', flat=True)[batch_size - 1:batch_size].first()
+            if upto is None:
+                upto = pending.aggregate(upto=Max('id'))['upto']
+            if upto is None:
+                totals['watermark'] = checkpoint.position
+                return totals
+
+            processed = SubscriptionHistory.objects.filter(id__gt=checkpoint.position, id__lte=upto).count()
+            totals['buckets'] += _apply_buckets(_history_buckets(checkpoint.position, upto))
+            totals['processed'] += processed
+
+            checkpoint.position = upto
+            checkpoint.save(update_fields=['position', 'updated_at'])
+
+
+def _ratio(numerator, denominator):
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def _money(value):
+    return Decimal(value or 0).quantize(CENT)
+
+
+def mrr_by_plan(as_of):
+    """
+    MRR and active subscriptions per plan and billing cycle at the end of
+    ``as_of``, net of activations and cancellations
+    """
+    rows = (
+        SubscriptionDailyRollup.objects
+        .filter(day__lte=as_of)
+        .values('plan', 'billing_cycle')
+        .annotate(
+            mrr=Sum(F('new_mrr') - F('churned_mrr')),
+            active_subscriptions=Sum(F('activations') - F('cancellations')),
+        )
+        .order_by('plan', 'billing_cycle')
+    )
+    breakdown = [
+        {
+            'plan': row['plan'],
+            'billing_cycle': row['billing_cycle'],
+            'mrr': _money(row['mrr']),
+            'active_subscriptions': row['active_subscriptions'],
+        }
+        for row in rows
+        if row['mrr'] or row['active_subscriptions']
+    ]
+    return {
+        'as_of': as_of,
+        'mrr': sum((row['mrr'] for row in breakdown), Decimal('0.00')),
+        'active_subscriptions': sum(row['active_subscriptions'] for row in breakdown),
+        'breakdown': breakdown,
+    }
+
+
+def trial_conversion(since, until):
+    """
+    Trials started and ended, and activations of subscriptions that had a
+    trial, between ``since`` and ``until`` inclusive
+    """
+    totals = SubscriptionDailyRollup.objects.filter(day__gte=since, day__lte=until).aggregate(
+        trials_started=Sum('trials_started', default=0),
+        trials_ended=Sum('trials_ended', default=0),
+        conversions=Sum('conversions', default=0),
+    )
+    return {
+        'since': since,
+        'until': until,
+        **totals,
+        'conversion_rate': _ratio(totals['conversions'], totals['trials_started']),
+    }
+
+
+def churn(since, until):
+    """
+    Cancellations between ``since`` and ``until`` inclusive, as a share of
+    the subscriptions and MRR active when the period began
+    """
+    aggregates = {
+        'starting_subscriptions': Sum(F('activations') - F('cancellations'), filter=Q(day__lt=since), default=0),
+        'starting_mrr': Sum(F('new_mrr') - F('churned_mrr'), filter=Q(day__lt=since), default=0),
+        'cancellations': Sum('cancellations', filter=Q(day__gte=since), default=0),
+        'churned_mrr': Sum('churned_mrr', filter=Q(day__gte=since), default=0),
+    }
+    totals = SubscriptionDailyRollup.objects.filter(day__lte=until).aggregate(**aggregates)
+    return {
+        'since': since,
+        'until': until,
+        'starting_subscriptions': totals['starting_subscriptions'],
+        'starting_mrr': _money(totals['starting_mrr']),
+        'cancellations': totals['cancellations'],
+        'churned_mrr': _money(totals['churned_mrr']),
+        'churn_rate': _ratio(totals['cancellations'], totals['starting_subscriptions']),
+        'mrr_churn_rate': _ratio(totals['churned_mrr'], totals['starting_mrr']),
+    }
@@ -0,0 +1,383 @@
+"""
+Write-behind log for SubscriptionHistory.
+
+Inserting a history row on the request path costs a round trip and index
+maintenance on one of the busiest tables. record_history() instead buffers
+the event in memory once the surrounding transaction commits. A background
+thread in each process moves buffered events into a local durable queue (a
+SQLite file shared by the processes on the host, AUDIT_QUEUE_PATH) and from
+there into the database with multi-row inserts.
+
+Every event carries a unique ``event_id``. Events leave the local queue only
+after the insert holding them has committed, and that insert skips event
+ids already in the table, so an event that reached the queue is written
+exactly once, even if a flusher dies between the two steps or two processes
+drain the same events. An event that can never be written, e.g. because
+its subscription was deleted meanwhile, is moved to a dead-letter table in
+the same SQLite file instead of holding up the events behind it.
+
+Until it is written, an event is also kept in the shared cache under a key
+of its own, numbered by a per-user counter, and the user's own history
+listing merges it in (read-your-writes).
+"""
+import atexit
+import json
+import logging
+import os
+import sqlite3
+import threading
+import uuid
+from contextlib import closing
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DataError, IntegrityError, close_old_connections, connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.common.cache import drop_user_versions
+from apps.common.models import Subscription, SubscriptionHistory
+
+logger = logging.getLogger(__name__)
+
+# History columns carried by an event besides its id, user and timestamp
+FIELDS = ('subscription_id', 'action', 'previous_plan', 'new_plan', 'payment_id', 'amount', 'notes')
+
+# Most unwritten events kept per user for read-your-writes
+PENDING_LIMIT = 50
+
+
+def _pending_key(user_id, seq):
+    return f"audit-pending:{user_id}:{seq}"
+
+
+def _pending_seq_key(user_id):
+    return f"audit-pending-seq:{user_id}"
+
+
+def _pending_keys(user_id, seq):
+    """
+    Cache keys of the user's PENDING_LIMIT latest events, oldest first
+    """
+    return [_pending_key(user_id, n) for n in range(max(1, seq - PENDING_LIMIT + 1), seq + 1)]
+
+
+def _encode(history, user_id):
+    event = {field: getattr(history, field) for field in FIELDS}
+    event.update(event_id=str(history.event_id), user_id=user_id, created_at=history.created_at)
+    return json.loads(json.dumps(event, cls=DjangoJSONEncoder))
+
+
+def _decode(event):
+    fields = {field: event[field] for field in FIELDS}
+    if fields['amount'] is not None:
+        fields['amount'] = Decimal(fields['amount'])
+    created_at = parse_datetime(event['created_at'])
+    return SubscriptionHistory(
+        event_id=uuid.UUID(event['event_id']),
+        created_at=created_at,
+        updated_at=created_at,
+        **fields
+    )
+
+
+class LocalQueue:
+    """
+    Durable FIFO of encoded events in a SQLite file shared by the processes on a host
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=FULL')
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS events '
+            '(id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL)'
+        )
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS dead_events '
+            '(id INTEGER PRIMARY KEY AUTOINCREMENT, payload TEXT NOT NULL, '
+            'error TEXT NOT NULL, failed_at TEXT NOT NULL)'
+        )
+        return db
+
+    def put(self, events):
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany(
+                'INSERT INTO events (payload) VALUES (?)',
+                [(json.dumps(event),) for event in events]
+            )
+            db.execute('COMMIT')
+
+    def take(self, limit):
+        """
+        Return the ``limit`` oldest (id, event) pairs without removing them
+        """
+        with closing(self._connect()) as db:
+            rows = db.execute('SELECT id, payload FROM events ORDER BY id LIMIT ?', (limit,)).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def ack(self, last_id, dead=()):
+        """
+        Remove the events up to ``last_id``; ids only grow, so these are
+        exactly the events returned by the take() that ended at it. The
+        (event, error) pairs in ``dead`` are moved to the dead-letter table
+        in the same transaction.
+        """
+        failed_at = timezone.now().isoformat()
+        with closing(self._connect()) as db:
+            db.execute('BEGIN IMMEDIATE')
+            db.executemany(
+                'INSERT INTO dead_events (payload, error, failed_at) VALUES (?, ?, ?)',
+                [(json.dumps(event), error, failed_at) for event, error in dead]
+            )
+            db.execute('DELETE FROM events WHERE id <= ?', (last_id,))
+            db.execute('COMMIT')
+
+    def count(self):
+        with closing(self._connect()) as db:
+            return db.execute('SELECT COUNT(*) FROM events').fetchone()[0]
+
+    def dead_count(self):
+        with closing(self._connect()) as db:
+            return db.execute('SELECT COUNT(*) FROM dead_events').fetchone()[0]
+
+
+def write_events(events):
+    """
+    Insert events into SubscriptionHistory with multi-row inserts, skipping
+    those whose event_id is already there
+    """
+    histories = [_decode(event) for event in events]
+    now = timezone.now()
+    for history in histories:
+        history.updated_at = now
+
+    fields = [field for field in SubscriptionHistory._meta.concrete_fields if not field.primary_key]
+    batch_size = connection.ops.bulk_batch_size(fields, histories)
+    with transaction.atomic():
+        for start in range(0, len(histories), batch_size):
+            # A raw insert keeps created_at at the time of the event, where
+            # bulk_create would stamp it with the time of the flush
+            SubscriptionHistory.objects._insert(
+                histories[start:start + batch_size], fields, raw=True, on_conflict=OnConflict.IGNORE
+            )
+        # Foreign keys are deferred; check them here so a violation fails
+        # this block even when it is a savepoint
+        connection.check_constraints(table_names=[SubscriptionHistory._meta.db_table])
+        # Raw inserts bypass the model signals that invalidate cached responses
+        drop_user_versions({event['user_id'] for event in events})
+
+
+def write_each(events):
+    """
+    Write events one at a time, returning (event, error) pairs for those
+    the database rejects
+    """
+    dead = []
+    for event in events:
+        try:
+            write_events([event])
+        except (IntegrityError, DataError) as e:
+            logger.error(f"History event {event['event_id']} cannot be written, moving it to dead letters: {e}")
+            dead.append((event, str(e)))
+    return dead
+
+
+def _forget(events):
+    """
+    Drop written events from their users' read-your-writes entries
+    """
+    cache.delete_many([event['pending_key'] for event in events if 'pending_key' in event])
+
+
+class AuditLog:
+    """
+    Per-process event buffer and background flusher in front of the local queue
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+        self._pid = None
+        self._buffer = []
+        self._wake = None
+        self._lock = threading.Lock()
+        self._flushing = threading.Lock()
+
+    def _start(self):
+        # Threads do not survive a fork, so each worker starts its own flusher
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._buffer = []
+                    self._wake = threading.Event()
+                    threading.Thread(target=self._run, name='audit-flusher', daemon=True).start()
+                    atexit.register(self.flush)
+                    self._pid = os.getpid()
+
+    def enqueue(self, event):
+        self._start()
+
+        # One key per event, numbered atomically, so concurrent writers and
+        # flushers never overwrite each other's changes to a shared list
+        seq_key = _pending_seq_key(event['user_id'])
+        cache.add(seq_key, 0, timeout=settings.AUDIT_PENDING_TIMEOUT)
+        seq = cache.incr(seq_key)
+        cache.touch(seq_key, timeout=settings.AUDIT_PENDING_TIMEOUT)
+        event['pending_key'] = _pending_key(event['user_id'], seq)
+        cache.set(event['pending_key'], event, timeout=settings.AUDIT_PENDING_TIMEOUT)
+
+        with self._lock:
+            self._buffer.append(event)
+            full = len(self._buffer) >= settings.AUDIT_BUFFER_SIZE
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait(settings.AUDIT_FLUSH_INTERVAL)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Audit log flush failed, retrying on the next round")
+                connection.close()
+
+    def spool(self):
+        """
+        Move the buffered events into the local queue
+        """
+        with self._lock:
+            events, self._buffer = self._buffer, []
+        if not events:
+            return 0
+
+        try:
+            self.queue.put(events)
+        except Exception:
+            with self._lock:
+                self._buffer[:0] = events
+            raise
+        return len(events)
+
+    def drain(self, batch_size=None):
+        """
+        Write the events in the local queue to the database, oldest first,
+        and return how many were written.
+
+        A batch the database rejects is written again event by event, and
+        the events that still fail are moved to the dead-letter table.
+        """
+        batch_size = batch_size or settings.AUDIT_FLUSH_BATCH_SIZE
+        written = 0
+        close_old_connections()
+        while True:
+            batch = self.queue.take(batch_size)
+            if not batch:
+                return written
+
+            events = [event for _, event in batch]
+            try:
+                write_events(events)
+                dead = []
+            except (IntegrityError, DataError):
+                dead = write_each(events)
+            self.queue.ack(batch[-1][0], dead)
+            _forget(events)
+            written += len(events) - len(dead)
+            if len(batch) < batch_size:
+                return written
+
+    def flush(self):
+        with self._flushing:
+            self.spool()
+            return self.drain()
+
+
+log = AuditLog(LocalQueue(settings.AUDIT_QUEUE_PATH))
+
+
+def record_history(user_id, subscription_id, action, **fields):
+    """
+    Record a SubscriptionHistory event for the user's subscription and
+    return its (unsaved) row.
+
+    With AUDIT_WRITE_BEHIND the event is handed to the write-behind log when
+    the current transaction commits, and dropped if it rolls back. Otherwise
+    the row is inserted right away.
+    """
+    now = timezone.now()
+    history = SubscriptionHistory(
+        subscription_id=subscription_id,
+        action=action,
+        event_id=uuid.uuid4(),
+        created_at=now,
+        updated_at=now,
+        **fields
+    )
+    # The subscription's user is known, so the history signal needs no lookup
+    history.subscription = Subscription(pk=subscription_id, user_id=user_id)
+
+    if not settings.AUDIT_WRITE_BEHIND:
+        history.save(force_insert=True)
+        return history
+
+    event = _encode(history, user_id)
+    transaction.on_commit(lambda: log.enqueue(event))
+    return history
+
+
+def _unwritten(user, events, written):
+    histories = []
+    for event in reversed(events):
+        if event['event_id'] in written:
+            continue
+        history = _decode(event)
+        history.subscription = Subscription(pk=history.subscription_id, user=user)
+        histories.append(history)
+    return histories
+
+
+def pending_history(user):
+    """
+    The user's recorded history events not yet written, newest first
+    """
+    seq = cache.get(_pending_seq_key(user.pk))
+    if not seq:
+        return []
+    keys = _pending_keys(user.pk, seq)
+    found = cache.get_many(keys)
+    events = [found[key] for key in keys if key in found]
+    if not events:
+        return []
+    written = {
+        str(event_id) for event_id in SubscriptionHistory.objects.filter(
+            event_id__in=[event['event_id'] for event in events]
+        ).values_list('event_id', flat=True)
+    }
+    return _unwritten(user, events, written)
+
+
+async def apending_history(user):
+    seq = await cache.aget(_pending_seq_key(user.pk))
+    if not seq:
+        return []
+    keys = _pending_keys(user.pk, seq)
+    found = await cache.aget_many(keys)
+    events = [found[key] for key in keys if key in found]
+    if not events:
+        return []
+    written = {
+        str(event_id) async for event_id in SubscriptionHistory.objects.filter(
+            event_id__in=[event['event_id'] for event in events]
+        ).values_list('event_id', flat=True)
+    }
+    return _unwritten(user, events, written)
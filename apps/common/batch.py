@@ -0,0 +1,234 @@
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.common.cache import bump_user_version, drop_user_versions
+from apps.common.models import JobCheckpoint, Subscription, SubscriptionHistory
+from apps.common.utils import RazorpayClient
+from apps.users.snapshots import invalidate_user_snapshots
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+# Razorpay subscription statuses during which the subscription is usable
+ACTIVE_RAZORPAY_STATUSES = ('authenticated', 'active')
+
+# User.subscription_status implied by a Razorpay subscription status
+USER_STATUSES = {
+    'authenticated': 'active',
+    'active': 'active',
+    'cancelled': 'cancelled',
+    'completed': 'expired',
+    'expired': 'expired',
+    'halted': 'expired',
+}
+
+# SubscriptionHistory action recorded when reconciliation finds a
+# subscription in a Razorpay status
+RECONCILED_ACTIONS = {
+    'authenticated': 'created',
+    'active': 'renewed',
+    'cancelled': 'cancelled',
+    'completed': 'cancelled',
+    'expired': 'cancelled',
+    'halted': 'payment_failed',
+}
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter spacing calls evenly at ``rate`` calls per second
+    """
+    
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self.next_slot = time.monotonic()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+def _timestamp(value):
+    if not value:
+        return None
+    return datetime.datetime.fromtimestamp(value, tz=datetime.timezone.utc)
+
+
+def apply_razorpay_subscription(subscription, payload):
+    """
+    Copy the state of a Razorpay subscription payload onto a local
+    Subscription. Returns the names of the fields that changed.
+    """
+    values = {
+        'is_active': payload.get('status') in ACTIVE_RAZORPAY_STATUSES,
+        'start_date': _timestamp(payload.get('current_start')) or subscription.start_date,
+        'end_date': _timestamp(payload.get('current_end')) or subscription.end_date,
+    }
+    changed = [name for name, value in values.items() if getattr(subscription, name) != value]
+    for name in changed:
+        setattr(subscription, name, values[name])
+    return changed
+
+
+class ReconcileSubscriptions:
+    """
+    Refresh local subscriptions, and the status of their users, from
+    Razorpay's view of them
+    """
+    name = 'reconcile_razorpay_subscriptions'
+    fields = ['is_active', 'start_date', 'end_date', 'updated_at']
+    
+    def __init__(self):
+        # Razorpay status of each changed subscription in the current chunk
+        self.statuses = {}
+    
+    def queryset(self):
+        return Subscription.objects.filter(
+            razorpay_subscription_id__isnull=False
+        ).exclude(razorpay_subscription_id='').select_related('user')
+    
+    def fetch(self, client, subscription):
+        # Reconciliation needs the gateway's current state; the result still
+        # refreshes the read-through cache
+        return client.get_subscription(subscription.razorpay_subscription_id, use_cache=False)
+    
+    def apply(self, subscription, payload):
+        changed = apply_razorpay_subscription(subscription, payload)
+        user_status = USER_STATUSES.get(payload.get('status'))
+        if not changed and user_status in (None, subscription.user.subscription_status):
+            return False
+        # bulk_update does not apply auto_now
+        subscription.updated_at = timezone.now()
+        self.statuses[subscription.pk] = payload.get('status')
+        return True
+    
+    def write(self, subscriptions):
+        Subscription.objects.bulk_update(subscriptions, self.fields)
+        
+        # One UPDATE per distinct target status, bumping the version the
+        # transitions compare against (see apps.common.transitions)
+        by_status = {}
+        history = []
+        for subscription in subscriptions:
+            status = self.statuses.pop(subscription.pk)
+            if USER_STATUSES.get(status, subscription.user.subscription_status) != subscription.user.subscription_status:
+                by_status.setdefault(USER_STATUSES[status], []).append(subscription.user_id)
+            if status in RECONCILED_ACTIONS:
+                history.append(SubscriptionHistory(
+                    subscription=subscription,
+                    action=RECONCILED_ACTIONS[status],
+                    new_plan=subscription.plan,
+                    notes=f"Reconciled with Razorpay status {status}"
+                ))
+        for user_status, user_ids in by_status.items():
+            updates = {'subscription_status': user_status, 'state_version': F('state_version') + 1}
+            if user_status == 'active':
+                updates['is_on_trial'] = False
+            User.objects.filter(id__in=user_ids).update(**updates)
+        SubscriptionHistory.objects.bulk_create(history)
+        
+        # Bulk writes bypass the model signals that invalidate caches
+        user_ids = [subscription.user_id for subscription in subscriptions]
+        for user_id in user_ids:
+            bump_user_version(user_id)
+        invalidate_user_snapshots(user_ids)
+
+
+class BackfillCustomers:
+    """
+    Create the missing Razorpay customers of users
+    """
+    name = 'backfill_razorpay_customers'
+    fields = ['razorpay_customer_id']
+    
+    def queryset(self):
+        return User.objects.filter(razorpay_customer_id__isnull=True).only(
+            'id', 'email', 'first_name', 'last_name', 'username', 'phone_number', 'razorpay_customer_id'
+        )
+    
+    def fetch(self, client, user):
+        name = user.get_full_name() or user.username
+        # Repeating the call for a user already created upstream returns the same customer
+        return client.create_customer(name, user.email, user.phone_number, fail_existing=False)
+    
+    def apply(self, user, payload):
+        user.razorpay_customer_id = payload['id']
+        return True
+    
+    def write(self, users):
+        User.objects.bulk_update(users, self.fields)
+        
+        # Bulk writes bypass the model signals that invalidate caches
+        user_ids = [user.pk for user in users]
+        drop_user_versions(user_ids)
+        invalidate_user_snapshots(user_ids)
+
+
+JOBS = {job.name: job for job in (ReconcileSubscriptions, BackfillCustomers)}
+
+
+def run_razorpay_batch(job_name, chunk_size=None, workers=None, rate=None, restart=False):
+    """
+    Run a Razorpay batch job over its rows in primary key order.
+    
+    Each chunk's gateway calls are fanned out over a bounded thread pool
+    while a shared limiter keeps them under ``rate`` requests per second.
+    Changed rows are written with bulk statements once per chunk, and the
+    last processed primary key is checkpointed in the same transaction, so an
+    interrupted run resumes after the last committed chunk.
+    """
+    job = JOBS[job_name]()
+    chunk_size = chunk_size or settings.RAZORPAY_BATCH_CHUNK_SIZE
+    workers = workers or settings.RAZORPAY_BATCH_WORKERS
+    limiter = RateLimiter(rate or settings.RAZORPAY_BATCH_RATE)
+    client = RazorpayClient()
+    
+    checkpoint, _ = JobCheckpoint.objects.get_or_create(name=job.name)
+    if restart:
+        checkpoint.position = 0
+    
+    def fetch(row):
+        limiter.acquire()
+        return job.fetch(client, row)
+    
+    totals = {'processed': 0, 'updated': 0, 'failed': 0, 'resumed_from': checkpoint.position}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            rows = list(job.queryset().filter(pk__gt=checkpoint.position).order_by('pk')[:chunk_size])
+            if not rows:
+                break
+            
+            changed = []
+            for row, payload in zip(rows, pool.map(fetch, rows)):
+                if payload is None:
+                    totals['failed'] += 1
+                elif job.apply(row, payload):
+                    changed.append(row)
+            
+            with transaction.atomic():
+                job.write(changed)
+                checkpoint.position = rows[-1].pk
+                checkpoint.save(update_fields=['position', 'updated_at'])
+            
+            totals['processed'] += len(rows)
+            totals['updated'] += len(changed)
+            logger.info(f"{job.name}: processed up to id {checkpoint.position}")
+    
+    # The run is complete; the next one starts from the beginning
+    checkpoint.position = 0
+    checkpoint.save(update_fields=['position', 'updated_at'])
+    return totals
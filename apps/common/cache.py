@@ -0,0 +1,64 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+
+def _version_key(user_id):
+    return f'user-version:{user_id}'
+
+
+def _stamp(moment=None):
+    """Microsecond timestamp used as a per-user version"""
+    return int((moment or timezone.now()).timestamp() * 1_000_000)
+
+
+def get_user_version(user_id):
+    """
+    Return the version of the user's cached data.
+    
+    Versions are microsecond timestamps of the last change to the user,
+    their subscription or its history, so they double as Last-Modified.
+    Users whose version was dropped get a fresh one stamped now.
+    """
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _stamp(), timeout=None)
+        version = cache.get(key) or _stamp()
+    return version
+
+
+async def aget_user_version(user_id):
+    """
+    Async counterpart of get_user_version
+    """
+    key = _version_key(user_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, _stamp(), timeout=None)
+        version = await cache.aget(key) or _stamp()
+    return version
+
+
+def bump_user_version(user_id, modified=None):
+    """
+    Move the user's version forward once the current transaction commits,
+    so cached representations are rebuilt from committed data
+    """
+    def bump():
+        key = _version_key(user_id)
+        version = _stamp(modified)
+        current = cache.get(key)
+        if current is not None and current >= version:
+            version = current + 1
+        cache.set(key, version, timeout=None)
+    
+    transaction.on_commit(bump)
+
+
+def drop_user_versions(user_ids):
+    """
+    Invalidate many users at once after bulk writes that bypass signals
+    """
+    keys = [_version_key(user_id) for user_id in user_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
@@ -0,0 +1,162 @@
+import csv
+import datetime
+import json
+import zlib
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from apps.common.models import Subscription, SubscriptionHistory
+
+FORMATS = ('csv', 'ndjson')
+
+# Each export: its queryset, the (column, lookup) pairs it writes and the
+# field its choice filter applies to (``action`` for history, ``plan`` for
+# subscriptions)
+EXPORTS = {
+    'history': {
+        'queryset': SubscriptionHistory.objects.all(),
+        'columns': [
+            ('id', 'id'),
+            ('created_at', 'created_at'),
+            ('subscription_id', 'subscription_id'),
+            ('user_email', 'subscription__user__email'),
+            ('action', 'action'),
+            ('previous_plan', 'previous_plan'),
+            ('new_plan', 'new_plan'),
+            ('payment_id', 'payment_id'),
+            ('amount', 'amount'),
+            ('notes', 'notes'),
+        ],
+        'choice_filter': 'action',
+    },
+    'subscriptions': {
+        'queryset': Subscription.objects.all(),
+        'columns': [
+            ('id', 'id'),
+            ('created_at', 'created_at'),
+            ('updated_at', 'updated_at'),
+            ('user_id', 'user_id'),
+            ('user_email', 'user__email'),
+            ('plan', 'plan'),
+            ('is_active', 'is_active'),
+            ('start_date', 'start_date'),
+            ('end_date', 'end_date'),
+            ('amount', 'amount'),
+            ('currency', 'currency'),
+            ('billing_cycle', 'billing_cycle'),
+            ('auto_renew', 'auto_renew'),
+            ('razorpay_subscription_id', 'razorpay_subscription_id'),
+        ],
+        'choice_filter': 'plan',
+    },
+}
+
+
+class ExportError(ValueError):
+    """
+    Raised for an invalid export filter
+    """
+    pass
+
+
+def parse_bound(value, name):
+    """
+    Parse a date or datetime filter value into an aware datetime; dates mean
+    midnight in the project time zone
+    """
+    if not value:
+        return None
+
+    # Both parsers raise ValueError for well-formed but impossible values,
+    # such as February 30th
+    try:
+        moment = parse_datetime(value)
+        day = None if moment else parse_date(value)
+    except ValueError:
+        moment = day = None
+    if moment is None:
+        if day is None:
+            raise ExportError(f"'{name}' must be an ISO 8601 date or datetime")
+        moment = datetime.datetime.combine(day, datetime.time.min)
+
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+def export_rows(kind, since=None, until=None, choices=None):
+    """
+    Return the column names and a values_list queryset of the export,
+    filtered in SQL on created_at (since inclusive, until exclusive) and on
+    the export's choice field
+    """
+    export = EXPORTS[kind]
+    queryset = export['queryset']
+
+    if since:
+        queryset = queryset.filter(created_at__gte=since)
+    if until:
+        queryset = queryset.filter(created_at__lt=until)
+    if choices:
+        field = queryset.model._meta.get_field(export['choice_filter'])
+        unknown = set(choices) - {value for value, _ in field.choices}
+        if unknown:
+            raise ExportError(f"Unknown {field.name} value(s): {', '.join(sorted(unknown))}")
+        queryset = queryset.filter(**{f"{field.name}__in": choices})
+
+    columns = [column for column, _ in export['columns']]
+    rows = queryset.order_by('id').values_list(*[lookup for _, lookup in export['columns']])
+    return columns, rows
+
+
+class _Line:
+    """
+    File-like object whose write() returns what was written, so csv.writer
+    can format one row at a time
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_export(columns, rows, fmt, compress=False, chunk_size=None):
+    """
+    Yield the export as encoded chunks, reading rows through a server-side
+    cursor ``chunk_size`` at a time so memory stays flat however many rows
+    there are, and gzip-compressing on the fly when ``compress`` is set
+    """
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+
+    if fmt == 'csv':
+        writer = csv.writer(_Line())
+        header = writer.writerow(columns)
+        format_row = writer.writerow
+    else:
+        header = ''
+
+        def format_row(row):
+            return json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n'
+
+    compressor = zlib.compressobj(wbits=31) if compress else None  # 31: gzip container
+
+    def emit(text):
+        data = text.encode('utf-8')
+        return compressor.compress(data) if compressor else data
+
+    lines = [header]
+    for row in rows.iterator(chunk_size=chunk_size):
+        lines.append(format_row(row))
+        if len(lines) >= chunk_size:
+            data = emit(''.join(lines))
+            lines = []
+            if data:
+                yield data
+
+    data = emit(''.join(lines))
+    if compressor:
+        data += compressor.flush()
+    if data:
+        yield data
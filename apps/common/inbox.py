@@ -0,0 +1,158 @@
+import json
+import logging
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from apps.common.batch import USER_STATUSES, apply_razorpay_subscription
+from apps.common.cache import drop_user_versions
+from apps.common.models import Subscription, SubscriptionHistory, WebhookEvent
+from apps.common.utils import invalidate_cached_subscriptions
+from apps.users.snapshots import invalidate_user_snapshots
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+# Seconds before an event for an unknown subscription is retried, doubled
+# on every attempt up to the maximum
+WEBHOOK_RETRY_BASE_DELAY = 30
+WEBHOOK_RETRY_MAX_DELAY = 60 * 60
+# Attempts after which an event is marked failed instead of parked again,
+# about seven hours after it arrived
+WEBHOOK_MAX_ATTEMPTS = 12
+
+# SubscriptionHistory action recorded for a webhook event
+HISTORY_ACTIONS = {
+    'subscription.activated': 'created',
+    'subscription.charged': 'renewed',
+    'subscription.cancelled': 'cancelled',
+    'subscription.halted': 'payment_failed',
+    'subscription.pending': 'payment_failed',
+}
+
+
+def _entity(event, name):
+    return event.get('payload', {}).get(name, {}).get('entity') or {}
+
+
+def process_webhook_batch(batch_size):
+    """
+    Apply one batch of pending inbox events in a single transaction.
+    
+    Events are locked (skipping those held by a concurrent consumer),
+    applied in arrival order to the affected subscriptions, and written back
+    with bulk statements. Each event is in the inbox once, as redeliveries
+    are dropped on insert. Events for subscriptions not known yet are
+    parked and retried with backoff instead, until WEBHOOK_MAX_ATTEMPTS
+    when they are marked failed. Returns the number of inbox rows
+    consumed, parked and failed ones included.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        rows = list(
+            WebhookEvent.objects.filter(processed_at__isnull=True, failed_at__isnull=True)
+            .filter(Q(retry_at__isnull=True) | Q(retry_at__lte=now))
+            .select_for_update(skip_locked=True)
+            .order_by('id')[:batch_size]
+        )
+        if not rows:
+            return 0
+        
+        events = []
+        for row in rows:
+            try:
+                event = json.loads(row.body)
+            except ValueError:
+                logger.error(f"Skipping malformed webhook event {row.event_id}")
+                continue
+            if _entity(event, 'subscription').get('id'):
+                events.append((row, event))
+        
+        subscriptions = {
+            subscription.razorpay_subscription_id: subscription
+            for subscription in Subscription.objects.filter(
+                razorpay_subscription_id__in={_entity(event, 'subscription')['id'] for _, event in events}
+            )
+        }
+        
+        changed_subscriptions = {}
+        user_statuses = {}
+        history = []
+        parked = []
+        for row, event in events:
+            entity = _entity(event, 'subscription')
+            subscription = subscriptions.get(entity['id'])
+            if subscription is None:
+                # The subscription may not have been saved locally yet
+                row.attempts += 1
+                parked.append(row)
+                if row.attempts >= WEBHOOK_MAX_ATTEMPTS:
+                    row.retry_at = None
+                    row.failed_at = now
+                    logger.error(
+                        f"Webhook {row.event_id} for unknown Razorpay subscription {entity['id']} "
+                        f"failed after {row.attempts} attempts"
+                    )
+                    continue
+                delay = min(WEBHOOK_RETRY_MAX_DELAY, WEBHOOK_RETRY_BASE_DELAY * 2 ** (row.attempts - 1))
+                row.retry_at = now + timedelta(seconds=delay)
+                logger.warning(
+                    f"Webhook {row.event_id} for unknown Razorpay subscription {entity['id']}, "
+                    f"retrying in {delay}s (attempt {row.attempts})"
+                )
+                continue
+            
+            if apply_razorpay_subscription(subscription, entity):
+                subscription.updated_at = timezone.now()
+                changed_subscriptions[subscription.pk] = subscription
+            if entity.get('status') in USER_STATUSES:
+                user_statuses[subscription.user_id] = USER_STATUSES[entity['status']]
+            
+            action = HISTORY_ACTIONS.get(event.get('event'))
+            if action:
+                payment = _entity(event, 'payment')
+                history.append(SubscriptionHistory(
+                    subscription=subscription,
+                    action=action,
+                    new_plan=subscription.plan,
+                    payment_id=payment.get('id'),
+                    amount=Decimal(payment['amount']) / 100 if payment.get('amount') else None,
+                    notes=f"Razorpay {event['event']}"
+                ))
+        
+        Subscription.objects.bulk_update(
+            changed_subscriptions.values(), ['is_active', 'start_date', 'end_date', 'updated_at']
+        )
+        
+        # One UPDATE per distinct target status
+        by_status = {}
+        for user_id, user_status in user_statuses.items():
+            by_status.setdefault(user_status, []).append(user_id)
+        for user_status, user_ids in by_status.items():
+            updates = {'subscription_status': user_status, 'state_version': F('state_version') + 1}
+            if user_status == 'active':
+                updates['is_on_trial'] = False
+            User.objects.filter(id__in=user_ids).update(**updates)
+        
+        SubscriptionHistory.objects.bulk_create(history)
+        
+        WebhookEvent.objects.bulk_update(parked, ['attempts', 'retry_at', 'failed_at'])
+        parked_ids = {row.id for row in parked}
+        WebhookEvent.objects.filter(
+            id__in=[row.id for row in rows if row.id not in parked_ids]
+        ).update(processed_at=timezone.now())
+        
+        # Bulk writes bypass the model signals that invalidate caches
+        affected = {subscription.user_id for subscription in changed_subscriptions.values()}
+        affected.update(user_statuses)
+        affected.update(entry.subscription.user_id for entry in history)
+        drop_user_versions(affected)
+        invalidate_user_snapshots(user_statuses)
+        razorpay_ids = list(subscriptions)
+        transaction.on_commit(lambda: invalidate_cached_subscriptions(razorpay_ids))
+    
+    return len(rows)
@@ -0,0 +1,48 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.common.export import EXPORTS, FORMATS, ExportError, export_rows, parse_bound, stream_export
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream every subscription or subscription history row to a CSV or '
+        'NDJSON file in constant memory'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--output', '-o', default='-', help="File to write, or '-' for stdout")
+        parser.add_argument('--format', choices=FORMATS, default='csv')
+        parser.add_argument('--since', help='Only rows created at or after this ISO date/datetime')
+        parser.add_argument('--until', help='Only rows created before this ISO date/datetime')
+        parser.add_argument('--filter', action='append', default=[], metavar='VALUE',
+                            help='Only rows with this action (history) or plan (subscriptions); repeatable')
+        parser.add_argument('--gzip', action='store_true', help='Gzip-compress the output')
+        parser.add_argument('--chunk-size', type=int, help='Rows fetched per cursor round trip')
+
+    def handle(self, *args, **options):
+        try:
+            columns, rows = export_rows(
+                options['kind'],
+                since=parse_bound(options['since'], 'since'),
+                until=parse_bound(options['until'], 'until'),
+                choices=options['filter'],
+            )
+        except ExportError as e:
+            raise CommandError(str(e))
+
+        chunks = stream_export(
+            columns, rows, options['format'],
+            compress=options['gzip'],
+            chunk_size=options['chunk_size'],
+        )
+        if options['output'] == '-':
+            for chunk in chunks:
+                sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+        else:
+            with open(options['output'], 'wb') as output:
+                for chunk in chunks:
+                    output.write(chunk)
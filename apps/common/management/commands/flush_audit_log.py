@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from apps.common.audit import log
+
+
+class Command(BaseCommand):
+    help = (
+        "Write the subscription history events left in this host's write-behind "
+        'queue, e.g. after its web workers were stopped'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Events per multi-row insert')
+
+    def handle(self, *args, **options):
+        queued = log.queue.count()
+        written = log.drain(options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {written} of {queued} queued history events from {log.queue.path}"
+        ))
+        dead = log.queue.dead_count()
+        if dead:
+            self.stdout.write(self.style.WARNING(
+                f"{dead} events that could not be written are kept in its dead_events table"
+            ))
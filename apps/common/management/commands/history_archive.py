@@ -0,0 +1,60 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.common.export import ExportError, parse_bound
+from apps.common.partitions import (
+    PartitioningError, archives, detach_partition, read_archive, restore_archive
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'List, query or restore the archived monthly partitions of the '
+        'subscription history table, or detach a restored one to archive it again'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('list', 'query', 'restore', 'detach'))
+        parser.add_argument('--since', help='query: only rows created at or after this ISO date/datetime')
+        parser.add_argument('--until', help='query: only rows created before this ISO date/datetime')
+        parser.add_argument('--filter', action='append', default=[], metavar='ACTION',
+                            help='query: only rows with this action; repeatable')
+        parser.add_argument('--subscription', type=int, help='query: only rows of this subscription id')
+        parser.add_argument('--month', help='restore, detach: the month, as YYYY-MM')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'list':
+            for name, path in archives():
+                self.stdout.write(f"{name}\t{os.path.getsize(path)} bytes\t{path}")
+        elif action == 'query':
+            try:
+                since = parse_bound(options['since'], 'since')
+                until = parse_bound(options['until'], 'until')
+            except ExportError as e:
+                raise CommandError(str(e))
+            rows = read_archive(since, until, set(options['filter']), options['subscription'])
+            for row in rows:
+                self.stdout.write(json.dumps(row))
+        else:
+            try:
+                month = parse_bound(f"{options['month']}-01", 'month') if options['month'] else None
+            except ExportError:
+                month = None
+            if month is None:
+                raise CommandError(f'{action} needs --month YYYY-MM')
+            try:
+                if action == 'restore':
+                    totals = restore_archive(month)
+                else:
+                    name = detach_partition(month)
+            except PartitioningError as e:
+                raise CommandError(str(e))
+            if action == 'restore':
+                self.stdout.write(self.style.SUCCESS(
+                    f"Restored {totals['restored']} rows, skipped {totals['skipped']} of deleted subscriptions"
+                ))
+            else:
+                self.stdout.write(self.style.SUCCESS(f"Detached {name}; the next archive run archives it"))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.common.partitions import (
+    PartitioningError, archive_partitions, convert_to_partitioned, ensure_partitions, is_partitioned
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Convert the subscription history table to monthly partitions (once, in a '
+        'maintenance window), create the coming partitions, or archive old ones'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('convert', 'create', 'archive'))
+        parser.add_argument('--months-ahead', type=int, help='Months of partitions to create ahead')
+        parser.add_argument('--archive-after', type=int, help='Months of partitions to keep attached')
+
+    def handle(self, *args, **options):
+        action = options['action']
+        if action == 'convert':
+            try:
+                totals = convert_to_partitioned(options['months_ahead'])
+            except PartitioningError as e:
+                raise CommandError(str(e))
+            self.stdout.write(self.style.SUCCESS(
+                f"Copied {totals['rows']} rows into {totals['partitions']} monthly partitions"
+            ))
+            return
+
+        if not is_partitioned():
+            raise CommandError("The subscription history table is not partitioned; run 'convert' first")
+
+        if action == 'create':
+            created = ensure_partitions(options['months_ahead'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Created {len(created)} partitions" + (f": {', '.join(created)}" if created else '')
+            ))
+        else:
+            for archive in archive_partitions(options['archive_after']):
+                self.stdout.write(f"{archive['partition']}: {archive['rows']} rows -> {archive['path']}")
+            self.stdout.write(self.style.SUCCESS('Archived every partition past the horizon'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from apps.common.batch import JOBS, run_razorpay_batch
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconcile subscriptions against Razorpay or backfill Razorpay customers, '
+        'resuming from the last checkpoint of an interrupted run'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('job', choices=sorted(JOBS))
+        parser.add_argument('--workers', type=int, help='Concurrent gateway calls')
+        parser.add_argument('--rate', type=float, help='Maximum requests per second')
+        parser.add_argument('--chunk-size', type=int, help='Rows written and checkpointed together')
+        parser.add_argument('--restart', action='store_true',
+                            help='Ignore the checkpoint and start from the first row')
+
+    def handle(self, *args, **options):
+        totals = run_razorpay_batch(
+            options['job'],
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            rate=options['rate'],
+            restart=options['restart'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {totals['processed']} rows from id {totals['resumed_from']}: "
+            f"{totals['updated']} updated, {totals['failed']} failed"
+        ))
@@ -25,6 +25,11 @@ class Subscription(TimeStampedModel):
         ('premium', 'Premium'),
         ('enterprise', 'Enterprise'),
     ], default='free')
+    # Razorpay plan billing the subscription's terms, from the plan catalog
+    # (see apps.common.plans); None for free subscriptions
+    catalog_plan = models.ForeignKey(
+        'Plan', on_delete=models.PROTECT, null=True, blank=True, related_name='subscriptions'
+    )
     
     # Razorpay specific fields
     razorpay_subscription_id = models.CharField(max_length=100, blank=True, null=True)
@@ -55,6 +60,12 @@ class Subscription(TimeStampedModel):
     class Meta:
         verbose_name = _('subscription')
         verbose_name_plural = _('subscriptions')
+        indexes = [
+            # Webhooks and reconciliation look subscriptions up by their Razorpay id
+            models.Index(fields=['razorpay_subscription_id'], name='subscription_razorpay_id_idx'),
+            # Admin date hierarchy bounds (MIN/MAX) and drill-downs on start_date
+            models.Index(fields=['start_date'], name='subscription_start_date_idx'),
+        ]
 
 
 class SubscriptionHistory(TimeStampedModel):
@@ -84,6 +95,10 @@ class SubscriptionHistory(TimeStampedModel):
     # Additional notes
     notes = models.TextField(blank=True, null=True)
     
+    # Id of the write-behind event the row was written from, so replayed
+    # events are skipped (see apps.common.audit)
+    event_id = models.UUIDField(unique=True, null=True, blank=True, editable=False)
+    
     def __str__(self):
         return f"{self.subscription.user.email} - {self.action} on {self.created_at}"
     
@@ -91,3 +106,151 @@ class SubscriptionHistory(TimeStampedModel):
         verbose_name = _('subscription history')
         verbose_name_plural = _('subscription histories')
         ordering = ['-created_at']
+        indexes = [
+            # Per-user history listing, ordered by Meta.ordering
+            models.Index(fields=['subscription', '-created_at'], name='subhistory_sub_created_idx'),
+            # Staff listing of all history, keyset-paginated on (created_at, id)
+            models.Index(fields=['-created_at', '-id'], name='subhistory_created_idx'),
+        ]
+
+
+class TrialReminder(TimeStampedModel):
+    """
+    Ledger of trial expiration reminders already sent to users
+    """
+    user = models.ForeignKey('users.User', on_delete=models.CASCADE, related_name='trial_reminders')
+    tier = models.CharField(max_length=20, choices=[
+        ('3_days', '3 Days'),
+        ('1_day', '1 Day'),
+        ('12_hours', '12 Hours'),
+    ])
+    
+    def __str__(self):
+        return f"{self.user_id} - {self.tier} reminder"
+    
+    class Meta:
+        verbose_name = _('trial reminder')
+        verbose_name_plural = _('trial reminders')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'tier'], name='unique_trial_reminder_per_tier'),
+        ]
+
+
+class JobCheckpoint(TimeStampedModel):
+    """
+    Progress of a resumable batch job, as the last primary key it processed
+    """
+    name = models.CharField(max_length=100, unique=True)
+    position = models.BigIntegerField(default=0)
+    
+    def __str__(self):
+        return f"{self.name} at {self.position}"
+    
+    class Meta:
+        verbose_name = _('job checkpoint')
+        verbose_name_plural = _('job checkpoints')
+
+
+class WebhookEvent(models.Model):
+    """
+    Append-only inbox of verified Razorpay webhook deliveries, drained in
+    batches by the process_webhook_events task
+    """
+    # Redeliveries of an event are not inserted again
+    event_id = models.CharField(max_length=100, unique=True)
+    body = models.TextField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    # Events for subscriptions not known yet are parked until retry_at
+    attempts = models.PositiveIntegerField(default=0)
+    retry_at = models.DateTimeField(null=True, blank=True)
+    # Set when an event is given up on after its last attempt; clear it and
+    # attempts to retry the event
+    failed_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.event_id} received on {self.received_at}"
+    
+    class Meta:
+        verbose_name = _('webhook event')
+        verbose_name_plural = _('webhook events')
+        indexes = [
+            # The consumer only ever scans events still waiting to be processed
+            models.Index(
+                fields=['id'], condition=models.Q(processed_at__isnull=True, failed_at__isnull=True),
+                name='webhook_pending_idx'
+            ),
+        ]
+
+
+class Plan(TimeStampedModel):
+    """
+    Local catalog of the plans created in Razorpay
+    """
+    name = models.CharField(max_length=100)
+    period = models.CharField(max_length=20, choices=[
+        ('daily', 'Daily'),
+        ('weekly', 'Weekly'),
+        ('monthly', 'Monthly'),
+        ('yearly', 'Yearly'),
+    ])
+    # Periods between charges, e.g. 3 monthly periods for quarterly billing
+    interval = models.PositiveIntegerField(default=1)
+    # Amount in the smallest currency unit (paise for INR)
+    amount = models.PositiveIntegerField()
+    currency = models.CharField(max_length=3, default='INR')
+    description = models.TextField(blank=True, null=True)
+    
+    # Razorpay specific fields
+    razorpay_item_id = models.CharField(max_length=100, blank=True, null=True)
+    razorpay_plan_id = models.CharField(max_length=100, unique=True)
+    
+    def __str__(self):
+        return f"{self.name} - {self.amount} {self.currency} ({self.get_period_display()})"
+    
+    class Meta:
+        verbose_name = _('plan')
+        verbose_name_plural = _('plans')
+        ordering = ['name', 'period', 'interval', 'amount']
+        constraints = [
+            models.UniqueConstraint(fields=['name', 'period', 'interval', 'amount', 'currency'], name='unique_plan_terms'),
+        ]
+
+
+class SubscriptionDailyRollup(TimeStampedModel):
+    """
+    Subscription activity aggregated per day, plan and billing cycle,
+    maintained incrementally from SubscriptionHistory by the
+    rollup_subscription_analytics task
+    """
+    day = models.DateField()
+    plan = models.CharField(max_length=50)
+    billing_cycle = models.CharField(max_length=20)
+    
+    # Event counts
+    trials_started = models.PositiveIntegerField(default=0)
+    trials_ended = models.PositiveIntegerField(default=0)
+    activations = models.PositiveIntegerField(default=0)
+    # Activations of subscriptions that had started a trial
+    conversions = models.PositiveIntegerField(default=0)
+    renewals = models.PositiveIntegerField(default=0)
+    cancellations = models.PositiveIntegerField(default=0)
+    payment_failures = models.PositiveIntegerField(default=0)
+    
+    # Monthly recurring revenue added by activations and lost to cancellations,
+    # and revenue collected by renewals
+    new_mrr = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    churned_mrr = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    renewal_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    
+    def __str__(self):
+        return f"{self.day} - {self.plan} ({self.billing_cycle})"
+    
+    class Meta:
+        verbose_name = _('subscription daily rollup')
+        verbose_name_plural = _('subscription daily rollups')
+        ordering = ['day', 'plan', 'billing_cycle']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'plan', 'billing_cycle'], name='unique_rollup_bucket'),
+        ]
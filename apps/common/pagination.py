@@ -0,0 +1,53 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Below this many estimated rows an exact COUNT(*) is cheap enough to run
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+def estimate_row_count(queryset):
+    """
+    Return PostgreSQL's planner estimate of the number of rows in the
+    queryset's table, or None when no usable estimate is available
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    
+    table = queryset.model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind, reltuples::bigint FROM pg_class WHERE oid = %s::regclass", [table])
+        row = cursor.fetchone()
+        if row and row[0] == 'p':
+            # Autovacuum never analyzes partitioned tables themselves, so
+            # add up the estimates of their analyzed partitions
+            cursor.execute(
+                "SELECT SUM(c.reltuples)::bigint FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = %s::regclass AND c.reltuples >= 0", [table]
+            )
+            row = ('p', cursor.fetchone()[0])
+    
+    # reltuples is -1 for tables that have never been vacuumed or analyzed
+    if not row or row[1] is None or row[1] < 0:
+        return None
+    return row[1]
+
+
+class ApproximateCountPaginator(Paginator):
+    """
+    Paginator that reads the row count of unfiltered querysets from planner
+    statistics instead of running COUNT(*) over the whole table.
+    
+    Filtered querysets, small tables and other database backends still get
+    an exact count.
+    """
+    
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if hasattr(queryset, 'query') and not queryset.query.where:
+            estimate = estimate_row_count(queryset)
+            if estimate is not None and estimate >= ESTIMATED_COUNT_THRESHOLD:
+                return estimate
+        return super().count
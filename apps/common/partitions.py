@@ -0,0 +1,442 @@
+"""
+Monthly range partitioning of SubscriptionHistory on created_at (PostgreSQL).
+
+convert_to_partitioned() turns the existing table into a partitioned one,
+once, during a maintenance window. From then on:
+
+- ensure_partitions() creates the partition of the current month and the
+  HISTORY_PARTITION_MONTHS_AHEAD following ones.
+- archive_partitions() detaches the partitions older than
+  HISTORY_ARCHIVE_AFTER_MONTHS, writes each one to a gzip-compressed NDJSON
+  file in HISTORY_ARCHIVE_DIR and drops it.
+- read_archive() and restore_archive() query and restore those files. A
+  restored partition is left out of archive runs until detach_partition()
+  hands it back; archiving it again merges it into the existing file.
+
+PostgreSQL requires unique constraints on a partitioned table to include the
+partition key, so the table's primary key becomes (id, created_at) and the
+unique event_id constraint (event_id, created_at). The model is unchanged:
+ids still come from a single sequence and stay unique, and a replayed
+write-behind event carries its original created_at, so it still conflicts.
+"""
+import contextlib
+import datetime
+import gzip
+import json
+import os
+import re
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+from django.utils import timezone
+
+from apps.common.models import Subscription, SubscriptionHistory
+
+TABLE = SubscriptionHistory._meta.db_table
+PARTITION_NAME = re.compile(rf'^{TABLE}_y(\d{{4}})m(\d{{2}})$')
+
+# Rows read per server-side cursor round trip while archiving, and inserted
+# per statement while restoring
+ARCHIVE_CHUNK_SIZE = 2000
+
+# Table comment marking a partition recreated by restore_archive()
+RESTORED = 'restored from archive'
+
+
+class PartitioningError(Exception):
+    """
+    Raised when the history table is not in the state an operation needs
+    """
+    pass
+
+
+def month_start(moment):
+    """
+    Midnight on the first of the month of ``moment``, in the project time zone
+    """
+    moment = timezone.localtime(moment)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(start, months):
+    years, month = divmod(start.month - 1 + months, 12)
+    return start.replace(year=start.year + years, month=month + 1)
+
+
+def partition_name(start):
+    return f"{TABLE}_y{start.year}m{start.month:02d}"
+
+
+def partition_month(name):
+    """
+    The first instant of the month a partition (or its archive) holds
+    """
+    match = PARTITION_NAME.match(name)
+    if match is None:
+        return None
+    year, month = int(match.group(1)), int(match.group(2))
+    return timezone.make_aware(datetime.datetime(year, month, 1))
+
+
+def archive_path(name):
+    return os.path.join(settings.HISTORY_ARCHIVE_DIR, f"{name}.ndjson.gz")
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def _columns():
+    return [field.column for field in SubscriptionHistory._meta.concrete_fields]
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [TABLE]
+        )
+        return cursor.fetchone() is not None
+
+
+def attached_partitions(restored=None):
+    """
+    Names of the partitions currently attached, oldest first; only the
+    restored ones, or only the others, when ``restored`` is True or False
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname, obj_description(c.oid, 'pg_class') IS NOT DISTINCT FROM %s "
+            "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass(%s)", [RESTORED, TABLE]
+        )
+        names = [
+            name for name, is_restored in cursor.fetchall()
+            if PARTITION_NAME.match(name) and restored in (None, is_restored)
+        ]
+    return sorted(names)
+
+
+def detached_partitions():
+    """
+    Names of monthly partition tables detached but not yet dropped, e.g. by
+    an archive run that stopped halfway
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT relname FROM pg_class WHERE relkind = 'r' AND NOT relispartition "
+            "AND relname LIKE %s AND pg_table_is_visible(oid)",
+            [TABLE.replace('_', r'\_') + r'\_y%']
+        )
+        names = [name for name, in cursor.fetchall() if PARTITION_NAME.match(name)]
+    return sorted(names)
+
+
+def create_partition(start):
+    """
+    Create the partition for the month starting at ``start`` if it does not
+    exist; return whether it was created
+    """
+    name = partition_name(start)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT to_regclass(%s) IS NOT NULL', [name])
+        if cursor.fetchone()[0]:
+            return False
+        cursor.execute(
+            f"CREATE TABLE {_quote(name)} PARTITION OF {_quote(TABLE)} "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{add_months(start, 1).isoformat()}')"
+        )
+    return True
+
+
+def convert_to_partitioned(months_ahead=None):
+    """
+    Rebuild the history table as a partitioned table with one partition per
+    month from its oldest row to ``months_ahead`` months from now, copying
+    every row, in a single transaction.
+
+    The table is locked, reads included, while its rows are copied; run
+    this in a maintenance window. Returns the number of partitions and rows.
+    """
+    if connection.vendor != 'postgresql':
+        raise PartitioningError('Partitioning needs PostgreSQL')
+    if is_partitioned():
+        raise PartitioningError(f"{TABLE} is already partitioned")
+    months_ahead = settings.HISTORY_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+
+    legacy = f"{TABLE}_legacy"
+    sequence = f"{TABLE}_id_seq"
+    subscription_table = Subscription._meta.db_table
+    columns = ', '.join(_quote(column) for column in _columns())
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"LOCK TABLE {_quote(TABLE)} IN ACCESS EXCLUSIVE MODE")
+
+        # Secondary indexes are recreated on the partitioned table, where
+        # they cascade to every partition; constraint-backed ones are replaced
+        cursor.execute(
+            'SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s '
+            'AND indexname NOT IN (SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s))',
+            [TABLE, TABLE]
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(f"SELECT MIN(created_at), MAX(id) FROM {_quote(TABLE)}")
+        oldest, last_id = cursor.fetchone()
+
+        cursor.execute(f"ALTER TABLE {_quote(TABLE)} RENAME TO {_quote(legacy)}")
+        for name, _ in indexes:
+            cursor.execute(f"ALTER INDEX {_quote(name)} RENAME TO {_quote(name + '_legacy')}")
+        cursor.execute(
+            f"CREATE TABLE {_quote(TABLE)} (LIKE {_quote(legacy)} INCLUDING DEFAULTS) "
+            f"PARTITION BY RANGE (created_at)"
+        )
+
+        start = month_start(oldest or timezone.now())
+        end = add_months(month_start(timezone.now()), months_ahead + 1)
+        partitions = 0
+        while start < end:
+            partitions += create_partition(start)
+            start = add_months(start, 1)
+
+        # Load first, then build the keys and indexes over the loaded rows
+        cursor.execute(f"INSERT INTO {_quote(TABLE)} ({columns}) SELECT {columns} FROM {_quote(legacy)}")
+        rows = cursor.rowcount
+        cursor.execute(f"DROP TABLE {_quote(legacy)}")
+
+        # The identity sequence went with the old table; ids carry on from a plain one
+        cursor.execute(f"CREATE SEQUENCE {_quote(sequence)} OWNED BY {_quote(TABLE)}.id")
+        cursor.execute('SELECT setval(%s, %s, false)', [sequence, (last_id or 0) + 1])
+        cursor.execute(f"ALTER TABLE {_quote(TABLE)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+        cursor.execute(f"ALTER TABLE {_quote(TABLE)} ADD PRIMARY KEY (id, created_at)")
+        cursor.execute(f"ALTER TABLE {_quote(TABLE)} ADD UNIQUE (event_id, created_at)")
+        cursor.execute(
+            f"ALTER TABLE {_quote(TABLE)} ADD FOREIGN KEY (subscription_id) "
+            f"REFERENCES {_quote(subscription_table)} (id) DEFERRABLE INITIALLY DEFERRED"
+        )
+        for _, definition in indexes:
+            cursor.execute(definition)
+        # The copied partitions start without statistics, which the planner
+        # and the admin's row estimates need
+        cursor.execute(f"ANALYZE {_quote(TABLE)}")
+
+    return {'partitions': partitions, 'rows': rows}
+
+
+def ensure_partitions(months_ahead=None):
+    """
+    Create the partitions of the current month and the ``months_ahead``
+    following ones that do not exist yet, and return their names
+    """
+    if not is_partitioned():
+        return []
+    months_ahead = settings.HISTORY_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+
+    start = month_start(timezone.now())
+    created = []
+    for offset in range(months_ahead + 1):
+        month = add_months(start, offset)
+        if create_partition(month):
+            created.append(partition_name(month))
+    return created
+
+
+def _merge(archived, rows):
+    """
+    Merge two streams of rows ordered by id into one, keeping the row from
+    ``rows`` where both have the same id
+    """
+    archived, rows = iter(archived), iter(rows)
+    old, new = next(archived, None), next(rows, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old['id'] < new['id']):
+            yield old
+            old = next(archived, None)
+        else:
+            if old is not None and old['id'] == new['id']:
+                old = next(archived, None)
+            yield new
+            new = next(rows, None)
+
+
+def _partition_rows(cursor, columns):
+    while True:
+        rows = cursor.fetchmany(ARCHIVE_CHUNK_SIZE)
+        if not rows:
+            return
+        for row in rows:
+            yield json.loads(json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder))
+
+
+def _write_archive(name):
+    """
+    Write the rows of a detached partition to its archive file and return
+    how many the file holds. The file only appears once complete.
+
+    An existing archive of the month (one restored, or written by an
+    interrupted run) is never overwritten: its rows are merged with the
+    partition's, so rows the restore skipped are kept.
+    """
+    columns = _columns()
+    path = archive_path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    written = 0
+    with transaction.atomic(), gzip.open(f"{path}.tmp", 'wt', encoding='utf-8') as archive, \
+            contextlib.ExitStack() as stack:
+        archived = []
+        if os.path.exists(path):
+            archived = map(json.loads, stack.enter_context(gzip.open(path, 'rt', encoding='utf-8')))
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(
+                f"SELECT {', '.join(_quote(column) for column in columns)} "
+                f"FROM {_quote(name)} ORDER BY id"
+            )
+            for row in _merge(archived, _partition_rows(cursor, columns)):
+                archive.write(json.dumps(row) + '\n')
+                written += 1
+
+    descriptor = os.open(f"{path}.tmp", os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+    os.replace(f"{path}.tmp", path)
+    return written
+
+
+def archive_partitions(after_months=None):
+    """
+    Detach the partitions whose month ended more than ``after_months``
+    months ago, archive each one to compressed NDJSON and drop it.
+
+    Every step can be rerun: partitions left detached by an interrupted run
+    are archived (again, if their file was incomplete) and dropped first.
+    Restored partitions are skipped until detach_partition() is run on them.
+    """
+    if not is_partitioned():
+        return []
+    after_months = settings.HISTORY_ARCHIVE_AFTER_MONTHS if after_months is None else after_months
+    horizon = add_months(month_start(timezone.now()), -after_months)
+
+    for name in attached_partitions(restored=False):
+        if add_months(partition_month(name), 1) <= horizon:
+            with connection.cursor() as cursor:
+                cursor.execute(f"ALTER TABLE {_quote(TABLE)} DETACH PARTITION {_quote(name)}")
+
+    archived = []
+    for name in detached_partitions():
+        rows = _write_archive(name)
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {_quote(name)}")
+        archived.append({'partition': name, 'rows': rows, 'path': archive_path(name)})
+    return archived
+
+
+def archives():
+    """
+    (partition name, path) of every archive file, oldest month first
+    """
+    directory = settings.HISTORY_ARCHIVE_DIR
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(
+        filename[:-len('.ndjson.gz')] for filename in os.listdir(directory)
+        if filename.endswith('.ndjson.gz')
+    )
+    return [(name, archive_path(name)) for name in names if PARTITION_NAME.match(name)]
+
+
+def read_archive(since=None, until=None, actions=None, subscription_id=None):
+    """
+    Yield the archived history rows (as decoded dicts) matching the filters,
+    reading only the archives of months overlapping [since, until)
+    """
+    for name, path in archives():
+        start = partition_month(name)
+        if (until and start >= until) or (since and add_months(start, 1) <= since):
+            continue
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            for line in archive:
+                row = json.loads(line)
+                if actions and row['action'] not in actions:
+                    continue
+                if subscription_id is not None and row['subscription_id'] != subscription_id:
+                    continue
+                if since or until:
+                    created_at = SubscriptionHistory._meta.get_field('created_at').to_python(row['created_at'])
+                    if (since and created_at < since) or (until and created_at >= until):
+                        continue
+                yield row
+
+
+def restore_archive(month):
+    """
+    Recreate the partition of ``month`` and load its archive back into it.
+    Rows of subscriptions deleted since are skipped. Returns the numbers of
+    rows restored and skipped.
+
+    The archive file is kept. The restored partition stays attached, out
+    of reach of archive runs, until detach_partition() hands it back.
+    """
+    if not is_partitioned():
+        raise PartitioningError(f"{TABLE} is not partitioned")
+    start = month_start(month)
+    name = partition_name(start)
+    path = archive_path(name)
+    if not os.path.exists(path):
+        raise PartitioningError(f"No archive for {start:%Y-%m} at {path}")
+    if name in detached_partitions():
+        raise PartitioningError(f"{name} is detached and not archived yet; run the archive first")
+
+    totals = {'restored': 0, 'skipped': 0}
+    with transaction.atomic():
+        create_partition(start)
+        with connection.cursor() as cursor:
+            cursor.execute(f"COMMENT ON TABLE {_quote(name)} IS %s", [RESTORED])
+        with gzip.open(path, 'rt', encoding='utf-8') as archive:
+            chunk = []
+            for line in archive:
+                chunk.append(json.loads(line))
+                if len(chunk) >= ARCHIVE_CHUNK_SIZE:
+                    _restore_chunk(chunk, totals)
+                    chunk = []
+            _restore_chunk(chunk, totals)
+    return totals
+
+
+def detach_partition(month):
+    """
+    Detach the restored partition of ``month`` so the next archive run
+    merges it back into its archive file and drops it
+    """
+    if not is_partitioned():
+        raise PartitioningError(f"{TABLE} is not partitioned")
+    name = partition_name(month_start(month))
+    if name not in attached_partitions(restored=True):
+        raise PartitioningError(f"{name} is not a restored partition")
+    with connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {_quote(TABLE)} DETACH PARTITION {_quote(name)}")
+    return name
+
+
+def _restore_chunk(rows, totals):
+    if not rows:
+        return
+    subscription_ids = set(
+        Subscription.objects.filter(id__in={row['subscription_id'] for row in rows})
+        .values_list('id', flat=True)
+    )
+    fields = SubscriptionHistory._meta.concrete_fields
+    histories = [
+        SubscriptionHistory(**{field.attname: field.to_python(row[field.column]) for field in fields})
+        for row in rows if row['subscription_id'] in subscription_ids
+    ]
+    if histories:
+        # A raw insert keeps the archived ids and timestamps as they were;
+        # rows still in the table are skipped
+        SubscriptionHistory.objects._insert(histories, fields, raw=True, on_conflict=OnConflict.IGNORE)
+    totals['restored'] += len(histories)
+    totals['skipped'] += len(rows) - len(histories)
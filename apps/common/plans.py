@@ -0,0 +1,85 @@
+import logging
+import threading
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+
+from apps.common.models import Plan
+from apps.common.utils import RazorpayClient
+
+logger = logging.getLogger(__name__)
+
+# Razorpay plans are immutable, so resolved plans never go stale in-process
+_plans = {}
+_lock = threading.Lock()
+
+# Razorpay (period, interval) of each Subscription.billing_cycle
+BILLING_PERIODS = {
+    'monthly': ('monthly', 1),
+    'quarterly': ('monthly', 3),
+    'yearly': ('yearly', 1),
+}
+
+
+def get_or_create_plan(name, period, amount, currency='INR', description=None, interval=1):
+    """
+    Return the catalog Plan for (name, period, interval, amount, currency).
+    
+    Resolves from the process-level cache, then the database, and only
+    creates the item and plan in Razorpay when neither has it. Returns None
+    if the plan is unknown and could not be created remotely.
+    """
+    key = (name, period, interval, amount, currency)
+    terms = {'name': name, 'period': period, 'interval': interval, 'amount': amount, 'currency': currency}
+    plan = _plans.get(key)
+    if plan is not None:
+        return plan
+    
+    plan = Plan.objects.filter(**terms).first()
+    if plan is None:
+        # Serialize remote creation within the process so concurrent misses
+        # for the same terms do not each create a Razorpay plan
+        with _lock:
+            plan = _plans.get(key) or Plan.objects.filter(**terms).first()
+            if plan is None:
+                plan = _create_plan(terms, description)
+                if plan is None:
+                    return None
+    
+    _plans[key] = plan
+    return plan
+
+
+def get_subscription_plan(plan, billing_cycle, amount, currency='INR'):
+    """
+    Return the catalog Plan charging ``amount`` (in currency units, as on
+    Subscription) for ``plan`` every ``billing_cycle``, through
+    get_or_create_plan. Returns None if it could not be created remotely.
+    """
+    period, interval = BILLING_PERIODS[billing_cycle]
+    return get_or_create_plan(
+        plan, period, int(Decimal(amount) * 100), currency,
+        description=f"{plan.title()} plan, billed {billing_cycle}",
+        interval=interval,
+    )
+
+
+def _create_plan(terms, description):
+    remote = RazorpayClient().create_plan(
+        terms['name'], terms['period'], terms['amount'], terms['currency'], description, terms['interval']
+    )
+    if remote is None:
+        return None
+    
+    try:
+        with transaction.atomic():
+            return Plan.objects.create(
+                **terms,
+                description=description or f"{terms['name']} Plan",
+                razorpay_item_id=remote.get('item', {}).get('id'),
+                razorpay_plan_id=remote['id'],
+            )
+    except IntegrityError:
+        # Another process recorded the same terms first; use its plan
+        logger.warning(f"Discarding duplicate Razorpay plan {remote['id']} for {terms['name']}")
+        return Plan.objects.get(**terms)
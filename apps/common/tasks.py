@@ -1,62 +1,122 @@
+import io
+import logging
+import time
+
 from celery import shared_task
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Case, Exists, F, OuterRef, Value, When
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from apps.common.models import Subscription, SubscriptionHistory
+from apps.common.analytics import rollup_subscription_history
+from apps.common.batch import run_razorpay_batch
+from apps.common.cache import drop_user_versions
+from apps.common.inbox import process_webhook_batch
+from apps.common.models import Subscription, SubscriptionHistory, TrialReminder
+from apps.common.partitions import archive_partitions, ensure_partitions
+from apps.users.importer import import_users
+from apps.users.snapshots import invalidate_user_snapshots
 
 User = get_user_model()
+logger = logging.getLogger(__name__)
+
+# Number of users expired per UPDATE in check_trial_expirations
+TRIAL_SWEEP_CHUNK_SIZE = 1000
+
+# Number of webhook inbox events applied per transaction
+WEBHOOK_BATCH_SIZE = 500
 
 
 @shared_task
-def check_trial_expirations():
+def check_trial_expirations(chunk_size=TRIAL_SWEEP_CHUNK_SIZE):
     """
     Background task to check for expired trials and update user statuses.
     This task should be scheduled to run daily.
+
+    Expired trials are processed in keyset-paginated chunks of user ids. Each
+    chunk is locked, updated with a single UPDATE and gets its missing
+    Subscription rows and ``trial_ended`` history rows inserted in bulk, all
+    inside one transaction. A crashed run can simply be rerun: committed
+    chunks no longer match the expiry filter and uncommitted ones roll back.
     """
     now = timezone.now()
-    
-    # Find users with active trials that have expired
     expired_trials = User.objects.filter(
         is_on_trial=True,
         trial_end_date__lt=now,
         subscription_status='trial'
     )
-    
-    # Update each user's status
-    for user in expired_trials:
-        # Update user status
-        user.is_on_trial = False
-        user.subscription_status = 'expired'
-        user.save()
-        
-        # Update subscription history
-        try:
-            subscription = Subscription.objects.get(user=user)
-            
-            # Create history record
-            SubscriptionHistory.objects.create(
-                subscription=subscription,
-                action='trial_ended',
-                previous_plan='free',
-                notes='Trial period expired'
+
+    last_id = 0
+    chunks = []
+    totals = {'users': 0, 'subscriptions_created': 0, 'history_created': 0}
+
+    while True:
+        started = time.monotonic()
+        with transaction.atomic():
+            # Lock the next chunk; rows held by a concurrent sweep are skipped
+            user_ids = list(
+                expired_trials.filter(id__gt=last_id)
+                .select_for_update(skip_locked=True)
+                .order_by('id')
+                .values_list('id', flat=True)[:chunk_size]
             )
-            
-        except Subscription.DoesNotExist:
-            # If no subscription exists, create one in expired state
-            subscription = Subscription.objects.create(
-                user=user,
-                plan='free',
-                is_active=False
+            if not user_ids:
+                break
+            last_id = user_ids[-1]
+
+            updated = User.objects.filter(id__in=user_ids).update(
+                is_on_trial=False,
+                subscription_status='expired',
+                state_version=F('state_version') + 1
             )
-            
-            # Create history record
-            SubscriptionHistory.objects.create(
-                subscription=subscription,
-                action='trial_ended',
-                previous_plan='free',
-                notes='Trial period expired without subscription record'
+
+            # If no subscription exists, create one in expired state
+            existing = set(
+                Subscription.objects.filter(user_id__in=user_ids)
+                .values_list('user_id', flat=True)
             )
-    
-    return f"Processed {expired_trials.count()} expired trials"
+            missing = [
+                Subscription(user_id=user_id, plan='free', is_active=False)
+                for user_id in user_ids if user_id not in existing
+            ]
+            Subscription.objects.bulk_create(missing, ignore_conflicts=True)
+
+            subscription_ids = Subscription.objects.filter(
+                user_id__in=user_ids
+            ).values_list('user_id', 'id')
+            history = SubscriptionHistory.objects.bulk_create([
+                SubscriptionHistory(
+                    subscription_id=subscription_id,
+                    action='trial_ended',
+                    previous_plan='free',
+                    notes=(
+                        'Trial period expired' if user_id in existing
+                        else 'Trial period expired without subscription record'
+                    )
+                )
+                for user_id, subscription_id in subscription_ids
+            ])
+
+            # Bulk writes bypass the model signals that invalidate cached responses
+            drop_user_versions(user_ids)
+            invalidate_user_snapshots(user_ids)
+
+        chunk = {
+            'users': updated,
+            'subscriptions_created': len(missing),
+            'history_created': len(history),
+            'seconds': round(time.monotonic() - started, 3),
+        }
+        chunks.append(chunk)
+        for key in totals:
+            totals[key] += chunk[key]
+        logger.info(
+            "Expired %d trials up to user id %d in %.3fs",
+            updated, last_id, chunk['seconds']
+        )
+
+    return {**totals, 'chunks': chunks}
 
 
 @shared_task
@@ -64,37 +124,135 @@ def send_trial_expiration_reminders():
     """
     Background task to send reminders to users whose trials are about to expire.
     Sends reminders 3 days, 1 day, and 12 hours before expiration.
+
+    Every trialing user is assigned to the single, most urgent tier they fall
+    in. Users already recorded in the TrialReminder ledger for that tier are
+    filtered out in SQL, so each run only reminds users once per tier.
     """
     now = timezone.now()
-    
-    # 3 days before expiration
+    twelve_hours_from_now = now + timezone.timedelta(hours=12)
+    one_day_from_now = now + timezone.timedelta(days=1)
     three_days_from_now = now + timezone.timedelta(days=3)
-    users_3days = User.objects.filter(
+    
+    already_reminded = TrialReminder.objects.filter(
+        user=OuterRef('pk'),
+        tier=OuterRef('reminder_tier')
+    )
+    due = User.objects.filter(
         is_on_trial=True,
         trial_end_date__range=(now, three_days_from_now),
         subscription_status='trial'
-    )
+    ).annotate(
+        reminder_tier=Case(
+            When(trial_end_date__lte=twelve_hours_from_now, then=Value('12_hours')),
+            When(trial_end_date__lte=one_day_from_now, then=Value('1_day')),
+            default=Value('3_days'),
+        )
+    ).filter(~Exists(already_reminded)).values_list('id', 'reminder_tier')
     
-    # 1 day before expiration
-    one_day_from_now = now + timezone.timedelta(days=1)
-    users_1day = User.objects.filter(
-        is_on_trial=True,
-        trial_end_date__range=(now, one_day_from_now),
-        subscription_status='trial'
-    )
+    reminders = [TrialReminder(user_id=user_id, tier=tier) for user_id, tier in due]
     
-    # 12 hours before expiration
-    twelve_hours_from_now = now + timezone.timedelta(hours=12)
-    users_12hrs = User.objects.filter(
-        is_on_trial=True,
-        trial_end_date__range=(now, twelve_hours_from_now),
-        subscription_status='trial'
-    )
+    # Record the reminders before sending so a crashed run never re-sends
+    TrialReminder.objects.bulk_create(reminders, ignore_conflicts=True)
     
     # Here you would send emails or notifications to these users
     # For now, we'll just return the counts
+    counts = {tier: 0 for tier in ('3_days', '1_day', '12_hours')}
+    for reminder in reminders:
+        counts[reminder.tier] += 1
+    
+    return {
+        "3_days_reminder": counts['3_days'],
+        "1_day_reminder": counts['1_day'],
+        "12_hours_reminder": counts['12_hours']
+    }
+
+
+@shared_task
+def reconcile_razorpay_subscriptions(restart=False):
+    """
+    Background task to refresh local subscriptions from Razorpay.
+    Resumes from its checkpoint if a previous run was interrupted.
+    """
+    return run_razorpay_batch('reconcile_razorpay_subscriptions', restart=restart)
+
+
+@shared_task
+def backfill_razorpay_customers(restart=False):
+    """
+    Background task to create the Razorpay customers missing for users.
+    Resumes from its checkpoint if a previous run was interrupted.
+    """
+    return run_razorpay_batch('backfill_razorpay_customers', restart=restart)
+
+
+@shared_task
+def process_webhook_events(batch_size=WEBHOOK_BATCH_SIZE):
+    """
+    Background task to drain the Razorpay webhook inbox in batches.
+    This task should be scheduled to run every few seconds.
+    """
+    processed = 0
+    while True:
+        consumed = process_webhook_batch(batch_size)
+        if not consumed:
+            return processed
+        processed += consumed
+
+
+@shared_task
+def rollup_subscription_analytics():
+    """
+    Background task to fold new subscription history into the daily
+    analytics rollup. This task should be scheduled every few minutes.
+    """
+    totals = rollup_subscription_history()
+    logger.info(f"Folded {totals['processed']} history rows into {totals['buckets']} rollup buckets")
+    return totals
+
+
+@shared_task
+def create_subscription_history_partitions():
+    """
+    Background task to create the coming monthly partitions of the
+    subscription history table. This task should be scheduled daily.
+    """
+    created = ensure_partitions()
+    for name in created:
+        logger.info(f"Created subscription history partition {name}")
+    return created
+
+
+@shared_task
+def archive_subscription_history_partitions():
+    """
+    Background task to archive and drop the subscription history partitions
+    past the archive horizon. This task should be scheduled daily.
+    """
+    archived = archive_partitions()
+    for archive in archived:
+        logger.info(f"Archived {archive['rows']} rows of {archive['partition']} to {archive['path']}")
+    return archived
+
+
+@shared_task
+def import_users_file(name, fmt):
+    """
+    Background task to import users from a file uploaded to the default
+    storage, which is deleted afterwards. Returns the totals and the first
+    USER_IMPORT_MAX_REPORTED_ERRORS per-row errors.
+    """
+    try:
+        with default_storage.open(name, 'rb') as upload:
+            stream = io.TextIOWrapper(upload, encoding='utf-8', newline='')
+            totals, errors = import_users(stream, fmt, max_errors=settings.USER_IMPORT_MAX_REPORTED_ERRORS)
+    finally:
+        default_storage.delete(name)
+    
+    logger.info(f"Imported {totals['created']} users from {name}, {totals['failed']} rows failed")
     return {
-        "3_days_reminder": users_3days.count(),
-        "1_day_reminder": users_1day.count(),
-        "12_hours_reminder": users_12hrs.count()
+        'created': totals['created'],
+        'failed': totals['failed'],
+        'errors': errors,
+        'errors_truncated': totals['failed'] > len(errors),
     }
@@ -0,0 +1,108 @@
+import datetime
+from decimal import Decimal
+
+import pytest
+from django.utils import timezone
+
+from apps.common.analytics import mrr_by_plan, rollup_subscription_history, trial_conversion
+from apps.common.models import Subscription, SubscriptionDailyRollup, SubscriptionHistory
+
+pytestmark = pytest.mark.django_db
+
+DAY = [datetime.date(2024, 3, day) for day in range(1, 6)]
+
+
+def record(subscription, action, day, amount=None):
+    row = SubscriptionHistory.objects.create(subscription=subscription, action=action, amount=amount)
+    created_at = timezone.make_aware(datetime.datetime.combine(day, datetime.time(12)))
+    SubscriptionHistory.objects.filter(pk=row.pk).update(created_at=created_at)
+    return row
+
+
+@pytest.fixture
+def history(make_user):
+    """
+    A basic monthly subscription converting from its trial then cancelled,
+    a premium yearly one activated without a trial and a trial that ended
+    """
+    converted = Subscription.objects.create(
+        user=make_user(email='a@example.com', username='a'), plan='basic', amount=Decimal('499')
+    )
+    yearly = Subscription.objects.create(
+        user=make_user(email='b@example.com', username='b'), plan='premium', billing_cycle='yearly',
+        amount=Decimal('12000')
+    )
+    lapsed = Subscription.objects.create(
+        user=make_user(email='c@example.com', username='c'), plan='basic', amount=Decimal('499')
+    )
+    record(converted, 'trial_started', DAY[0])
+    record(lapsed, 'trial_started', DAY[0])
+    record(converted, 'created', DAY[1])
+    record(yearly, 'created', DAY[2], amount=Decimal('12000'))
+    record(lapsed, 'trial_ended', DAY[3])
+    record(converted, 'cancelled', DAY[4])
+
+
+def rollups():
+    return {
+        (rollup.day, rollup.plan, rollup.billing_cycle): (rollup.activations, rollup.cancellations, rollup.new_mrr)
+        for rollup in SubscriptionDailyRollup.objects.all()
+    }
+
+
+def test_rollup_counts_each_row_once(history):
+    first = rollup_subscription_history(batch_size=2, lag=0)
+    snapshot = rollups()
+    second = rollup_subscription_history(batch_size=2, lag=0)
+
+    assert first['processed'] == 6
+    assert second['processed'] == 0
+    assert second['watermark'] == first['watermark'] == SubscriptionHistory.objects.order_by('-id').first().pk
+    assert rollups() == snapshot
+    assert snapshot[(DAY[1], 'basic', 'monthly')] == (1, 0, Decimal('499.00'))
+    assert snapshot[(DAY[2], 'premium', 'yearly')] == (1, 0, Decimal('1000.00'))
+
+
+def test_rows_newer_than_the_lag_are_deferred(history):
+    assert rollup_subscription_history(lag=60)['processed'] == 0
+
+    # Rows inserted before the lag window are folded in, later ones wait
+    early = SubscriptionHistory.objects.order_by('id')[:2]
+    SubscriptionHistory.objects.filter(pk__in=[row.pk for row in early]).update(
+        updated_at=timezone.now() - datetime.timedelta(seconds=120)
+    )
+    assert rollup_subscription_history(lag=60)['processed'] == 2
+    assert trial_conversion(DAY[0], DAY[4])['trials_started'] == 2
+    assert trial_conversion(DAY[0], DAY[4])['conversions'] == 0
+
+    assert rollup_subscription_history(lag=0)['processed'] == 4
+
+
+def test_mrr_by_plan(history):
+    rollup_subscription_history(lag=0)
+
+    before_cancellation = mrr_by_plan(DAY[3])
+    assert before_cancellation['mrr'] == Decimal('1499.00')
+    assert before_cancellation['active_subscriptions'] == 2
+    assert before_cancellation['breakdown'] == [
+        {'plan': 'basic', 'billing_cycle': 'monthly', 'mrr': Decimal('499.00'), 'active_subscriptions': 1},
+        {'plan': 'premium', 'billing_cycle': 'yearly', 'mrr': Decimal('1000.00'), 'active_subscriptions': 1},
+    ]
+
+    after_cancellation = mrr_by_plan(DAY[4])
+    assert after_cancellation['mrr'] == Decimal('1000.00')
+    assert [row['plan'] for row in after_cancellation['breakdown']] == ['premium']
+
+
+def test_trial_conversion(history):
+    rollup_subscription_history(lag=0)
+
+    assert trial_conversion(DAY[0], DAY[4]) == {
+        'since': DAY[0],
+        'until': DAY[4],
+        'trials_started': 2,
+        'trials_ended': 1,
+        'conversions': 1,
+        'conversion_rate': 0.5,
+    }
+    assert trial_conversion(DAY[2], DAY[4])['conversion_rate'] is None
@@ -0,0 +1,76 @@
+import os
+import threading
+
+import pytest
+
+from apps.common import audit
+from apps.common.models import Subscription, SubscriptionHistory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def audit_log(settings, tmp_path, monkeypatch):
+    """
+    A write-behind log on its own queue, flushed by the test rather than by
+    a background thread
+    """
+    settings.AUDIT_WRITE_BEHIND = True
+    # The test's connection is in its transaction, which would count as unusable
+    monkeypatch.setattr(audit, 'close_old_connections', lambda: None)
+    log = audit.AuditLog(audit.LocalQueue(str(tmp_path / 'queue.sqlite3')))
+    log._pid = os.getpid()
+    log._wake = threading.Event()
+    monkeypatch.setattr(audit, 'log', log)
+    return log
+
+
+def record(subscription, django_capture_on_commit_callbacks, count=1):
+    with django_capture_on_commit_callbacks(execute=True):
+        for _ in range(count):
+            audit.record_history(subscription.user_id, subscription.pk, 'renewed')
+
+
+def test_rejected_event_is_dead_lettered_without_blocking_the_rest(audit_log, make_user, django_capture_on_commit_callbacks):
+    kept = Subscription.objects.create(user=make_user())
+    deleted = Subscription.objects.create(user=make_user())
+    record(deleted, django_capture_on_commit_callbacks)
+    record(kept, django_capture_on_commit_callbacks, count=2)
+    deleted.delete()
+
+    assert audit_log.flush() == 2
+
+    assert SubscriptionHistory.objects.filter(subscription=kept).count() == 2
+    assert audit_log.queue.count() == 0
+    assert audit_log.queue.dead_count() == 1
+    assert audit.pending_history(deleted.user) == []
+
+
+def test_concurrent_events_all_stay_readable_until_written(audit_log, make_user, django_capture_on_commit_callbacks):
+    user = make_user()
+    subscription = Subscription.objects.create(user=user)
+    events = [
+        audit._encode(SubscriptionHistory(
+            subscription_id=subscription.pk, action='renewed', event_id=audit.uuid.uuid4(),
+            created_at=audit.timezone.now(),
+        ), user.pk)
+        for _ in range(audit.PENDING_LIMIT // 2)
+    ]
+    barrier = threading.Barrier(len(events))
+
+    def enqueue(event):
+        barrier.wait()
+        audit_log.enqueue(event)
+
+    threads = [threading.Thread(target=enqueue, args=(event,)) for event in events]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(audit.pending_history(user)) == len(events)
+
+    audit_log.flush()
+
+    assert audit.pending_history(user) == []
+    assert SubscriptionHistory.objects.filter(subscription=subscription).count() == len(events)
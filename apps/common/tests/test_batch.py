@@ -0,0 +1,120 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from apps.common import batch
+from apps.common.batch import RateLimiter, run_razorpay_batch
+from apps.common.cache import get_user_version
+from apps.common.models import JobCheckpoint, Subscription, SubscriptionHistory
+from apps.common.utils import RazorpayClient
+
+pytestmark = pytest.mark.django_db
+
+JOB = 'reconcile_razorpay_subscriptions'
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    """
+    Razorpay statuses served by get_subscription, by subscription id; the
+    ids fetched are recorded in ``calls``
+    """
+    statuses = {}
+    calls = []
+
+    def get_subscription(self, subscription_id, use_cache=True):
+        calls.append(subscription_id)
+        status = statuses[subscription_id]
+        if isinstance(status, Exception):
+            raise status
+        return {'id': subscription_id, 'status': status, 'current_start': 1704067200, 'current_end': 1706745600}
+
+    monkeypatch.setattr(RazorpayClient, 'get_subscription', get_subscription)
+    gateway.statuses, gateway.calls = statuses, calls
+    return gateway
+
+
+def subscribe(make_user, count):
+    subscriptions = []
+    for i in range(count):
+        user = make_user(email=f'user{i}@example.com', username=f'user{i}')
+        subscriptions.append(Subscription.objects.create(user=user, razorpay_subscription_id=f'sub_{i}'))
+    return subscriptions
+
+
+def test_changed_subscriptions_update_their_users(make_user, gateway, django_capture_on_commit_callbacks):
+    subscriptions = subscribe(make_user, 5)
+    for i in range(5):
+        gateway.statuses[f'sub_{i}'] = 'cancelled' if i == 4 else 'active'
+    versions = {s.user_id: get_user_version(s.user_id) for s in subscriptions}
+
+    with CaptureQueriesContext(connection) as queries, django_capture_on_commit_callbacks(execute=True):
+        totals = run_razorpay_batch(JOB, chunk_size=2, workers=2, rate=1000)
+
+    assert totals == {'processed': 5, 'updated': 5, 'failed': 0, 'resumed_from': 0}
+    # One bulk UPDATE of the subscriptions per chunk
+    updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "common_subscription"')]
+    assert len(updates) == 3
+    for subscription in subscriptions:
+        subscription.refresh_from_db()
+        subscription.user.refresh_from_db()
+        assert subscription.is_active == (subscription.user.subscription_status == 'active')
+        assert subscription.user.state_version == 1
+        assert get_user_version(subscription.user_id) > versions[subscription.user_id]
+    assert subscriptions[4].user.subscription_status == 'cancelled'
+    assert SubscriptionHistory.objects.filter(action='renewed').count() == 4
+    assert SubscriptionHistory.objects.filter(action='cancelled').count() == 1
+    assert JobCheckpoint.objects.get(name=JOB).position == 0
+
+    # Nothing changed upstream: no writes, no history
+    assert run_razorpay_batch(JOB, chunk_size=2, workers=2, rate=1000)['updated'] == 0
+    assert SubscriptionHistory.objects.count() == 5
+
+
+def test_interrupted_run_resumes_after_the_last_committed_chunk(make_user, gateway):
+    subscriptions = subscribe(make_user, 5)
+    for i in range(5):
+        gateway.statuses[f'sub_{i}'] = 'active'
+    gateway.statuses['sub_3'] = RuntimeError('worker killed')
+
+    with pytest.raises(RuntimeError):
+        run_razorpay_batch(JOB, chunk_size=2, workers=1, rate=1000)
+    assert JobCheckpoint.objects.get(name=JOB).position == subscriptions[1].pk
+
+    gateway.statuses['sub_3'] = 'active'
+    gateway.calls.clear()
+    totals = run_razorpay_batch(JOB, chunk_size=2, workers=1, rate=1000)
+
+    assert totals == {'processed': 3, 'updated': 3, 'failed': 0, 'resumed_from': subscriptions[1].pk}
+    assert gateway.calls == ['sub_2', 'sub_3', 'sub_4']
+    assert Subscription.objects.filter(is_active=True).count() == 5
+
+
+def test_every_gateway_call_waits_for_the_limiter(make_user, gateway, monkeypatch):
+    subscribe(make_user, 3)
+    for i in range(3):
+        gateway.statuses[f'sub_{i}'] = 'active'
+    acquired = []
+    monkeypatch.setattr(RateLimiter, 'acquire', lambda self: acquired.append(self.interval))
+
+    run_razorpay_batch(JOB, chunk_size=2, workers=2, rate=4)
+
+    assert acquired == [0.25] * 3
+
+
+def test_limiter_spaces_calls_evenly(monkeypatch):
+    clock = [100.0]
+    slept = []
+    monkeypatch.setattr(batch.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(batch.time, 'sleep', slept.append)
+    limiter = RateLimiter(rate=10)
+
+    for _ in range(3):
+        limiter.acquire()
+    assert slept == pytest.approx([0.1, 0.2])
+
+    # Idle time is not banked into a burst
+    clock[0] += 5
+    limiter.acquire()
+    limiter.acquire()
+    assert slept[2:] == pytest.approx([0.1])
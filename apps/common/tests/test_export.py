@@ -0,0 +1,107 @@
+import csv
+import datetime
+import gzip
+import io
+import json
+
+import pytest
+from django.utils import timezone
+
+from apps.common.export import ExportError, export_rows, parse_bound, stream_export
+from apps.common.models import Subscription, SubscriptionHistory
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture
+def history(make_user):
+    """
+    One history row per month of January to April 2024, alternating
+    between renewals and cancellations
+    """
+    subscription = Subscription.objects.create(user=make_user(email='ada@example.com'), plan='basic')
+    rows = []
+    for month in range(1, 5):
+        row = SubscriptionHistory.objects.create(
+            subscription=subscription, action='renewed' if month % 2 else 'cancelled', new_plan='basic'
+        )
+        created_at = timezone.make_aware(datetime.datetime(2024, month, 15, 12))
+        SubscriptionHistory.objects.filter(pk=row.pk).update(created_at=created_at)
+        rows.append(row)
+    return rows
+
+
+@pytest.fixture
+def staff_client(make_user, auth_client):
+    return auth_client(make_user(email='staff@example.com', username='staff', is_staff=True))
+
+
+def download(client, kind, **params):
+    response = client.get(f'/api/v1/exports/{kind}/', params)
+    assert response.status_code == 200, response.content
+    assert response.streaming
+    return b''.join(response.streaming_content)
+
+
+def test_bounds_accept_dates_and_datetimes():
+    assert parse_bound('2024-02-01', 'since') == timezone.make_aware(datetime.datetime(2024, 2, 1))
+    assert parse_bound('2024-02-01T12:30:00+00:00', 'since') == datetime.datetime(
+        2024, 2, 1, 12, 30, tzinfo=datetime.timezone.utc
+    )
+    assert parse_bound('', 'since') is None
+
+
+@pytest.mark.parametrize('value', ['yesterday', '2024-02-30', '2024-02-30T00:00', '2024-13-01T25:00'])
+def test_invalid_bounds_are_rejected(value, staff_client):
+    with pytest.raises(ExportError):
+        parse_bound(value, 'since')
+
+    response = staff_client.get('/api/v1/exports/history/', {'since': value})
+    assert response.status_code == 400
+    assert response.data == {'detail': "'since' must be an ISO 8601 date or datetime"}
+
+
+def test_csv_export_is_filtered_on_bounds_and_choices(history, staff_client):
+    content = download(staff_client, 'history', since='2024-02-01', until='2024-04-15')
+    rows = list(csv.DictReader(io.StringIO(content.decode())))
+
+    # since is inclusive, until exclusive
+    assert [int(row['id']) for row in rows] == [history[1].pk, history[2].pk]
+    assert rows[0]['user_email'] == 'ada@example.com'
+    assert rows[0]['action'] == 'cancelled'
+
+    content = download(staff_client, 'history', action='renewed')
+    assert [int(row['id']) for row in csv.DictReader(io.StringIO(content.decode()))] == [
+        history[0].pk, history[2].pk
+    ]
+
+
+def test_ndjson_export_can_be_gzipped(history, staff_client):
+    content = download(staff_client, 'history', output='ndjson', compress='gzip')
+    records = [json.loads(line) for line in gzip.decompress(content).decode().splitlines()]
+
+    assert [record['id'] for record in records] == [row.pk for row in history]
+    assert records[0]['created_at'].startswith('2024-01-15')
+
+
+def test_export_is_streamed_in_chunks(history):
+    columns, rows = export_rows('history')
+
+    chunks = list(stream_export(columns, rows, 'csv', chunk_size=2))
+
+    assert len(chunks) == 3
+    assert b''.join(chunks).decode().splitlines()[0] == ','.join(columns)
+    assert len(b''.join(chunks).decode().splitlines()) == 1 + len(history)
+
+
+def test_export_rejects_unknown_choices_and_formats(staff_client):
+    response = staff_client.get('/api/v1/exports/subscriptions/', {'plan': 'gold'})
+    assert response.status_code == 400
+    assert response.data == {'detail': 'Unknown plan value(s): gold'}
+
+    assert staff_client.get('/api/v1/exports/history/', {'output': 'xml'}).status_code == 400
+    assert staff_client.get('/api/v1/exports/users/').status_code == 404
+
+
+def test_exports_are_staff_only(make_user, auth_client):
+    assert auth_client(make_user()).get('/api/v1/exports/history/').status_code == 403
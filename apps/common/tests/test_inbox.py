@@ -0,0 +1,103 @@
+import hashlib
+import hmac
+import json
+from datetime import timedelta
+
+import pytest
+from django.test import Client
+from django.utils import timezone
+
+from apps.common.inbox import process_webhook_batch
+from apps.common.models import Subscription, SubscriptionHistory, WebhookEvent
+
+pytestmark = pytest.mark.django_db
+
+SECRET = 'webhook-secret'
+
+
+@pytest.fixture(autouse=True)
+def webhook_secret(settings):
+    settings.RAZORPAY_WEBHOOK_SECRET = SECRET
+
+
+def deliver(event_id, razorpay_id, event='subscription.charged'):
+    body = json.dumps({
+        'event': event,
+        'payload': {
+            'subscription': {'entity': {'id': razorpay_id, 'status': 'active'}},
+            'payment': {'entity': {'id': f'pay_{event_id}', 'amount': 49900}},
+        },
+    }).encode()
+    return Client().post(
+        '/api/v1/webhooks/razorpay/',
+        body,
+        content_type='application/json',
+        headers={
+            'X-Razorpay-Signature': hmac.new(SECRET.encode(), body, hashlib.sha256).hexdigest(),
+            'X-Razorpay-Event-Id': event_id,
+        },
+    )
+
+
+def test_redeliveries_are_applied_once(make_user):
+    subscription = Subscription.objects.create(user=make_user(), razorpay_subscription_id='sub_1')
+
+    assert deliver('evt_1', 'sub_1').status_code == 202
+    assert deliver('evt_1', 'sub_1').status_code == 202
+    assert WebhookEvent.objects.filter(event_id='evt_1').count() == 1
+
+    # Consumers each lock a different batch; there is no second row to apply
+    assert process_webhook_batch(1) == 1
+    assert process_webhook_batch(1) == 0
+    assert deliver('evt_1', 'sub_1').status_code == 202
+    assert process_webhook_batch(10) == 0
+
+    assert SubscriptionHistory.objects.filter(subscription=subscription, action='renewed').count() == 1
+
+
+def test_events_for_unknown_subscriptions_are_parked_and_retried(make_user):
+    deliver('evt_early', 'sub_later')
+
+    assert process_webhook_batch(10) == 1
+    event = WebhookEvent.objects.get(event_id='evt_early')
+    assert event.processed_at is None
+    assert event.attempts == 1
+    assert event.retry_at > timezone.now()
+
+    # Parked events are not picked up again before their retry time
+    assert process_webhook_batch(10) == 0
+
+    subscription = Subscription.objects.create(user=make_user(), razorpay_subscription_id='sub_later')
+    WebhookEvent.objects.filter(pk=event.pk).update(retry_at=timezone.now() - timedelta(seconds=1))
+
+    assert process_webhook_batch(10) == 1
+    event.refresh_from_db()
+    assert event.processed_at is not None
+    assert SubscriptionHistory.objects.filter(subscription=subscription, action='renewed').count() == 1
+
+
+def test_events_still_unknown_after_the_last_attempt_are_failed(make_user, monkeypatch):
+    from apps.common import inbox
+
+    monkeypatch.setattr(inbox, 'WEBHOOK_MAX_ATTEMPTS', 3)
+    deliver('evt_orphan', 'sub_missing')
+    event = WebhookEvent.objects.get(event_id='evt_orphan')
+
+    for attempt in range(1, 4):
+        WebhookEvent.objects.filter(pk=event.pk).update(retry_at=timezone.now() - timedelta(seconds=1))
+        assert process_webhook_batch(10) == 1
+        event.refresh_from_db()
+        assert event.attempts == attempt
+
+    assert event.failed_at is not None
+    assert event.retry_at is None
+    assert event.processed_at is None
+    # Failed events are no longer picked up, even once their subscription exists
+    Subscription.objects.create(user=make_user(), razorpay_subscription_id='sub_missing')
+    assert process_webhook_batch(10) == 0
+
+    # Clearing the failure retries the event
+    WebhookEvent.objects.filter(pk=event.pk).update(failed_at=None, attempts=0)
+    assert process_webhook_batch(10) == 1
+    event.refresh_from_db()
+    assert event.processed_at is not None
@@ -0,0 +1,78 @@
+import gzip
+import json
+from datetime import timedelta
+
+import pytest
+from django.db import connection
+from django.utils import timezone
+
+from apps.common import partitions
+from apps.common.models import Subscription, SubscriptionHistory
+from apps.common.pagination import estimate_row_count
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(connection.vendor != 'postgresql', reason='Partitioning requires PostgreSQL'),
+]
+
+
+def archived_ids(month):
+    with gzip.open(partitions.archive_path(partitions.partition_name(month)), 'rt', encoding='utf-8') as archive:
+        return [json.loads(line)['id'] for line in archive]
+
+
+def archived_rows(archived, month):
+    """
+    Rows written for ``month`` by an archive run; the empty months after it
+    are archived too
+    """
+    return [archive['rows'] for archive in archived if archive['partition'] == partitions.partition_name(month)]
+
+
+def test_rearchiving_a_restored_month_keeps_the_rows_its_restore_skipped(make_user):
+    month = partitions.add_months(partitions.month_start(timezone.now()), -12)
+    subscriptions = [Subscription.objects.create(user=make_user()) for _ in range(3)]
+    for subscription in subscriptions:
+        SubscriptionHistory.objects.create(subscription=subscription, action='renewed')
+    SubscriptionHistory.objects.update(created_at=month + timedelta(days=3))
+    ids = sorted(SubscriptionHistory.objects.values_list('id', flat=True))
+    # Each step commits on its own in production; run the deferred foreign
+    # key checks its commit would, before tables are rebuilt or dropped
+    connection.check_constraints()
+    partitions.convert_to_partitioned(months_ahead=0)
+
+    assert archived_rows(partitions.archive_partitions(after_months=3), month) == [3]
+    subscriptions[0].delete()
+    connection.check_constraints()
+    assert partitions.restore_archive(month) == {'restored': 2, 'skipped': 1}
+    connection.check_constraints()
+
+    # A restored month stays out of archive runs until it is detached
+    assert partitions.archive_partitions(after_months=3) == []
+    assert SubscriptionHistory.objects.count() == 2
+
+    partitions.detach_partition(month)
+    assert archived_rows(partitions.archive_partitions(after_months=3), month) == [3]
+    assert archived_ids(month) == ids
+    assert not SubscriptionHistory.objects.exists()
+
+
+def test_row_estimate_covers_the_partitions(make_user):
+    subscription = Subscription.objects.create(user=make_user())
+    for _ in range(5):
+        SubscriptionHistory.objects.create(subscription=subscription, action='renewed')
+    connection.check_constraints()
+    partitions.convert_to_partitioned(months_ahead=1)
+
+    assert estimate_row_count(SubscriptionHistory.objects.all()) == 5
+
+    # New partitions are not analyzed yet and do not count
+    partitions.ensure_partitions(months_ahead=3)
+    assert estimate_row_count(SubscriptionHistory.objects.all()) == 5
+
+    # Autovacuum analyzes the partitions but never their parent
+    for _ in range(3):
+        SubscriptionHistory.objects.create(subscription=subscription, action='renewed')
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {partitions.partition_name(partitions.month_start(timezone.now()))}")
+    assert estimate_row_count(SubscriptionHistory.objects.all()) == 8
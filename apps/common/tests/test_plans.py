@@ -0,0 +1,83 @@
+import pytest
+
+from apps.common import plans
+from apps.common.models import Plan, Subscription
+from apps.common.utils import RazorpayClient
+
+pytestmark = pytest.mark.django_db
+
+
+@pytest.fixture(autouse=True)
+def empty_plan_cache():
+    plans._plans.clear()
+    yield
+    plans._plans.clear()
+
+
+@pytest.fixture
+def remote_plans(monkeypatch):
+    """
+    Record the plans created in Razorpay instead of calling the gateway
+    """
+    created = []
+
+    def create_plan(self, name, period, amount, currency='INR', description=None, interval=1):
+        created.append((name, period, interval, amount, currency))
+        return {'id': f'plan_{len(created)}', 'item': {'id': f'item_{len(created)}'}}
+
+    monkeypatch.setattr(RazorpayClient, 'create_plan', create_plan)
+    return created
+
+
+def test_plans_are_created_remotely_once(remote_plans):
+    first = plans.get_or_create_plan('basic', 'monthly', 49900, interval=3)
+    plans._plans.clear()
+    second = plans.get_or_create_plan('basic', 'monthly', 49900, interval=3)
+
+    assert first == second
+    assert first.razorpay_plan_id == 'plan_1'
+    assert remote_plans == [('basic', 'monthly', 3, 49900, 'INR')]
+
+
+def test_paid_subscriptions_are_linked_to_their_catalog_plan(make_user, auth_client, remote_plans):
+    catalog_plan = Plan.objects.create(
+        name='premium', period='yearly', amount=999900, razorpay_plan_id='plan_premium_yearly'
+    )
+    user = make_user()
+
+    response = auth_client(user).post('/api/v1/subscriptions/', {
+        'plan': 'premium', 'billing_cycle': 'yearly', 'amount': '9999.00',
+    })
+
+    assert response.status_code == 201, response.content
+    assert response.data['razorpay_plan_id'] == 'plan_premium_yearly'
+    assert Subscription.objects.get(user=user).catalog_plan == catalog_plan
+    assert remote_plans == []
+
+
+def test_quarterly_billing_is_three_monthly_periods(make_user, auth_client, remote_plans):
+    response = auth_client(make_user()).post('/api/v1/subscriptions/', {
+        'plan': 'basic', 'billing_cycle': 'quarterly', 'amount': '1499.00',
+    })
+
+    assert response.status_code == 201, response.content
+    assert remote_plans == [('basic', 'monthly', 3, 149900, 'INR')]
+
+
+def test_free_subscriptions_have_no_catalog_plan(make_user, auth_client, remote_plans):
+    response = auth_client(make_user()).post('/api/v1/subscriptions/', {'plan': 'free'})
+
+    assert response.status_code == 201, response.content
+    assert response.data['razorpay_plan_id'] is None
+    assert remote_plans == []
+
+
+def test_plan_the_gateway_could_not_create_is_a_503(make_user, auth_client, monkeypatch):
+    monkeypatch.setattr(RazorpayClient, 'create_plan', lambda self, *args, **kwargs: None)
+
+    response = auth_client(make_user()).post('/api/v1/subscriptions/', {
+        'plan': 'basic', 'billing_cycle': 'monthly', 'amount': '499.00',
+    })
+
+    assert response.status_code == 503
+    assert not Subscription.objects.exists()
@@ -0,0 +1,136 @@
+"""
+EXPLAIN the queries issued by the trial lifecycle tasks and the API views
+over a realistically sized, analyzed dataset, with the planner left at its
+defaults, and fail on any sequential scan
+"""
+import re
+from datetime import timedelta
+
+import pytest
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from apps.common.models import Plan, Subscription, SubscriptionHistory, TrialReminder
+from apps.common.tasks import check_trial_expirations, send_trial_expiration_reminders
+
+User = get_user_model()
+
+pytestmark = [
+    pytest.mark.django_db,
+    pytest.mark.skipif(connection.vendor != 'postgresql', reason='Query plan checks require PostgreSQL'),
+]
+
+SEQ_SCAN = re.compile(r'Seq Scan on (\w+)')
+
+# Lookup tables of a few dozen rows, which the planner rightly reads whole
+SMALL_TABLES = {Plan._meta.db_table}
+
+USERS = 20000
+HISTORY_PER_SUBSCRIPTION = 3
+
+
+def seed():
+    """
+    Insert USERS users, mostly past their trial, with a subscription and a
+    few history rows each; active subscriptions are billed on one of a
+    small catalog of plans. About 5% are trialing, spread over the 30 days
+    either side of now, and half of those were already reminded; users past
+    their trial have all three reminders in the ledger.
+    """
+    now = timezone.now()
+    statuses = ('inactive', 'active', 'cancelled', 'expired')
+    users = []
+    for n in range(USERS):
+        trialing = n % 20 == 0
+        users.append(User(
+            email=f'seed{n}@example.com',
+            username=f'seed{n}',
+            password='!',
+            is_on_trial=trialing,
+            subscription_status='trial' if trialing else statuses[n % len(statuses)],
+            trial_start_date=now - timedelta(days=30),
+            trial_end_date=now + timedelta(hours=(n % 1440) - 720),
+        ))
+    users = User.objects.bulk_create(users, batch_size=5000)
+
+    catalog = Plan.objects.bulk_create([
+        Plan(name=name, period=period, amount=amount, razorpay_plan_id=f'plan_{name}_{period}_{amount}')
+        for name in ('basic', 'premium', 'enterprise')
+        for period in ('monthly', 'yearly')
+        for amount in (49900, 99900, 199900)
+    ])
+    subscriptions = Subscription.objects.bulk_create(
+        [
+            Subscription(
+                user=user,
+                is_active=user.subscription_status == 'active',
+                catalog_plan=catalog[n % len(catalog)] if user.subscription_status == 'active' else None,
+            )
+            for n, user in enumerate(users)
+        ],
+        batch_size=5000,
+    )
+    SubscriptionHistory.objects.bulk_create(
+        [
+            SubscriptionHistory(subscription=subscription, action='created')
+            for subscription in subscriptions
+            for _ in range(HISTORY_PER_SUBSCRIPTION)
+        ],
+        batch_size=5000,
+    )
+    reminders = [TrialReminder(user=user, tier='3_days') for user in users if user.is_on_trial][::2]
+    reminders += [
+        TrialReminder(user=user, tier=tier)
+        for user in users if user.subscription_status in ('active', 'cancelled', 'expired')
+        for tier in ('3_days', '1_day', '12_hours')
+    ]
+    TrialReminder.objects.bulk_create(reminders, batch_size=5000)
+
+    with connection.cursor() as cursor:
+        for model in (User, Plan, Subscription, SubscriptionHistory, TrialReminder):
+            cursor.execute(f'ANALYZE {model._meta.db_table}')
+    return users
+
+
+def capture_selects(func):
+    with CaptureQueriesContext(connection) as captured:
+        func()
+    return [query['sql'] for query in captured.captured_queries if query['sql'].startswith('SELECT')]
+
+
+def test_trial_lifecycle_queries_use_indexes(auth_client, make_user):
+    users = seed()
+    member = users[1]
+    staff = make_user(is_staff=True)
+    member_client = auth_client(member)
+    staff_client = auth_client(staff)
+
+    workloads = {
+        'tasks.check_trial_expirations': check_trial_expirations,
+        'tasks.send_trial_expiration_reminders': send_trial_expiration_reminders,
+    }
+    for label, path, client in [
+        ('UserViewSet.me', '/api/v1/users/me/', member_client),
+        ('UserViewSet.list', '/api/v1/users/', staff_client),
+        ('SubscriptionViewSet.list', '/api/v1/subscriptions/', member_client),
+        ('SubscriptionViewSet.list (staff)', '/api/v1/subscriptions/', staff_client),
+        ('SubscriptionViewSet.my_subscription', '/api/v1/subscriptions/my_subscription/', member_client),
+        ('SubscriptionHistoryViewSet.list', '/api/v1/subscription-history/', member_client),
+        ('SubscriptionHistoryViewSet.list (staff)', '/api/v1/subscription-history/', staff_client),
+    ]:
+        workloads[f'views.{label}'] = lambda path=path, client=client: client.get(path)
+
+    failures = []
+    for label, func in workloads.items():
+        statements = capture_selects(func)
+        assert statements, f'{label} issued no queries'
+        for sql in statements:
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN {sql}')
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+            if set(SEQ_SCAN.findall(plan)) - SMALL_TABLES:
+                failures.append(f'{label}:\n{sql}\n{plan}')
+
+    assert not failures, '\n\n'.join(failures)
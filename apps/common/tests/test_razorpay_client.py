@@ -0,0 +1,126 @@
+import json
+import time
+
+import pytest
+import razorpay
+import requests
+
+from apps.common import utils
+from apps.common.utils import CircuitBreaker, RazorpayClient
+
+SUBSCRIPTION = {'id': 'sub_1', 'status': 'active'}
+
+
+def response(status, body):
+    result = requests.Response()
+    result.status_code = status
+    result._content = json.dumps(body).encode()
+    return result
+
+
+SERVER_ERROR = response(500, {'error': {'code': 'SERVER_ERROR', 'description': 'Try again'}})
+
+
+class StubSession:
+    """
+    Session answering each request with the next queued response, or
+    raising it when it is an exception
+    """
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def _respond(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        result = self.responses.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def get(self, url, **kwargs):
+        return self._respond('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._respond('post', url, **kwargs)
+
+
+@pytest.fixture(autouse=True)
+def fresh_breaker(settings, monkeypatch):
+    settings.RAZORPAY_RETRY_BASE_DELAY = 0
+    monkeypatch.setattr(utils, 'breaker', CircuitBreaker(failure_threshold=2, reset_timeout=30))
+
+
+def client_for(session):
+    client = RazorpayClient()
+    client.client = razorpay.Client(session=session, auth=('key', 'secret'))
+    return client
+
+
+def test_idempotent_reads_are_retried_with_timeouts(settings):
+    session = StubSession(SERVER_ERROR, response(200, SUBSCRIPTION))
+
+    assert client_for(session).get_subscription('sub_1', use_cache=False) == SUBSCRIPTION
+
+    assert len(session.calls) == 2
+    timeout = (settings.RAZORPAY_CONNECT_TIMEOUT, settings.RAZORPAY_READ_TIMEOUT)
+    assert all(kwargs['timeout'] == timeout for _, _, kwargs in session.calls)
+
+
+def test_creates_are_not_retried():
+    session = StubSession(SERVER_ERROR, response(200, SUBSCRIPTION))
+
+    assert client_for(session).create_subscription('plan_1', 'cust_1') is None
+
+    assert [method for method, _, _ in session.calls] == ['post']
+
+
+def test_customer_creation_returning_the_existing_customer_is_retried():
+    customer = {'id': 'cust_1'}
+    session = StubSession(requests.ConnectionError('reset'), response(200, customer))
+
+    assert client_for(session).create_customer('Ada', 'ada@example.com', fail_existing=False) == customer
+    assert len(session.calls) == 2
+
+
+def test_breaker_opens_then_lets_one_probe_through_half_open():
+    session = StubSession(requests.Timeout('slow'), requests.Timeout('slow'), response(200, SUBSCRIPTION))
+    client = client_for(session)
+    client.max_retries = 0
+
+    assert client.get_subscription('sub_1', use_cache=False) is None
+    assert client.get_subscription('sub_1', use_cache=False) is None
+    assert utils.breaker.state == 'open'
+
+    # Open: fails fast without calling the gateway
+    assert client.get_subscription('sub_1', use_cache=False) is None
+    assert len(session.calls) == 2
+
+    utils.breaker.opened_at = time.monotonic() - utils.breaker.reset_timeout
+    assert utils.breaker.state == 'half-open'
+    assert client.get_subscription('sub_1', use_cache=False) == SUBSCRIPTION
+    assert utils.breaker.state == 'closed'
+
+
+def test_half_open_breaker_admits_a_single_probe():
+    breaker = utils.breaker
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout
+
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+
+
+def test_stale_subscription_is_served_while_refreshes_fail(monkeypatch):
+    monkeypatch.setattr(utils._refresher, 'submit', lambda func, *args: func(*args))
+    session = StubSession(SERVER_ERROR, SERVER_ERROR)
+    client = client_for(session)
+    client.max_retries = 0
+    stale = {'id': 'sub_1', 'status': 'created'}
+    utils.cache.set(utils._subscription_cache_key('sub_1'), {'payload': stale, 'fetched_at': time.time() - 3600})
+
+    assert client.get_subscription('sub_1') == stale
+    # The failed refresh keeps the stale entry and releases its lock
+    assert client.get_subscription('sub_1') == stale
+    assert len(session.calls) == 2
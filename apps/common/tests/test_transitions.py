@@ -0,0 +1,106 @@
+import threading
+
+import pytest
+from django.db import connection
+
+from apps.common.models import Subscription, SubscriptionHistory
+from apps.common.transitions import ConcurrentTransition, transition
+from apps.users.models import User
+
+# Each thread commits on its own connection, so the tests cannot run
+# inside a rolled back test transaction
+pytestmark = pytest.mark.django_db(transaction=True)
+
+
+def race(user, names):
+    """
+    Run one thread per transition name, each on its own freshly loaded copy
+    of ``user``, all reading the same state before any of them writes.
+    Returns the names of the transitions that won.
+    """
+    barrier = threading.Barrier(len(names))
+    won = []
+    errors = []
+
+    def run(name):
+        try:
+            copy = User.objects.get(pk=user.pk)
+            barrier.wait()
+            try:
+                transition(copy, name)
+            except ConcurrentTransition:
+                pass
+            else:
+                won.append(name)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(name,)) for name in names]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+    return won
+
+
+def assert_consistent(user):
+    user.refresh_from_db()
+    subscription = Subscription.objects.get(user=user)
+    assert subscription.is_active == (user.subscription_status == 'active')
+
+
+@pytest.mark.parametrize('names', [
+    ('cancel', 'expire_trial'),
+    ('cancel', 'expire_trial', 'cancel', 'expire_trial'),
+])
+def test_one_transition_out_of_trial_wins(make_user, names):
+    user = make_user()
+    transition(user, 'start_trial')
+
+    won = race(user, names)
+
+    assert len(won) == 1
+    user.refresh_from_db()
+    assert user.subscription_status == {'cancel': 'cancelled', 'expire_trial': 'expired'}[won[0]]
+    assert SubscriptionHistory.objects.filter(action__in=('cancelled', 'trial_ended')).count() == 1
+    assert_consistent(user)
+
+
+def test_one_trial_start_wins(make_user):
+    user = make_user()
+    transition(user, 'activate')
+    transition(user, 'cancel')
+
+    won = race(user, ['start_trial'] * 4)
+
+    assert won == ['start_trial']
+    assert SubscriptionHistory.objects.filter(action='trial_started').count() == 1
+    assert_consistent(user)
+
+
+def test_password_change_keeps_a_concurrent_transition(make_user, auth_client, monkeypatch):
+    from apps.users import hashing
+
+    user = make_user(password='old-pass-123')
+    transition(user, 'start_trial')
+    set_password = hashing.set_password
+
+    def set_password_during_cancel(request_user, raw_password):
+        # The user is cancelled after the request loaded it
+        set_password(request_user, raw_password)
+        transition(User.objects.get(pk=user.pk), 'cancel')
+
+    monkeypatch.setattr(hashing, 'set_password', set_password_during_cancel)
+
+    response = auth_client(user).post('/api/v1/users/change_password/', {
+        'old_password': 'old-pass-123', 'new_password': 'new-pass-456', 'confirm_password': 'new-pass-456',
+    })
+
+    assert response.status_code == 200, response.content
+    user.refresh_from_db()
+    assert user.check_password('new-pass-456')
+    assert user.subscription_status == 'cancelled'
+    assert_consistent(user)
@@ -0,0 +1,160 @@
+"""
+Subscription state machine for users: trial, active, cancelled and expired.
+
+A transition writes only the columns it changes, with a conditional UPDATE
+that applies only if the user's ``state_version`` is still the one that was
+read. Its Subscription change is written in the same transaction, and its
+SubscriptionHistory event is handed to the write-behind log when that
+transaction commits. If a concurrent transition got there first, the
+UPDATE matches no row, nothing is written and ConcurrentTransition is
+raised. The caller can then reload the user and decide again.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from apps.common.audit import record_history
+from apps.common.cache import bump_user_version
+from apps.common.models import Subscription
+from apps.common.utils import calculate_trial_end_date
+from apps.users.models import User
+from apps.users.snapshots import invalidate_user_snapshots
+
+# Per transition: the statuses it may start from, the status it leads to,
+# the Subscription.is_active it implies (None leaves it alone) and the
+# history action it records
+TRANSITIONS = {
+    'start_trial': {
+        'sources': ('inactive', 'cancelled', 'expired'),
+        'target': 'trial',
+        'is_active': None,
+        'action': 'trial_started',
+    },
+    'activate': {
+        'sources': ('inactive', 'trial', 'cancelled', 'expired'),
+        'target': 'active',
+        'is_active': True,
+        'action': 'created',
+    },
+    'cancel': {
+        'sources': ('trial', 'active'),
+        'target': 'cancelled',
+        'is_active': False,
+        'action': 'cancelled',
+    },
+    'expire_trial': {
+        'sources': ('trial',),
+        'target': 'expired',
+        'is_active': False,
+        'action': 'trial_ended',
+    },
+}
+
+
+class TransitionError(Exception):
+    """
+    Base class for subscription state transition errors
+    """
+    pass
+
+
+class InvalidTransition(TransitionError):
+    """
+    Raised when a transition does not apply to the user's current status
+    """
+    pass
+
+
+class ConcurrentTransition(TransitionError):
+    """
+    Raised when the user's subscription state changed since it was read
+    """
+    pass
+
+
+def _user_changes(name, now):
+    """
+    The User columns a transition writes besides subscription_status
+    """
+    if name == 'start_trial':
+        return {
+            'is_on_trial': True,
+            'trial_start_date': now,
+            'trial_end_date': calculate_trial_end_date(now),
+        }
+    if name in ('activate', 'expire_trial'):
+        return {'is_on_trial': False}
+    return {}
+
+
+def _history(name, subscription, notes):
+    if name == 'start_trial':
+        return {'new_plan': 'free', 'notes': notes or '30-day free trial started'}
+    if name == 'activate':
+        return {'new_plan': subscription['plan'], 'notes': notes}
+    if name == 'cancel':
+        return {'previous_plan': subscription['plan'], 'notes': notes or 'Subscription cancelled by user'}
+    return {'previous_plan': 'free', 'notes': notes or 'Trial period expired'}
+
+
+def transition(user, name, notes=None, payment_id=None, amount=None):
+    """
+    Apply a state transition to ``user`` and return its SubscriptionHistory row,
+    which is written behind (see apps.common.audit).
+
+    The user instance is updated in place on success. Raises
+    InvalidTransition if the user's status does not allow it, and
+    ConcurrentTransition if another transition changed the user first.
+    """
+    spec = TRANSITIONS[name]
+    if user.subscription_status not in spec['sources']:
+        raise InvalidTransition(
+            f"Cannot {name.replace('_', ' ')} from status '{user.subscription_status}'"
+        )
+
+    now = timezone.now()
+    changes = {'subscription_status': spec['target'], **_user_changes(name, now)}
+
+    with transaction.atomic():
+        updated = User.objects.filter(
+            pk=user.pk,
+            state_version=user.state_version,
+            subscription_status=user.subscription_status,
+        ).update(state_version=F('state_version') + 1, **changes)
+        if not updated:
+            raise ConcurrentTransition('The subscription changed since it was read, reload and retry')
+
+        subscription = (
+            Subscription.objects.filter(user_id=user.pk)
+            .values('id', 'plan', 'is_active').first()
+        )
+        if subscription is None:
+            subscription = {
+                'id': Subscription.objects.create(
+                    user_id=user.pk, is_active=bool(spec['is_active'])
+                ).pk,
+                'plan': 'free',
+                'is_active': bool(spec['is_active']),
+            }
+        elif spec['is_active'] is not None and subscription['is_active'] != spec['is_active']:
+            Subscription.objects.filter(pk=subscription['id']).update(
+                is_active=spec['is_active'], updated_at=now
+            )
+
+        history = record_history(
+            user.pk,
+            subscription['id'],
+            spec['action'],
+            payment_id=payment_id,
+            amount=amount,
+            **_history(name, subscription, notes)
+        )
+
+        # update() bypasses the User signals that invalidate cached responses
+        bump_user_version(user.pk, now)
+        invalidate_user_snapshots([user.pk])
+
+    for field, value in changes.items():
+        setattr(user, field, value)
+    user.state_version += 1
+    return history
@@ -1,46 +1,250 @@
 import razorpay
+import requests
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
+from razorpay.errors import BadRequestError, GatewayError, ServerError
+from requests.adapters import HTTPAdapter
 import datetime
 import logging
+import os
+import random
+import threading
+import time
 
 logger = logging.getLogger(__name__)
 
+# Failures worth retrying (for idempotent calls) and counting against the
+# circuit breaker; BadRequestError means the gateway is healthy
+TRANSIENT_ERRORS = (requests.RequestException, ServerError, GatewayError)
+
+
+class CircuitBreaker:
+    """
+    Fails fast after ``failure_threshold`` consecutive failures, then lets a
+    single trial call through once ``reset_timeout`` seconds have passed
+    """
+    
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+    
+    def allow(self):
+        with self._lock:
+            if self.state == 'open':
+                return False
+            if self.state == 'half-open':
+                # Let this call probe the gateway; keep others failing fast
+                self.opened_at = time.monotonic()
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+    
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class ClientMetrics:
+    """
+    Per-method call, error and latency counters
+    """
+    
+    def __init__(self):
+        self._methods = {}
+        self._lock = threading.Lock()
+    
+    def record(self, method, latency=None, error=False, short_circuited=False):
+        with self._lock:
+            stats = self._methods.setdefault(method, {
+                'calls': 0, 'errors': 0, 'short_circuited': 0,
+                'latency_total': 0.0, 'latency_max': 0.0,
+            })
+            stats['calls'] += 1
+            stats['errors'] += error
+            stats['short_circuited'] += short_circuited
+            if latency is not None:
+                stats['latency_total'] += latency
+                stats['latency_max'] = max(stats['latency_max'], latency)
+    
+    def snapshot(self):
+        with self._lock:
+            return {method: dict(stats) for method, stats in self._methods.items()}
+
+
+_shared = {'pid': None, 'client': None}
+_shared_lock = threading.Lock()
+breaker = CircuitBreaker(
+    failure_threshold=settings.RAZORPAY_BREAKER_THRESHOLD,
+    reset_timeout=settings.RAZORPAY_BREAKER_RESET_TIMEOUT,
+)
+metrics = ClientMetrics()
+
+
+class CacheStats:
+    """
+    Hit, stale hit, miss and background refresh counters of a read-through
+    cache, or whichever events ``names`` lists
+    """
+    
+    def __init__(self, names=('hits', 'stale_hits', 'misses', 'refreshes')):
+        self._counts = {name: 0 for name in names}
+        self._lock = threading.Lock()
+    
+    def incr(self, name):
+        with self._lock:
+            self._counts[name] += 1
+    
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+subscription_cache_stats = CacheStats()
+
+# Refreshes stale cached subscriptions off the request path
+_refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='razorpay-refresh')
+
+
+def _subscription_cache_key(subscription_id):
+    return f'razorpay-subscription:{subscription_id}'
+
+
+def invalidate_cached_subscriptions(subscription_ids):
+    """
+    Drop cached Razorpay subscription payloads, e.g. after a webhook or a
+    cancellation changed them
+    """
+    cache.delete_many([_subscription_cache_key(subscription_id) for subscription_id in subscription_ids])
+
+
+def get_shared_razorpay_client():
+    """
+    Return the process-wide razorpay.Client, whose session keeps a pool of
+    keep-alive connections to the gateway. Forked workers build their own.
+    """
+    if not (settings.RAZORPAY_KEY_ID and settings.RAZORPAY_KEY_SECRET):
+        return None
+    
+    with _shared_lock:
+        if _shared['pid'] != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=settings.RAZORPAY_POOL_SIZE,
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _shared['client'] = razorpay.Client(
+                session=session,
+                auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET),
+                base_url=settings.RAZORPAY_BASE_URL,
+            )
+            _shared['pid'] = os.getpid()
+        return _shared['client']
+
 
 class RazorpayClient:
     """
     Utility class to handle Razorpay API operations
+    
+    Instances share one pooled razorpay.Client per process. Every call gets a
+    (connect, read) timeout, idempotent calls are retried with jittered
+    exponential backoff, and a circuit breaker makes calls fail fast while
+    the gateway is degraded. Failed calls still return None.
     """
     def __init__(self):
         self.key_id = settings.RAZORPAY_KEY_ID
         self.key_secret = settings.RAZORPAY_KEY_SECRET
-        self.client = None
-        
-        if self.key_id and self.key_secret:
-            self.client = razorpay.Client(auth=(self.key_id, self.key_secret))
+        self.client = get_shared_razorpay_client()
+        self.timeout = (settings.RAZORPAY_CONNECT_TIMEOUT, settings.RAZORPAY_READ_TIMEOUT)
+        self.max_retries = settings.RAZORPAY_MAX_RETRIES
     
-    def create_customer(self, name, email, contact=None):
+    def _backoff(self, attempt):
+        """Full-jitter exponential backoff delay before retry number ``attempt``"""
+        return random.uniform(0, min(settings.RAZORPAY_RETRY_MAX_DELAY,
+                                     settings.RAZORPAY_RETRY_BASE_DELAY * 2 ** attempt))
+    
+    def _call(self, method, resource, action, *args, idempotent=False, **kwargs):
         """
-        Create a customer in Razorpay
+        Run ``self.client.<resource>.<action>`` with timeouts, retries,
+        circuit breaking and metrics
         """
         if not self.client:
             logger.warning("Razorpay client not initialized. Check your API keys.")
             return None
         
-        try:
-            customer_data = {
-                'name': name,
-                'email': email,
-            }
+        func = getattr(getattr(self.client, resource), action)
+        attempts = 1 + (self.max_retries if idempotent else 0)
+        for attempt in range(attempts):
+            if not breaker.allow():
+                metrics.record(method, short_circuited=True)
+                logger.warning(f"Razorpay circuit open, skipping {method}")
+                return None
             
-            if contact:
-                customer_data['contact'] = contact
-                
-            customer = self.client.customer.create(data=customer_data)
-            return customer
-        except Exception as e:
-            logger.error(f"Error creating Razorpay customer: {str(e)}")
-            return None
+            started = time.monotonic()
+            try:
+                result = func(*args, timeout=self.timeout, **kwargs)
+            except BadRequestError as e:
+                breaker.record_success()
+                metrics.record(method, time.monotonic() - started, error=True)
+                logger.error(f"Error in Razorpay {method}: {str(e)}")
+                return None
+            except TRANSIENT_ERRORS as e:
+                breaker.record_failure()
+                metrics.record(method, time.monotonic() - started, error=True)
+                if attempt + 1 < attempts:
+                    logger.warning(f"Retrying Razorpay {method} after error: {str(e)}")
+                    time.sleep(self._backoff(attempt))
+                    continue
+                logger.error(f"Error in Razorpay {method}: {str(e)}")
+                return None
+            except Exception as e:
+                metrics.record(method, time.monotonic() - started, error=True)
+                logger.error(f"Error in Razorpay {method}: {str(e)}")
+                return None
+            
+            breaker.record_success()
+            metrics.record(method, time.monotonic() - started)
+            return result
+    
+    def create_customer(self, name, email, contact=None, fail_existing=True):
+        """
+        Create a customer in Razorpay
+        If fail_existing is False, the existing customer with the same details
+        is returned instead of an error, which makes the call safe to repeat,
+        so it is then retried like the idempotent reads
+        """
+        customer_data = {
+            'name': name,
+            'email': email,
+        }
+        
+        if not fail_existing:
+            customer_data['fail_existing'] = '0'
+        
+        if contact:
+            customer_data['contact'] = contact
+        
+        return self._call('create_customer', 'customer', 'create', data=customer_data,
+                          idempotent=not fail_existing)
     
     def create_subscription(self, plan_id, customer_id, total_count=None, start_at=None):
         """
@@ -48,33 +252,24 @@ class RazorpayClient:
         If total_count is not provided, it will be an infinite subscription
         If start_at is not provided, it will start immediately after authorization
         """
-        if not self.client:
-            logger.warning("Razorpay client not initialized. Check your API keys.")
-            return None
+        subscription_data = {
+            'plan_id': plan_id,
+            'customer_notify': 1,  # Notify the customer
+            'customer_id': customer_id,
+        }
         
-        try:
-            subscription_data = {
-                'plan_id': plan_id,
-                'customer_notify': 1,  # Notify the customer
-                'customer_id': customer_id,
-            }
-            
-            # Add total_count if provided (for limited period subscriptions)
-            if total_count:
-                subscription_data['total_count'] = total_count
-            
-            # Add start_at if provided (for delayed start)
-            if start_at:
-                # Convert to Unix timestamp
-                if isinstance(start_at, datetime.datetime):
-                    start_at = int(start_at.timestamp())
-                subscription_data['start_at'] = start_at
-            
-            subscription = self.client.subscription.create(data=subscription_data)
-            return subscription
-        except Exception as e:
-            logger.error(f"Error creating Razorpay subscription: {str(e)}")
-            return None
+        # Add total_count if provided (for limited period subscriptions)
+        if total_count:
+            subscription_data['total_count'] = total_count
+        
+        # Add start_at if provided (for delayed start)
+        if start_at:
+            # Convert to Unix timestamp
+            if isinstance(start_at, datetime.datetime):
+                start_at = int(start_at.timestamp())
+            subscription_data['start_at'] = start_at
+        
+        return self._call('create_subscription', 'subscription', 'create', data=subscription_data)
     
     def cancel_subscription(self, subscription_id, cancel_at_cycle_end=True):
         """
@@ -82,71 +277,94 @@ class RazorpayClient:
         If cancel_at_cycle_end is True, it will be cancelled at the end of the current billing cycle
         Otherwise, it will be cancelled immediately
         """
-        if not self.client:
-            logger.warning("Razorpay client not initialized. Check your API keys.")
-            return None
-        
-        try:
-            return self.client.subscription.cancel(subscription_id, cancel_at_cycle_end)
-        except Exception as e:
-            logger.error(f"Error cancelling Razorpay subscription: {str(e)}")
-            return None
+        result = self._call(
+            'cancel_subscription', 'subscription', 'cancel',
+            subscription_id, {'cancel_at_cycle_end': 1 if cancel_at_cycle_end else 0}
+        )
+        invalidate_cached_subscriptions([subscription_id])
+        return result
     
-    def create_plan(self, name, period, amount, currency='INR', description=None):
+    def create_plan(self, name, period, amount, currency='INR', description=None, interval=1):
         """
         Create a plan in Razorpay
-        period can be 'daily', 'weekly', 'monthly', 'yearly'
+        period can be 'daily', 'weekly', 'monthly', 'yearly', charged every
+        ``interval`` periods
         amount is in the smallest currency unit (paise for INR)
         """
-        if not self.client:
-            logger.warning("Razorpay client not initialized. Check your API keys.")
+        # First create an item
+        item_data = {
+            'name': name,
+            'amount': amount,
+            'currency': currency,
+            'description': description or f"{name} Plan"
+        }
+        item = self._call('create_item', 'item', 'create', data=item_data)
+        if item is None:
             return None
         
-        try:
-            # First create an item
-            item_data = {
-                'name': name,
-                'amount': amount,
-                'currency': currency,
+        # Then create a plan with the item
+        plan_data = {
+            'period': period,
+            'interval': interval,
+            'item': {
+                'id': item['id'],
+                'name': item['name'],
+                'amount': item['amount'],
+                'currency': item['currency'],
+                'description': item['description']
+            },
+            'notes': {
                 'description': description or f"{name} Plan"
             }
-            item = self.client.item.create(data=item_data)
-            
-            # Then create a plan with the item
-            plan_data = {
-                'period': period,
-                'interval': 1,  # Every 1 period
-                'item': {
-                    'id': item['id'],
-                    'name': item['name'],
-                    'amount': item['amount'],
-                    'currency': item['currency'],
-                    'description': item['description']
-                },
-                'notes': {
-                    'description': description or f"{name} Plan"
-                }
-            }
-            
-            plan = self.client.plan.create(data=plan_data)
-            return plan
-        except Exception as e:
-            logger.error(f"Error creating Razorpay plan: {str(e)}")
-            return None
+        }
+        
+        return self._call('create_plan', 'plan', 'create', data=plan_data)
     
-    def get_subscription(self, subscription_id):
+    def get_subscription(self, subscription_id, use_cache=True):
         """
         Get subscription details from Razorpay
+        
+        Reads through a shared cache: entries younger than
+        RAZORPAY_SUBSCRIPTION_CACHE_TTL are served as is, older ones are
+        served stale for up to RAZORPAY_SUBSCRIPTION_CACHE_STALE more seconds
+        while a background thread refreshes them. With use_cache=False the
+        gateway is always called and the cache is refreshed with the result.
         """
-        if not self.client:
-            logger.warning("Razorpay client not initialized. Check your API keys.")
-            return None
+        if not use_cache:
+            return self._fetch_subscription(subscription_id)
+        
+        entry = cache.get(_subscription_cache_key(subscription_id))
+        if entry is None:
+            subscription_cache_stats.incr('misses')
+            return self._fetch_subscription(subscription_id)
         
+        if time.time() - entry['fetched_at'] < settings.RAZORPAY_SUBSCRIPTION_CACHE_TTL:
+            subscription_cache_stats.incr('hits')
+        else:
+            subscription_cache_stats.incr('stale_hits')
+            # Only one refresh per subscription at a time across processes
+            lock_key = f'{_subscription_cache_key(subscription_id)}:refreshing'
+            if cache.add(lock_key, True, timeout=settings.RAZORPAY_READ_TIMEOUT * 2):
+                _refresher.submit(self._refresh_subscription, subscription_id, lock_key)
+        return entry['payload']
+    
+    def _fetch_subscription(self, subscription_id):
+        payload = self._call('get_subscription', 'subscription', 'fetch',
+                             subscription_id, idempotent=True)
+        if payload is not None:
+            cache.set(
+                _subscription_cache_key(subscription_id),
+                {'payload': payload, 'fetched_at': time.time()},
+                timeout=settings.RAZORPAY_SUBSCRIPTION_CACHE_TTL + settings.RAZORPAY_SUBSCRIPTION_CACHE_STALE
+            )
+        return payload
+    
+    def _refresh_subscription(self, subscription_id, lock_key):
         try:
-            return self.client.subscription.fetch(subscription_id)
-        except Exception as e:
-            logger.error(f"Error fetching Razorpay subscription: {str(e)}")
-            return None
+            subscription_cache_stats.incr('refreshes')
+            self._fetch_subscription(subscription_id)
+        finally:
+            cache.delete(lock_key)
 
 
 def calculate_trial_end_date(start_date=None, days=30):
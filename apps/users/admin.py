@@ -2,11 +2,12 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.utils.translation import gettext_lazy as _
 
+from apps.common.admin_mixins import LargeTableAdminMixin
 from .models import User
 
 
 @admin.register(User)
-class UserAdmin(BaseUserAdmin):
+class UserAdmin(LargeTableAdminMixin, BaseUserAdmin):
     """
     Custom admin for User model that uses email as the primary identifier
     """
@@ -14,6 +15,7 @@ class UserAdmin(BaseUserAdmin):
                     'subscription_status', 'is_on_trial')
     list_filter = ('is_staff', 'is_superuser', 'is_active', 'subscription_status', 'is_on_trial')
     search_fields = ('email', 'username', 'first_name', 'last_name')
+    email_search_field = 'email'
     ordering = ('email',)
     
     fieldsets = (
@@ -0,0 +1,44 @@
+from django.contrib.auth.backends import ModelBackend
+
+from apps.users import hashing
+from apps.users.models import User
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    ModelBackend that checks passwords on the password hashing pool instead
+    of on the calling worker
+    """
+    
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return
+        try:
+            user = User._default_manager.get_by_natural_key(username)
+        except User.DoesNotExist:
+            # Hash once anyway so unknown and known users take as long (#20760)
+            try:
+                hashing.hash_password(password)
+            except hashing.PasswordHashingFailed:
+                pass
+        else:
+            if hashing.check_password(user, password) and self.user_can_authenticate(user):
+                return user
+    
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(User.USERNAME_FIELD)
+        if username is None or password is None:
+            return
+        try:
+            user = await User._default_manager.aget_by_natural_key(username)
+        except User.DoesNotExist:
+            try:
+                await hashing.ahash_password(password)
+            except hashing.PasswordHashingFailed:
+                pass
+        else:
+            if await hashing.acheck_password(user, password) and self.user_can_authenticate(user):
+                return user
@@ -0,0 +1,171 @@
+"""
+Password hashing and checking on a bounded process pool.
+
+Hashers are deliberately slow (hundreds of milliseconds of CPU per call), so
+running them inline on a web worker stalls every other request it serves.
+These helpers send the work to a shared pool of processes instead. At most
+PASSWORD_HASHING_MAX_PENDING operations may be queued or running per web
+process; past that, PasswordHashingBusy is raised so the caller can shed
+the request rather than pile up behind the pool.
+
+Operations that time out or whose worker process died fail closed: a
+password that could not be checked is treated as a wrong one, and a hash
+that could not be computed raises PasswordHashingFailed, answered like a
+busy pool.
+"""
+import asyncio
+import logging
+import os
+import threading
+from concurrent import futures
+from concurrent.futures import BrokenExecutor, ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import get_hasher, identify_hasher, make_password
+from django.contrib.auth.hashers import check_password as django_check_password
+
+logger = logging.getLogger(__name__)
+
+
+class PasswordHashingBusy(Exception):
+    """
+    Raised when the password hashing pool already has its maximum of pending operations
+    """
+    pass
+
+
+class PasswordHashingFailed(PasswordHashingBusy):
+    """
+    Raised when a password hashing operation timed out or its pool broke
+    """
+    pass
+
+
+def init_worker():
+    # Worker processes need Django configured to read PASSWORD_HASHERS
+    if not django.apps.apps.ready:
+        django.setup()
+
+
+def _check(raw_password, encoded):
+    """
+    Check a password in a worker process, returning whether it matched and,
+    when the stored hash uses outdated parameters, its replacement
+    """
+    if not django_check_password(raw_password, encoded):
+        return False, None
+
+    preferred = get_hasher()
+    hasher = identify_hasher(encoded)
+    if hasher.algorithm != preferred.algorithm or preferred.must_update(encoded):
+        return True, make_password(raw_password)
+    return True, None
+
+
+class PasswordPool:
+    """
+    Process pool for password hashing with a limit on pending operations
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._pid = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Pools do not survive a fork, so each web worker starts its own
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=settings.PASSWORD_HASHING_WORKERS,
+                        initializer=init_worker,
+                    )
+                    self._slots = threading.BoundedSemaphore(settings.PASSWORD_HASHING_MAX_PENDING)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def submit(self, fn, *args):
+        executor = self._get_executor()
+        slots = self._slots
+        if not slots.acquire(blocking=False):
+            raise PasswordHashingBusy()
+
+        try:
+            future = executor.submit(fn, *args)
+        except BaseException:
+            slots.release()
+            raise
+        future.add_done_callback(lambda _: slots.release())
+        return future
+
+    def _failed(self, exc):
+        if isinstance(exc, BrokenExecutor):
+            # A worker process died; the next operation starts a new pool
+            with self._lock:
+                self._pid = None
+        logger.error(f"Password hashing failed: {exc!r}")
+        return PasswordHashingFailed()
+
+    def run(self, fn, *args):
+        try:
+            return self.submit(fn, *args).result(timeout=settings.PASSWORD_HASHING_TIMEOUT)
+        except (futures.TimeoutError, BrokenExecutor) as e:
+            raise self._failed(e) from e
+
+    async def arun(self, fn, *args):
+        try:
+            future = asyncio.wrap_future(self.submit(fn, *args))
+            return await asyncio.wait_for(future, timeout=settings.PASSWORD_HASHING_TIMEOUT)
+        except (asyncio.TimeoutError, futures.TimeoutError, BrokenExecutor) as e:
+            raise self._failed(e) from e
+
+
+pool = PasswordPool()
+
+
+def hash_password(raw_password):
+    """
+    Return the encoded hash of a password, computed on the pool
+    """
+    return pool.run(make_password, raw_password)
+
+
+async def ahash_password(raw_password):
+    return await pool.arun(make_password, raw_password)
+
+
+def set_password(user, raw_password):
+    """
+    Pool-backed equivalent of user.set_password(); the caller saves the user
+    """
+    user.password = hash_password(raw_password)
+    user._password = raw_password
+
+
+def check_password(user, raw_password):
+    """
+    Pool-backed equivalent of user.check_password(), including the upgrade
+    of hashes made with outdated parameters
+    """
+    try:
+        valid, upgraded = pool.run(_check, raw_password, user.password)
+    except PasswordHashingFailed:
+        return False
+    if upgraded:
+        user.password = upgraded
+        user.save(update_fields=['password'])
+    return valid
+
+
+async def acheck_password(user, raw_password):
+    try:
+        valid, upgraded = await pool.arun(_check, raw_password, user.password)
+    except PasswordHashingFailed:
+        return False
+    if upgraded:
+        user.password = upgraded
+        await user.asave(update_fields=['password'])
+    return valid
@@ -0,0 +1,229 @@
+import csv
+import json
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+from apps.common.models import Subscription, SubscriptionHistory
+from apps.common.utils import calculate_trial_end_date
+from apps.users.hashing import init_worker
+from apps.users.models import User
+
+REQUIRED_FIELDS = ('email', 'username', 'first_name', 'last_name', 'password')
+OPTIONAL_FIELDS = ('phone_number',)
+
+
+def iter_records(stream, fmt):
+    """
+    Yield (line number, record dict) pairs from a CSV or NDJSON text stream
+    without reading it all into memory
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield line_number, record if isinstance(record, dict) else None
+    else:
+        raise ValueError(f"Unsupported import format '{fmt}'")
+
+
+def validate_record(record):
+    """
+    Return the cleaned user values of a record and a dict of field errors
+    """
+    if record is None:
+        return None, {'non_field_errors': ['Malformed record.']}
+    
+    errors = {}
+    values = {}
+    for field in REQUIRED_FIELDS + OPTIONAL_FIELDS:
+        value = record.get(field)
+        if value is not None and not isinstance(value, str):
+            # NDJSON values may be numbers, lists or objects
+            errors[field] = ['Not a valid string.']
+            values[field] = None
+            continue
+        value = (value or '').strip()
+        if not value and field in REQUIRED_FIELDS:
+            errors[field] = ['This field is required.']
+        values[field] = value or None
+    
+    if values['email']:
+        values['email'] = values['email'].lower()
+        try:
+            validate_email(values['email'])
+        except ValidationError as e:
+            errors['email'] = e.messages
+    
+    for field in ('username', 'first_name', 'last_name', 'phone_number'):
+        max_length = User._meta.get_field(field).max_length
+        if values[field] and len(values[field]) > max_length:
+            errors[field] = [f'Ensure this field has no more than {max_length} characters.']
+    
+    return values, errors
+
+
+class UserImporter:
+    """
+    Import users in chunks from a CSV or NDJSON stream.
+    
+    Each chunk is validated in memory with one query per unique field,
+    password hashing is fanned out over a process pool, and the users (on
+    trial, as after registration), their Subscription rows and their
+    trial_started history rows are written with bulk_create. Invalid rows
+    are reported through ``on_error`` instead of aborting the import; if a
+    concurrent signup makes the bulk insert conflict, the chunk is inserted
+    row by row so only the conflicting rows fail.
+    """
+    
+    def __init__(self, chunk_size=None, workers=None, on_error=None):
+        self.chunk_size = chunk_size or settings.USER_IMPORT_CHUNK_SIZE
+        self.workers = workers or settings.USER_IMPORT_WORKERS
+        self.on_error = on_error or (lambda line, errors: None)
+        self.seen_emails = set()
+        self.seen_usernames = set()
+        self.totals = {'created': 0, 'failed': 0}
+    
+    def run(self, stream, fmt):
+        records = iter_records(stream, fmt)
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker) as pool:
+            while True:
+                chunk = list(islice(records, self.chunk_size))
+                if not chunk:
+                    break
+                self.import_chunk(chunk, pool)
+        return self.totals
+    
+    def fail(self, line, errors):
+        self.totals['failed'] += 1
+        self.on_error(line, errors)
+    
+    def import_chunk(self, chunk, pool):
+        valid = []
+        for line, record in chunk:
+            values, errors = validate_record(record)
+            if errors:
+                self.fail(line, errors)
+            else:
+                valid.append((line, values))
+        
+        # Stored emails are not necessarily lowercase; compare them
+        # case-insensitively, as user_email_upper_idx allows
+        taken_emails = {
+            email.lower() for email in User.objects.annotate(email_upper=Upper('email')).filter(
+                email_upper__in=[values['email'].upper() for _, values in valid]
+            ).values_list('email', flat=True)
+        }
+        taken_usernames = set(User.objects.filter(
+            username__in=[values['username'] for _, values in valid]
+        ).values_list('username', flat=True))
+        
+        rows = []
+        for line, values in valid:
+            errors = {}
+            if values['email'] in taken_emails or values['email'] in self.seen_emails:
+                errors['email'] = ['User with this email address already exists.']
+            if values['username'] in taken_usernames or values['username'] in self.seen_usernames:
+                errors['username'] = ['A user with that username already exists.']
+            if errors:
+                self.fail(line, errors)
+                continue
+            self.seen_emails.add(values['email'])
+            self.seen_usernames.add(values['username'])
+            rows.append((line, values))
+        
+        if not rows:
+            return
+        
+        passwords = pool.map(make_password, [values['password'] for _, values in rows],
+                             chunksize=max(1, len(rows) // (self.workers * 4)))
+        
+        rows = [(line, values, password) for (line, values), password in zip(rows, passwords)]
+        try:
+            with transaction.atomic():
+                self.insert(rows)
+        except IntegrityError:
+            # A concurrent signup took one of the emails or usernames
+            self.insert_each(rows)
+            return
+        
+        self.totals['created'] += len(rows)
+    
+    def insert(self, rows):
+        """
+        Bulk insert the users of (line, values, password) rows on trial,
+        with their subscription and trial_started history rows
+        """
+        now = timezone.now()
+        users = User.objects.bulk_create([
+            User(
+                email=values['email'],
+                username=values['username'],
+                first_name=values['first_name'],
+                last_name=values['last_name'],
+                phone_number=values['phone_number'],
+                password=password,
+                is_on_trial=True,
+                trial_start_date=now,
+                trial_end_date=calculate_trial_end_date(now),
+                subscription_status='trial',
+            )
+            for _, values, password in rows
+        ])
+        subscriptions = Subscription.objects.bulk_create(
+            [Subscription(user=user) for user in users]
+        )
+        SubscriptionHistory.objects.bulk_create([
+            SubscriptionHistory(
+                subscription=subscription,
+                action='trial_started',
+                new_plan='free',
+                notes='30-day free trial started'
+            )
+            for subscription in subscriptions
+        ])
+    
+    def insert_each(self, rows):
+        """
+        Insert rows one at a time, each under a savepoint, failing only the
+        rows that conflict with existing users
+        """
+        with transaction.atomic():
+            for row in rows:
+                try:
+                    with transaction.atomic():
+                        self.insert([row])
+                except IntegrityError:
+                    self.fail(row[0], {'non_field_errors': ['User with this email address or username already exists.']})
+                else:
+                    self.totals['created'] += 1
+
+
+def import_users(stream, fmt, max_errors=None, **options):
+    """
+    Import users from a text stream, returning the totals and the per-row
+    errors, of which only the first ``max_errors`` are kept when it is set
+    """
+    errors = []
+    
+    def on_error(line, row_errors):
+        if max_errors is None or len(errors) < max_errors:
+            errors.append({'line': line, 'errors': row_errors})
+    
+    importer = UserImporter(on_error=on_error, **options)
+    return importer.run(stream, fmt), errors
@@ -0,0 +1,52 @@
+import json
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.users.importer import UserImporter
+
+
+class Command(BaseCommand):
+    help = (
+        'Import users from a CSV or NDJSON file, starting each one on a trial, '
+        'and report rows that could not be imported'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import, or '-' for stdin")
+        parser.add_argument('--format', choices=('csv', 'ndjson'),
+                            help='Input format (defaults to the file extension)')
+        parser.add_argument('--chunk-size', type=int, help='Rows validated and inserted together')
+        parser.add_argument('--workers', type=int, help='Password hashing processes')
+        parser.add_argument('--errors', help='Write the per-row error report (NDJSON) to this file')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        if fmt not in ('csv', 'ndjson'):
+            raise CommandError('Pass --format csv or --format ndjson')
+        
+        report = open(options['errors'], 'w') if options['errors'] else self.stderr
+        
+        def on_error(line, errors):
+            report.write(json.dumps({'line': line, 'errors': errors}) + '\n')
+        
+        importer = UserImporter(
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            on_error=on_error,
+        )
+        try:
+            if path == '-':
+                totals = importer.run(sys.stdin, fmt)
+            else:
+                with open(path, newline='', encoding='utf-8') as stream:
+                    totals = importer.run(stream, fmt)
+        finally:
+            if options['errors']:
+                report.close()
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['created']} users, {totals['failed']} rows failed"
+        ))
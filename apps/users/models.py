@@ -1,5 +1,6 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.db.models.functions import Upper
 from django.utils.translation import gettext_lazy as _
 
 
@@ -28,6 +29,9 @@ class User(AbstractUser):
         default='inactive'
     )
     razorpay_customer_id = models.CharField(max_length=100, blank=True, null=True)
+    # Incremented by every subscription state change; transitions only apply
+    # to the version they read (see apps.common.transitions)
+    state_version = models.PositiveIntegerField(default=0)
     
     # Use email as the username field
     USERNAME_FIELD = 'email'
@@ -36,25 +40,36 @@ class User(AbstractUser):
     class Meta:
         verbose_name = _('user')
         verbose_name_plural = _('users')
+        indexes = [
+            # Trial sweeps and reminders filter on these three columns together
+            models.Index(
+                fields=['subscription_status', 'is_on_trial', 'trial_end_date'],
+                name='user_trial_lifecycle_idx',
+            ),
+            # Only users still on trial are ever scanned by trial_end_date
+            models.Index(
+                fields=['trial_end_date'],
+                condition=models.Q(subscription_status='trial', is_on_trial=True),
+                name='user_trial_end_active_idx',
+            ),
+            # Case-insensitive email lookups (email__iexact), e.g. admin searches
+            models.Index(Upper('email'), name='user_email_upper_idx'),
+        ]
     
     def __str__(self):
         return self.email
     
     def start_trial(self):
         """Start the 30-day free trial for this user"""
-        from django.utils import timezone
-        import datetime
+        from apps.common.transitions import transition
         
-        self.is_on_trial = True
-        self.trial_start_date = timezone.now()
-        self.trial_end_date = self.trial_start_date + datetime.timedelta(days=30)
-        self.subscription_status = 'trial'
-        self.save()
+        return transition(self, 'start_trial')
     
     def cancel_subscription(self):
         """Cancel the user's subscription"""
-        self.subscription_status = 'cancelled'
-        self.save()
+        from apps.common.transitions import transition
+        
+        return transition(self, 'cancel')
     
     def is_trial_expired(self):
         """Check if the user's trial has expired"""
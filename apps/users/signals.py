@@ -1,9 +1,12 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 from django.conf import settings
 
 # Import your User model - adjust the import if needed
 from apps.users.models import User
+from apps.users.snapshots import invalidate_user_snapshots
+from apps.common.cache import bump_user_version
+from apps.common.models import Subscription, SubscriptionHistory
 
 
 @receiver(post_save, sender=User)
@@ -16,3 +19,38 @@ def create_user_profile(sender, instance, created, **kwargs):
         # You can add any post-user creation logic here
         # For example, creating a profile, sending welcome emails, etc.
         pass
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_cache(sender, instance, **kwargs):
+    """
+    Invalidate cached per-user responses and the authentication snapshot
+    when the user changes (including password changes and is_active flips)
+    """
+    bump_user_version(instance.pk)
+    invalidate_user_snapshots([instance.pk])
+
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def invalidate_subscription_cache(sender, instance, **kwargs):
+    """
+    Invalidate cached per-user responses when the user's subscription changes
+    """
+    bump_user_version(instance.user_id, instance.updated_at)
+
+
+@receiver(post_save, sender=SubscriptionHistory)
+@receiver(post_delete, sender=SubscriptionHistory)
+def invalidate_subscription_history_cache(sender, instance, **kwargs):
+    """
+    Invalidate cached per-user responses when the user's subscription history changes
+    """
+    if SubscriptionHistory.subscription.is_cached(instance):
+        user_id = instance.subscription.user_id
+    else:
+        user_id = Subscription.objects.filter(pk=instance.subscription_id).values_list('user_id', flat=True).first()
+    
+    if user_id is not None:
+        bump_user_version(user_id, instance.updated_at)
@@ -0,0 +1,180 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router, transaction
+
+from apps.common.utils import CacheStats
+from apps.users.models import User
+
+# Columns kept in a snapshot. The password hash is deliberately left out; it
+# is loaded lazily as a deferred field by the few views that need it.
+SNAPSHOT_FIELDS = (
+    'id', 'email', 'username', 'first_name', 'last_name', 'phone_number',
+    'profile_picture', 'is_active', 'is_staff', 'is_superuser', 'last_login',
+    'date_joined', 'is_on_trial', 'trial_start_date', 'trial_end_date',
+    'subscription_status', 'razorpay_customer_id', 'state_version',
+)
+
+
+class LocalSnapshotCache:
+    """
+    Thread-safe in-process LRU cache whose entries expire after a TTL
+    """
+    
+    def __init__(self, maxsize, timeout):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.timeout, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+snapshot_cache_stats = CacheStats(('local_hits', 'hits', 'misses'))
+
+local_snapshots = LocalSnapshotCache(
+    maxsize=settings.USER_SNAPSHOT_LOCAL_SIZE,
+    timeout=settings.USER_SNAPSHOT_LOCAL_TIMEOUT,
+)
+
+
+def _snapshot_key(user_id):
+    return f'user-snapshot:{user_id}'
+
+
+def _generation_key(user_id):
+    return f'user-snapshot-generation:{user_id}'
+
+
+def _stamp():
+    """Microsecond timestamp used as a snapshot generation"""
+    return time.time_ns() // 1000
+
+
+def get_user_snapshot(user_id):
+    """
+    Return the snapshot of a user's columns, reading through the local and
+    shared cache tiers before the database. Returns None for unknown users.
+    
+    Shared snapshots are tagged with the user's generation, read before the
+    database. Invalidation drops the generation, and the next reader stamps
+    a new one, so a snapshot read before an invalidation but stored after
+    it is never served.
+    """
+    snapshot = local_snapshots.get(user_id)
+    if snapshot is not None:
+        snapshot_cache_stats.incr('local_hits')
+        return snapshot
+    
+    key, generation_key = _snapshot_key(user_id), _generation_key(user_id)
+    cached = cache.get_many([key, generation_key])
+    generation, entry = cached.get(generation_key), cached.get(key)
+    if entry is not None and generation is not None and entry[0] == generation:
+        snapshot_cache_stats.incr('hits')
+        snapshot = entry[1]
+    else:
+        snapshot_cache_stats.incr('misses')
+        if generation is None:
+            cache.add(generation_key, _stamp(), timeout=None)
+            generation = cache.get(generation_key)
+        snapshot = User.objects.filter(pk=user_id).values(*SNAPSHOT_FIELDS).first()
+        if snapshot is None:
+            return None
+        if generation is not None:
+            cache.set(key, (generation, snapshot), timeout=settings.USER_SNAPSHOT_TIMEOUT)
+    
+    local_snapshots.set(user_id, snapshot)
+    return snapshot
+
+
+async def aget_user_snapshot(user_id):
+    """
+    Async counterpart of get_user_snapshot, using the async cache and ORM APIs
+    """
+    snapshot = local_snapshots.get(user_id)
+    if snapshot is not None:
+        snapshot_cache_stats.incr('local_hits')
+        return snapshot
+    
+    key, generation_key = _snapshot_key(user_id), _generation_key(user_id)
+    cached = await cache.aget_many([key, generation_key])
+    generation, entry = cached.get(generation_key), cached.get(key)
+    if entry is not None and generation is not None and entry[0] == generation:
+        snapshot_cache_stats.incr('hits')
+        snapshot = entry[1]
+    else:
+        snapshot_cache_stats.incr('misses')
+        if generation is None:
+            await cache.aadd(generation_key, _stamp(), timeout=None)
+            generation = await cache.aget(generation_key)
+        snapshot = await User.objects.filter(pk=user_id).values(*SNAPSHOT_FIELDS).afirst()
+        if snapshot is None:
+            return None
+        if generation is not None:
+            await cache.aset(key, (generation, snapshot), timeout=settings.USER_SNAPSHOT_TIMEOUT)
+    
+    local_snapshots.set(user_id, snapshot)
+    return snapshot
+
+
+def user_from_snapshot(snapshot):
+    """
+    Build a User instance from a snapshot as if it had been loaded with
+    ``only(*SNAPSHOT_FIELDS)``, so saving it only writes the snapshot columns
+    """
+    # from_db expects values in concrete field order
+    field_names = [
+        field.attname for field in User._meta.concrete_fields
+        if field.attname in snapshot
+    ]
+    return User.from_db(
+        router.db_for_read(User),
+        field_names,
+        [snapshot[name] for name in field_names],
+    )
+
+
+def invalidate_user_snapshots(user_ids):
+    """
+    Drop the users' snapshots from both cache tiers, and their generations,
+    once the current transaction commits
+    """
+    user_ids = list(user_ids)
+    
+    def invalidate():
+        for user_id in user_ids:
+            local_snapshots.delete(user_id)
+        cache.delete_many(
+            [_generation_key(user_id) for user_id in user_ids]
+            + [_snapshot_key(user_id) for user_id in user_ids]
+        )
+    
+    transaction.on_commit(invalidate)
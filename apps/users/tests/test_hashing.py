@@ -0,0 +1,68 @@
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+from django.contrib.auth.hashers import make_password
+
+from apps.users import hashing
+
+pytestmark = pytest.mark.django_db
+
+CREDENTIALS = {'email': 'ada@example.com', 'password': 'secret-pass-123'}
+
+
+@pytest.fixture
+def failing_pool(monkeypatch, settings):
+    """
+    Make pool operations running ``fn`` fail: ``broken`` as if a worker
+    process died, ``hung`` by never completing
+    """
+    settings.PASSWORD_HASHING_TIMEOUT = 0.05
+    submit = hashing.pool.submit
+
+    def fail(fn, mode):
+        def failing_submit(run, *args):
+            if run is not fn:
+                return submit(run, *args)
+            future = Future()
+            if mode == 'broken':
+                future.set_exception(BrokenProcessPool('A child process terminated abruptly'))
+            return future
+
+        monkeypatch.setattr(hashing.pool, 'submit', failing_submit)
+
+    return fail
+
+
+@pytest.mark.parametrize('mode', ['broken', 'hung'])
+@pytest.mark.parametrize('url', ['/api/v1/auth/login/', '/api/v1/async/auth/login/'])
+def test_failed_password_check_is_invalid_credentials(make_user, api_client, failing_pool, mode, url):
+    make_user(**CREDENTIALS)
+    failing_pool(hashing._check, mode)
+
+    response = api_client.post(url, CREDENTIALS, format='json')
+
+    assert response.status_code == 401, response.content
+
+
+def test_broken_pool_is_replaced(make_user, failing_pool):
+    user = make_user(**CREDENTIALS)
+    hashing.pool._get_executor()
+    failing_pool(hashing._check, 'broken')
+
+    assert hashing.check_password(user, CREDENTIALS['password']) is False
+    assert hashing.pool._pid is None
+
+
+def test_failed_password_hash_is_service_busy(make_user, auth_client, failing_pool):
+    user = make_user(**CREDENTIALS)
+    failing_pool(make_password, 'hung')
+
+    response = auth_client(user).post('/api/v1/users/change_password/', {
+        'old_password': CREDENTIALS['password'], 'new_password': 'new-pass-456', 'confirm_password': 'new-pass-456',
+    })
+
+    assert response.status_code == 503, response.content
+    assert response['Retry-After'] == '1'
+    user.refresh_from_db()
+    assert user.check_password(CREDENTIALS['password'])
@@ -0,0 +1,95 @@
+import io
+import json
+
+import pytest
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+
+from apps.users.importer import UserImporter, import_users
+from apps.users.models import User
+
+pytestmark = pytest.mark.django_db
+
+HEADER = 'email,username,first_name,last_name,password\n'
+
+
+def csv_of(*rows):
+    return HEADER + ''.join(f'{email},{username},Ada,Lovelace,secret-pass-123\n' for email, username in rows)
+
+
+def run_import(text):
+    return import_users(io.StringIO(text), 'csv', workers=1)
+
+
+def test_emails_are_compared_case_insensitively(make_user):
+    make_user(email='Taken@Example.com', username='taken')
+
+    totals, errors = run_import(csv_of(('taken@example.com', 'other'), ('new@example.com', 'new')))
+
+    assert totals == {'created': 1, 'failed': 1}
+    assert errors == [{'line': 2, 'errors': {'email': ['User with this email address already exists.']}}]
+
+
+def test_non_string_ndjson_values_fail_only_their_row():
+    lines = [
+        {'email': 'a@example.com', 'username': 123, 'first_name': 'Ada', 'last_name': 'Lovelace',
+         'password': 'secret-pass-123', 'phone_number': ['9876543210']},
+        {'email': 'b@example.com', 'username': 'beta', 'first_name': 'Ada', 'last_name': 'Lovelace',
+         'password': 'secret-pass-123'},
+    ]
+    text = ''.join(json.dumps(line) + '\n' for line in lines)
+
+    totals, errors = import_users(io.StringIO(text), 'ndjson', workers=1)
+
+    assert totals == {'created': 1, 'failed': 1}
+    assert errors == [{'line': 1, 'errors': {
+        'username': ['Not a valid string.'], 'phone_number': ['Not a valid string.'],
+    }}]
+    assert User.objects.filter(username='beta').exists()
+
+
+def test_conflicting_signup_fails_only_its_row(monkeypatch):
+    insert = UserImporter.insert
+
+    def insert_after_concurrent_signup(self, rows):
+        # A user registers one of the usernames between the check and the insert
+        if not User.objects.filter(username='racer').exists():
+            User.objects.create_user(email='racer@example.com', username='racer', password='x')
+        return insert(self, rows)
+
+    monkeypatch.setattr(UserImporter, 'insert', insert_after_concurrent_signup)
+
+    totals, errors = run_import(csv_of(('a@example.com', 'alpha'), ('b@example.com', 'racer'), ('c@example.com', 'gamma')))
+
+    assert totals == {'created': 2, 'failed': 1}
+    assert [error['line'] for error in errors] == [3]
+    assert set(User.objects.filter(is_on_trial=True).values_list('username', flat=True)) == {'alpha', 'gamma'}
+
+
+def test_uploads_are_imported_by_a_task(make_user, auth_client, settings, tmp_path, monkeypatch):
+    from apps.api import views
+
+    settings.MEDIA_ROOT = str(tmp_path / 'media')
+    results = {}
+
+    def delay(*args):
+        # Run the task inline and serve its result to the status view
+        result = views.import_users_file.apply(args)
+        results[result.id] = result
+        return result
+
+    monkeypatch.setattr(views.import_users_file, 'delay', delay)
+    monkeypatch.setattr(views, 'AsyncResult', lambda task_id: results[task_id])
+    client = auth_client(make_user(is_staff=True))
+    upload = SimpleUploadedFile('users.csv', csv_of(('a@example.com', 'alpha'), ('bad', 'beta')).encode())
+
+    response = client.post('/api/v1/users/import/', {'file': upload}, format='multipart')
+
+    assert response.status_code == 202, response.content
+    status = client.get(response.data['status_url'])
+    assert status.data['state'] == 'done'
+    assert status.data['created'] == 1
+    assert status.data['failed'] == 1
+    assert status.data['errors'][0]['line'] == 3
+    assert User.objects.filter(username='alpha').exists()
+    assert default_storage.listdir('imports') == ([], [])
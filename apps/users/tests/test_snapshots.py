@@ -0,0 +1,63 @@
+import pytest
+from asgiref.sync import async_to_sync
+from django.db import connection
+
+from apps.users.models import User
+from apps.users.snapshots import (
+    aget_user_snapshot,
+    get_user_snapshot,
+    invalidate_user_snapshots,
+    local_snapshots,
+)
+
+pytestmark = pytest.mark.django_db
+
+
+def update_during_snapshot_read(user, django_capture_on_commit_callbacks, **fields):
+    """
+    Execute wrapper that, right after the snapshot SELECT has read the
+    user, updates them and runs the invalidation a commit would trigger,
+    before the reader stores what it read
+    """
+    done = []
+
+    def wrapper(execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        if not done and sql.startswith('SELECT') and 'users_user' in sql:
+            done.append(True)
+            with django_capture_on_commit_callbacks(execute=True):
+                User.objects.filter(pk=user.pk).update(**fields)
+                invalidate_user_snapshots([user.pk])
+        return result
+
+    return wrapper
+
+
+@pytest.mark.parametrize('read', [get_user_snapshot, async_to_sync(aget_user_snapshot)], ids=['sync', 'async'])
+def test_snapshot_read_before_invalidation_is_not_served(read, make_user, django_capture_on_commit_callbacks):
+    user = make_user(subscription_status='trial', is_on_trial=True)
+
+    with connection.execute_wrapper(update_during_snapshot_read(
+        user, django_capture_on_commit_callbacks, subscription_status='cancelled', is_on_trial=False
+    )):
+        assert read(user.pk)['subscription_status'] == 'trial'
+
+    # Another process, without the local entry, must not get the stale snapshot
+    local_snapshots.clear()
+    assert read(user.pk)['subscription_status'] == 'cancelled'
+
+
+def test_snapshot_is_served_from_cache_until_invalidated(make_user, django_assert_num_queries, django_capture_on_commit_callbacks):
+    user = make_user()
+
+    with django_assert_num_queries(1):
+        get_user_snapshot(user.pk)
+    local_snapshots.clear()
+    with django_assert_num_queries(0):
+        assert get_user_snapshot(user.pk)['email'] == user.email
+
+    with django_capture_on_commit_callbacks(execute=True):
+        User.objects.filter(pk=user.pk).update(first_name='Renamed')
+        invalidate_user_snapshots([user.pk])
+    with django_assert_num_queries(1):
+        assert get_user_snapshot(user.pk)['first_name'] == 'Renamed'
@@ -0,0 +1,71 @@
+import pytest
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+
+@pytest.fixture(autouse=True, scope='session')
+def session_metrics_dir(tmp_path_factory):
+    """
+    Point metrics snapshots written outside any test, by the dumper thread
+    between tests or at exit, at a temporary directory
+    """
+    from django.conf import settings
+
+    settings.METRICS_DIR = str(tmp_path_factory.mktemp('metrics'))
+
+
+@pytest.fixture(autouse=True)
+def isolated_state(settings, tmp_path):
+    """
+    Fast password hashing, history written inline, per-test queue, metrics
+    and archive paths, and empty cache tiers for every test
+    """
+    from apps.users.snapshots import local_snapshots
+
+    settings.PASSWORD_HASHERS = ['django.contrib.auth.hashers.MD5PasswordHasher']
+    settings.AUDIT_WRITE_BEHIND = False
+    settings.AUDIT_QUEUE_PATH = str(tmp_path / 'audit-queue.sqlite3')
+    settings.METRICS_DIR = str(tmp_path / 'metrics')
+    settings.HISTORY_ARCHIVE_DIR = str(tmp_path / 'history-archive')
+    cache.clear()
+    local_snapshots.clear()
+    yield
+    cache.clear()
+    local_snapshots.clear()
+
+
+@pytest.fixture
+def make_user(db):
+    """
+    Create users with unique emails; extra fields are set on the model
+    """
+    counter = iter(range(1, 1_000_000))
+
+    def make(**fields):
+        n = next(counter)
+        fields.setdefault('email', f'user{n}@example.com')
+        fields.setdefault('username', f'user{n}')
+        password = fields.pop('password', 'secret-pass-123')
+        return get_user_model().objects.create_user(password=password, **fields)
+
+    return make
+
+
+@pytest.fixture
+def api_client():
+    return APIClient()
+
+
+@pytest.fixture
+def auth_client():
+    """
+    Return an APIClient authenticated with an access token for ``user``
+    """
+    def client_for(user):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+        return client
+
+    return client_for
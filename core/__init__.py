@@ -0,0 +1,5 @@
+# Load the Celery app with Django so shared tasks queued by the web
+# processes use its configuration
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
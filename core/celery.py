@@ -25,6 +25,22 @@ app.conf.beat_schedule = {
         'task': 'apps.common.tasks.send_trial_expiration_reminders',
         'schedule': crontab(hour='*/6'),  # Run every 6 hours
     },
+    'process-webhook-events': {
+        'task': 'apps.common.tasks.process_webhook_events',
+        'schedule': 10.0,  # Run every 10 seconds
+    },
+    'rollup-subscription-analytics': {
+        'task': 'apps.common.tasks.rollup_subscription_analytics',
+        'schedule': crontab(minute='*/15'),  # Run every 15 minutes
+    },
+    'create-subscription-history-partitions': {
+        'task': 'apps.common.tasks.create_subscription_history_partitions',
+        'schedule': crontab(hour=1, minute=0),  # Run at 1 AM every day
+    },
+    'archive-subscription-history-partitions': {
+        'task': 'apps.common.tasks.archive_subscription_history_partitions',
+        'schedule': crontab(hour=2, minute=0),  # Run at 2 AM every day
+    },
 }
 
 @app.task(bind=True, ignore_result=True)
@@ -61,13 +61,40 @@ MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',  # CORS middleware
+    'apps.api.middleware.LoadSheddingMiddleware',  # Adaptive per-route-class concurrency limits
+    'apps.api.middleware.MetricsMiddleware',  # Per-view request metrics for /metrics
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'apps.api.middleware.QueryBudgetMiddleware',  # Per-view query budgets (DEBUG only)
 ]
 
+# Adaptive load shedding: concurrent requests a process admits across route
+# classes, bounds of each class's adaptive limit, the latency over the
+# no-load latency that counts as congestion, and the backoff applied to it
+LOAD_SHEDDING_ENABLED = os.environ.get('LOAD_SHEDDING_ENABLED', 'True') == 'True'
+LOAD_SHEDDING_CAPACITY = int(os.environ.get('LOAD_SHEDDING_CAPACITY', 64))
+LOAD_SHEDDING_INITIAL_LIMIT = int(os.environ.get('LOAD_SHEDDING_INITIAL_LIMIT', 16))
+LOAD_SHEDDING_MIN_LIMIT = int(os.environ.get('LOAD_SHEDDING_MIN_LIMIT', 2))
+LOAD_SHEDDING_MAX_LIMIT = int(os.environ.get('LOAD_SHEDDING_MAX_LIMIT', 64))
+LOAD_SHEDDING_LATENCY_TOLERANCE = float(os.environ.get('LOAD_SHEDDING_LATENCY_TOLERANCE', 2.0))
+LOAD_SHEDDING_BACKOFF = float(os.environ.get('LOAD_SHEDDING_BACKOFF', 0.9))
+LOAD_SHEDDING_RETRY_AFTER = int(os.environ.get('LOAD_SHEDDING_RETRY_AFTER', 1))  # Seconds
+LOAD_SHEDDING_MAX_QUEUE_TIME = float(os.environ.get('LOAD_SHEDDING_MAX_QUEUE_TIME', 1.0))  # Seconds waited behind the proxy (X-Request-Start)
+
+# Request metrics: per-process snapshots are written to METRICS_DIR every
+# METRICS_DUMP_INTERVAL seconds and merged by /metrics, which requires
+# METRICS_TOKEN as a bearer token, and is closed without one unless DEBUG
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True') == 'True'
+METRICS_DIR = os.environ.get('METRICS_DIR', os.path.join(BASE_DIR, 'var', 'metrics'))
+METRICS_DUMP_INTERVAL = float(os.environ.get('METRICS_DUMP_INTERVAL', 5))
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+# Raise instead of logging when a view exceeds its declared query budget
+QUERY_BUDGET_STRICT = os.environ.get('QUERY_BUDGET_STRICT', 'False') == 'True'
+
 ROOT_URLCONF = 'core.urls'
 
 TEMPLATES = [
@@ -154,10 +181,19 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # Custom User Model
 AUTH_USER_MODEL = 'users.User'
 
+# Check passwords on the password hashing pool (apps.users.hashing)
+AUTHENTICATION_BACKENDS = ['apps.users.backends.PooledModelBackend']
+
+# Password hashing pool: worker processes, operations queued or running per
+# web process before requests are shed with a 503, and seconds to wait for one
+PASSWORD_HASHING_WORKERS = int(os.environ.get('PASSWORD_HASHING_WORKERS', os.cpu_count() or 1))
+PASSWORD_HASHING_MAX_PENDING = int(os.environ.get('PASSWORD_HASHING_MAX_PENDING', 32))
+PASSWORD_HASHING_TIMEOUT = float(os.environ.get('PASSWORD_HASHING_TIMEOUT', 10))
+
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apps.api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -174,6 +210,7 @@ REST_FRAMEWORK = {
         'rest_framework.renderers.JSONRenderer',
         'rest_framework.renderers.BrowsableAPIRenderer',
     ),
+    'EXCEPTION_HANDLER': 'apps.api.exceptions.exception_handler',
 }
 
 # JWT Settings
@@ -217,6 +254,51 @@ CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 
+# Cache Settings (shared by all workers so per-user versions stay consistent)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.environ.get('CACHE_URL', 'redis://localhost:6379/1'),
+    }
+}
+
+# Seconds a per-user cached response is kept for an unchanged version
+USER_RESPONSE_CACHE_TIMEOUT = int(os.environ.get('USER_RESPONSE_CACHE_TIMEOUT', 60 * 60 * 24))
+
+# Authenticated user snapshots: an in-process LRU (entries, seconds) in front
+# of the shared cache (seconds)
+USER_SNAPSHOT_LOCAL_SIZE = int(os.environ.get('USER_SNAPSHOT_LOCAL_SIZE', 10000))
+USER_SNAPSHOT_LOCAL_TIMEOUT = int(os.environ.get('USER_SNAPSHOT_LOCAL_TIMEOUT', 5))
+USER_SNAPSHOT_TIMEOUT = int(os.environ.get('USER_SNAPSHOT_TIMEOUT', 60 * 5))
+
+# Bulk user import
+USER_IMPORT_CHUNK_SIZE = int(os.environ.get('USER_IMPORT_CHUNK_SIZE', 1000))  # Rows validated and inserted together
+USER_IMPORT_WORKERS = int(os.environ.get('USER_IMPORT_WORKERS', os.cpu_count() or 1))  # Password hashing processes
+USER_IMPORT_MAX_REPORTED_ERRORS = int(os.environ.get('USER_IMPORT_MAX_REPORTED_ERRORS', 1000))  # Row errors kept in an upload's result
+
+# Streaming exports: rows fetched per server-side cursor round trip
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 2000))
+
+# Subscription analytics rollup: history rows folded in per transaction, and
+# seconds a history row must age before it is folded in
+ANALYTICS_ROLLUP_BATCH_SIZE = int(os.environ.get('ANALYTICS_ROLLUP_BATCH_SIZE', 5000))
+ANALYTICS_ROLLUP_LAG = int(os.environ.get('ANALYTICS_ROLLUP_LAG', 60))
+
+# Write-behind subscription history: events are buffered per process, spooled
+# to a SQLite queue on the host and written in multi-row inserts
+AUDIT_WRITE_BEHIND = os.environ.get('AUDIT_WRITE_BEHIND', 'True') == 'True'
+AUDIT_QUEUE_PATH = os.environ.get('AUDIT_QUEUE_PATH', os.path.join(BASE_DIR, 'var', 'audit-queue.sqlite3'))
+AUDIT_FLUSH_INTERVAL = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 0.5))  # Seconds between flushes
+AUDIT_BUFFER_SIZE = int(os.environ.get('AUDIT_BUFFER_SIZE', 100))  # Buffered events that trigger an early flush
+AUDIT_FLUSH_BATCH_SIZE = int(os.environ.get('AUDIT_FLUSH_BATCH_SIZE', 500))  # Events per multi-row insert
+AUDIT_PENDING_TIMEOUT = int(os.environ.get('AUDIT_PENDING_TIMEOUT', 60 * 10))  # Seconds unwritten events stay readable
+
+# Monthly partitions of subscription history (PostgreSQL): months created
+# ahead of time, and months kept before a partition is archived and dropped
+HISTORY_PARTITION_MONTHS_AHEAD = int(os.environ.get('HISTORY_PARTITION_MONTHS_AHEAD', 3))
+HISTORY_ARCHIVE_AFTER_MONTHS = int(os.environ.get('HISTORY_ARCHIVE_AFTER_MONTHS', 12))
+HISTORY_ARCHIVE_DIR = os.environ.get('HISTORY_ARCHIVE_DIR', os.path.join(BASE_DIR, 'var', 'history-archive'))
+
 # Swagger Settings
 SWAGGER_SETTINGS = {
     'SECURITY_DEFINITIONS': {
@@ -231,6 +313,24 @@ SWAGGER_SETTINGS = {
 # Razorpay Settings (for subscription management)
 RAZORPAY_KEY_ID = os.environ.get('RAZORPAY_KEY_ID', '')
 RAZORPAY_KEY_SECRET = os.environ.get('RAZORPAY_KEY_SECRET', '')
+RAZORPAY_WEBHOOK_SECRET = os.environ.get('RAZORPAY_WEBHOOK_SECRET', '')
+RAZORPAY_BASE_URL = os.environ.get('RAZORPAY_BASE_URL', 'https://api.razorpay.com')
+RAZORPAY_POOL_SIZE = int(os.environ.get('RAZORPAY_POOL_SIZE', 10))  # Keep-alive connections per process
+RAZORPAY_CONNECT_TIMEOUT = float(os.environ.get('RAZORPAY_CONNECT_TIMEOUT', 3.05))  # Seconds
+RAZORPAY_READ_TIMEOUT = float(os.environ.get('RAZORPAY_READ_TIMEOUT', 10))  # Seconds
+RAZORPAY_MAX_RETRIES = int(os.environ.get('RAZORPAY_MAX_RETRIES', 2))  # Idempotent calls only
+RAZORPAY_RETRY_BASE_DELAY = float(os.environ.get('RAZORPAY_RETRY_BASE_DELAY', 0.2))  # Seconds
+RAZORPAY_RETRY_MAX_DELAY = float(os.environ.get('RAZORPAY_RETRY_MAX_DELAY', 2))  # Seconds
+RAZORPAY_BREAKER_THRESHOLD = int(os.environ.get('RAZORPAY_BREAKER_THRESHOLD', 5))  # Consecutive failures
+RAZORPAY_BREAKER_RESET_TIMEOUT = float(os.environ.get('RAZORPAY_BREAKER_RESET_TIMEOUT', 30))  # Seconds
+RAZORPAY_SUBSCRIPTION_CACHE_TTL = int(os.environ.get('RAZORPAY_SUBSCRIPTION_CACHE_TTL', 60))  # Seconds fetched subscriptions are fresh
+RAZORPAY_SUBSCRIPTION_CACHE_STALE = int(os.environ.get('RAZORPAY_SUBSCRIPTION_CACHE_STALE', 600))  # Seconds they may then be served stale
+PLAN_CATALOG_TIMEOUT = int(os.environ.get('PLAN_CATALOG_TIMEOUT', 300))  # Seconds the plan catalog is served from memory
+
+# Razorpay batch jobs (reconciliation, customer backfill)
+RAZORPAY_BATCH_WORKERS = int(os.environ.get('RAZORPAY_BATCH_WORKERS', 8))  # Concurrent gateway calls
+RAZORPAY_BATCH_RATE = float(os.environ.get('RAZORPAY_BATCH_RATE', 20))  # Requests per second
+RAZORPAY_BATCH_CHUNK_SIZE = int(os.environ.get('RAZORPAY_BATCH_CHUNK_SIZE', 500))  # Rows per checkpoint
 
 # Logging configuration
 LOGGING = {
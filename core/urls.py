@@ -22,6 +22,8 @@ from rest_framework import permissions
 from drf_yasg.views import get_schema_view
 from drf_yasg import openapi
 
+from apps.api.metrics import metrics_view
+
 # Schema view for Swagger documentation
 schema_view = get_schema_view(
     openapi.Info(
@@ -43,6 +45,9 @@ urlpatterns = [
     # API endpoints
     path('api/v1/', include('apps.api.urls')),
     
+    # Prometheus metrics, merged across the worker processes of this host
+    path('metrics', metrics_view, name='metrics'),
+    
     # Swagger documentation
     path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
     path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),